@@ -1,4 +1,9 @@
+import contextlib
+import hashlib
+import io
 import os
+import threading
+import time
 import face_recognition
 from dotenv import load_dotenv
 
@@ -6,9 +11,13 @@ load_dotenv()
 
 from PIL import Image
 import numpy as np
-from typing import List, Dict, Any, Tuple
-import pickle
+from typing import List, Dict, Any, Tuple, Optional, Sequence, Union, NamedTuple
 from models import Student
+import roster_store
+from roster_index import RosterIndex
+from search_backends import make_backend
+from matching import match_faces, DEFAULT_TOLERANCE, UNKNOWN
+from face_templates import build_roster, build_template
 
 
 # Configure Gemini - REMOVED per user request
@@ -17,28 +26,53 @@ from models import Student
 
 
 # In-memory storage for face encodings (for simplicity in this MVP)
-# In production, use Vector DB
-known_face_encodings = []
-known_face_ids = []
+# The roster index is seeded from the packed roster store (zero-copy) and then
+# updated one student at a time by the API.
+# ROSTER_SEARCH_BACKEND picks exact (default) or approximate search.
+roster = RosterIndex(backend=make_backend())
 
-def load_roster_embeddings(students: List[Student]):
-    global known_face_encodings, known_face_ids
-    known_face_encodings = []
-    known_face_ids = []
-    
+def load_roster_embeddings(students: List[Student], compact: bool = True):
+    """
+    Full rebuild of the roster index from the store. Only needed at startup,
+    on explicit reload, or when the index is found to be corrupt. Raises
+    RosterCorruptionError if the rebuilt index fails verification.
+    Pass compact=False from read-only consumers (inference workers) so only
+    the API process ever rewrites the store.
+    """
     print(f"Loading embeddings for {len(students)} students...")
     
-    for student in students:
-        if student.face_encoding_path and os.path.exists(student.face_encoding_path):
-            try:
-                with open(student.face_encoding_path, 'rb') as f:
-                    encoding = pickle.load(f)
-                    known_face_encodings.append(encoding)
-                    known_face_ids.append(student.id)
-            except Exception as e:
-                print(f"Error loading encoding for {student.name}: {e}")
+    legacy = [s for s in students if s.face_encoding_path and s.face_encoding_path.endswith(".pkl")]
+    if legacy:
+        print(f"Warning: {len(legacy)} students still use per-student pickles. Run migrate_roster_store.py to load them.")
+    
+    student_ids = [s.id for s in students]
+    stores = []
+    for files in (roster_store.PRIMARY, roster_store.SAMPLES):
+        if compact:
+            # Compaction only rewrites the store when rows are stale; otherwise this is a zero-copy map.
+            ids, embeddings = roster_store.compact_store(student_ids, files)
+        else:
+            ids, embeddings = roster_store.load_store(files)
+            rows = roster_store.kept_rows(ids, student_ids, files)
+            if len(rows) != len(ids):
+                ids, embeddings = ids[rows], embeddings[rows]
+        stores.append((ids, embeddings))
+    # Students with extra enrollment photos are indexed as a template (see face_templates.py)
+    (ids, embeddings), (sample_ids, sample_embeddings) = stores
+    roster.rebuild(*build_roster(ids, embeddings, sample_ids, sample_embeddings))
+    # A damaged store would otherwise only show up as wrong matches. Array ops
+    # only (~20 ms per 100k rows), cheap next to loading the store.
+    roster.verify()
 
-def register_face(student_id: int, image_path: str):
+def encode_face(image_path: str, retry_upsample: bool = True,
+                raise_errors: bool = False) -> Optional[np.ndarray]:
+    """
+    Computes the 128-d encoding of the first face in an enrollment photo.
+    Returns None if no face is found. retry_upsample=False skips the slow
+    second pass at 2x upsampling for photos where no face was found.
+    raise_errors=True re-raises failures (unreadable file, I/O error)
+    instead of reporting them as no face, for callers that retry them.
+    """
     if not face_recognition:
         raise Exception("Face Recognition Engine is unavailable.")
 
@@ -49,7 +83,7 @@ def register_face(student_id: int, image_path: str):
         locations = face_recognition.face_locations(image)
         
         # 2. If fail, attempt with upsampling (helps for smaller faces or high-res images)
-        if not locations:
+        if not locations and retry_upsample:
             print(f"  [INFO] No face found with default. Retrying with upsample=2...")
             locations = face_recognition.face_locations(image, number_of_times_to_upsample=2)
             
@@ -63,94 +97,537 @@ def register_face(student_id: int, image_path: str):
              return None
         
         # We take the first face found
-        encoding = encodings[0]
-        encoding_path = f"static/roster/{student_id}_encoding.pkl"
-        with open(encoding_path, 'wb') as f:
-            pickle.dump(encoding, f)
-        return encoding_path
+        return encodings[0]
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Face Rec Error: {e}")
         return None
 
-def recognize_faces(image_path: str) -> Tuple[List[int], int]:
+def student_samples(student_id: int) -> np.ndarray:
+    """
+    All enrollment embeddings of one student: the primary one first, then any
+    extra samples. Scans the store's ID columns (memory-mapped, vectorized).
+    """
+    samples = []
+    for files in (roster_store.PRIMARY, roster_store.SAMPLES):
+        ids, embeddings = roster_store.load_store(files)
+        rows = np.flatnonzero(ids == student_id)
+        if files == roster_store.PRIMARY:
+            rows = rows[-1:]
+        samples.append(np.array(embeddings[rows]))
+    return np.concatenate(samples)
+
+def add_face_sample(student_id: int, encoding) -> np.ndarray:
+    """
+    Stores an extra enrollment sample for a student and returns their updated
+    template, ready for roster.add.
+    """
+    roster_store.append_embedding(student_id, encoding, files=roster_store.SAMPLES)
+    return build_template(student_samples(student_id))
+
+def register_face(student_id: int, image_path: str):
+    """
+    Encodes the enrollment photo and appends it to the roster store under the
+    student's DB id. Returns the store path, or None if no face was found.
+    """
+    encoding = encode_face(image_path)
+    if encoding is None:
+        return None
+    return roster_store.append_embedding(student_id, encoding)
+
+def decode_image(data: bytes) -> np.ndarray:
+    """
+    Decodes uploaded image bytes once into an (H, W, 3) uint8 RGB array, the
+    same thing face_recognition.load_image_file produces from a path.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image.convert('RGB'))
+
+# --- Face Detection ---
+# "full" runs HOG on the full-resolution image. "adaptive" runs it on a copy
+# downscaled so the smallest expected face is just above what HOG can find,
+# then maps boxes back and encodes on the full-resolution image. "tiled" is
+# for large lecture halls: overlapping tiles, upsampled only where faces are
+# small, plus one cheap downscaled pass for faces too big for a tile's overlap.
+DETECTION_MODES = ("full", "adaptive", "tiled")
+DEFAULT_DETECTION_MODE = os.environ.get("DETECTION_MODE", "full")
+# Smallest face width (px, in the original photo) we expect to need to find
+EXPECTED_FACE_PX = int(os.environ.get("EXPECTED_FACE_PX", "120"))
+# dlib's HOG window is 80px; face_locations upsamples once, so ~40px faces are
+# the floor. Aim a little above it.
+HOG_MIN_FACE_PX = 50
+# Adaptive detection never shrinks an image's long side below this: faces in
+# small or low-res photos are small too, whatever EXPECTED_FACE_PX says
+ADAPTIVE_MIN_SIDE = int(os.environ.get("ADAPTIVE_MIN_SIDE", "1024"))
+# A milder downscale than this saves too little to risk missing faces
+MIN_USEFUL_DOWNSCALE = 0.8
+
+def detection_scale(image_shape: Optional[Tuple[int, ...]] = None,
+                    expected_face_px: int = EXPECTED_FACE_PX) -> float:
+    """
+    Downscale factor (<= 1) for adaptive detection of an image of this
+    (height, width, ...) shape; without a shape, the face-size bound alone.
+    """
+    if expected_face_px <= 0:
+        return 1.0
+    scale = HOG_MIN_FACE_PX / expected_face_px
+    if image_shape is not None:
+        scale = max(scale, ADAPTIVE_MIN_SIDE / max(image_shape[:2]))
+    return scale if scale < MIN_USEFUL_DOWNSCALE else 1.0
+
+def detect_faces(image: np.ndarray, mode: str = DEFAULT_DETECTION_MODE,
+                 expected_face_px: int = EXPECTED_FACE_PX) -> List[Tuple[int, int, int, int]]:
+    """
+    Returns face boxes as (top, right, bottom, left) in full-resolution pixels.
+    """
+    if mode not in DETECTION_MODES:
+        raise ValueError(f"Unknown detection mode: {mode}")
+    
+    if mode == "tiled":
+        return detect_faces_tiled(image)
+    
+    scale = detection_scale(image.shape, expected_face_px) if mode == "adaptive" else 1.0
+    if scale >= 1.0:
+        # Use HOG model (faster) or cnn (slower but accurate)
+        return face_recognition.face_locations(image)
+    
+    height, width = image.shape[:2]
+    small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small = np.asarray(Image.fromarray(image).resize(small_size, Image.Resampling.BOX))
+    locations = face_recognition.face_locations(small)
+    
+    sx, sy = width / small_size[0], height / small_size[1]
+    return [
+        (max(0, int(top * sy)), min(width, int(round(right * sx))),
+         min(height, int(round(bottom * sy))), max(0, int(left * sx)))
+        for top, right, bottom, left in locations
+    ]
+
+# Tiled detection settings
+TILE_SIZE = int(os.environ.get("TILE_SIZE", "1024"))
+# Every face narrower than the overlap lies whole inside at least one tile
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", "200"))
+# Tiles whose smallest face is below this are re-run at upsample=2, and so are
+# empty tiles next to them (the back rows usually continue across the tile edge)
+SMALL_FACE_PX = 80
+# Empty tiles with no such neighbour are re-run only if nothing was found
+# anywhere, and then at most this many, most detailed first
+TILE_BLIND_RETRIES = int(os.environ.get("TILE_BLIND_RETRIES", "2"))
+# HOG window size: the smallest face found at upsample=0
+HOG_WINDOW_PX = 80
+
+# (y0, x0, y1, x1, scale, upsample): a region of the image, the scale it is
+# detected at, and the number of upsampling passes at full scale
+DetectionJob = Tuple[int, int, int, int, float, int]
+
+def tiled_detection_plan(image_shape: Tuple[int, ...], tile_size: int = TILE_SIZE,
+                         overlap: int = TILE_OVERLAP) -> List[DetectionJob]:
+    """
+    Independent detection jobs covering the image, so they can run in parallel.
+    The first job is a downscaled pass over the whole image for faces larger
+    than the overlap; the rest are full-resolution overlapping tiles. Tiles
+    that need it get a second, upsampled pass (see tiled_retry_plan).
+    """
+    height, width = image_shape[:2]
+    jobs: List[DetectionJob] = [(0, 0, height, width, min(1.0, HOG_WINDOW_PX / max(1, overlap)), 0)]
+    
+    stride = max(1, tile_size - overlap)
+    ys = list(range(0, max(1, height - overlap), stride))
+    xs = list(range(0, max(1, width - overlap), stride))
+    for y0 in ys:
+        for x0 in xs:
+            jobs.append((y0, x0, min(height, y0 + tile_size), min(width, x0 + tile_size), 1.0, 1))
+    return jobs
+
+def tiled_retry_plan(image: np.ndarray, jobs: List[DetectionJob],
+                     per_job: List[List[Tuple[int, int, int, int]]]) -> List[DetectionJob]:
+    """
+    Tiles worth a second pass at upsample=2, the most expensive detection
+    there is: tiles with small faces, empty tiles touching one of those, and,
+    only when no tile found anything, the TILE_BLIND_RETRIES most detailed
+    empty tiles. Mostly-empty images therefore cost about one pass.
+    """
+    tiles = [(job, boxes) for job, boxes in zip(jobs, per_job) if job[4] >= 1.0]
+    small = [job for job, boxes in tiles if boxes and min(b - t for t, _, b, _ in boxes) < SMALL_FACE_PX]
+    
+    def touches(a, b):
+        return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+    
+    retry = list(small)
+    retry += [job for job, boxes in tiles if not boxes and any(touches(job, other) for other in small)]
+    if not any(per_job) and TILE_BLIND_RETRIES > 0:
+        # Fine detail (a crowd) vs flat walls and ceiling, on a sparse sample of each tile
+        detail = [float(image[y0:y1:8, x0:x1:8].std()) for y0, x0, y1, x1, _, _ in (job for job, _ in tiles)]
+        ranked = sorted(range(len(tiles)), key=lambda i: -detail[i])
+        retry += [tiles[i][0] for i in ranked[:TILE_BLIND_RETRIES]]
+    return [(y0, x0, y1, x1, scale, 2) for y0, x0, y1, x1, scale, _ in retry]
+
+def run_detection_job(image: np.ndarray, job: DetectionJob) -> List[Tuple[int, int, int, int]]:
+    """
+    Detects faces in one job's region. Returns boxes in full-image coordinates.
+    """
+    y0, x0, y1, x1, scale, upsample = job
+    region = image[y0:y1, x0:x1]
+    
+    if scale < 1.0:
+        # Coarse pass: only big faces matter here, so no upsampling at all
+        height, width = region.shape[:2]
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small = np.asarray(Image.fromarray(region).resize(small_size, Image.Resampling.BOX))
+        sx, sy = width / small_size[0], height / small_size[1]
+        locations = [
+            (int(top * sy), int(round(right * sx)), int(round(bottom * sy)), int(left * sx))
+            for top, right, bottom, left in face_recognition.face_locations(small, number_of_times_to_upsample=0)
+        ]
+    else:
+        locations = face_recognition.face_locations(region, number_of_times_to_upsample=upsample)
+    
+    return [(top + y0, right + x0, bottom + y0, left + x0) for top, right, bottom, left in locations]
+
+def non_max_suppression(boxes: List[Tuple[int, int, int, int]], threshold: float = 0.5) -> List[Tuple[int, int, int, int]]:
+    """
+    Merges duplicate detections from overlapping tiles. HOG boxes carry no
+    score, so larger boxes win; overlap is measured against the smaller box so
+    a face cut off at a tile edge is suppressed by its whole copy.
+    """
+    if not boxes:
+        return []
+    b = np.array(boxes, dtype=np.float32)
+    top, right, bottom, left = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    areas = (bottom - top) * (right - left)
+    order = np.argsort(-areas)
+    keep = []
+    while len(order) > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_h = np.clip(np.minimum(bottom[i], bottom[rest]) - np.maximum(top[i], top[rest]), 0, None)
+        inter_w = np.clip(np.minimum(right[i], right[rest]) - np.maximum(left[i], left[rest]), 0, None)
+        overlap = inter_h * inter_w / np.maximum(np.minimum(areas[i], areas[rest]), 1)
+        order = rest[overlap <= threshold]
+    return [tuple(int(v) for v in boxes[i]) for i in sorted(keep)]
+
+def detect_faces_tiled(image: np.ndarray, map_fn=map) -> List[Tuple[int, int, int, int]]:
+    """
+    Tiled detection. map_fn(run, jobs) lets callers fan jobs out in parallel;
+    the inference pool does this across processes. Upsampled retries find
+    the same faces again plus smaller ones; suppression merges the copies.
+    """
+    jobs = tiled_detection_plan(image.shape)
+    per_job = list(map_fn(lambda job: run_detection_job(image, job), jobs))
+    retries = tiled_retry_plan(image, jobs, per_job)
+    per_job += list(map_fn(lambda job: run_detection_job(image, job), retries))
+    return non_max_suppression([box for boxes in per_job for box in boxes])
+
+# Bump when the face detector / encoder changes, so cached face results are not reused
+FACE_MODEL_VERSION = "dlib-hog-resnet128-v1"
+
+def face_cache_key(detection_mode: str) -> str:
+    """Identifies everything that determines detection boxes and encodings."""
+    key = f"{FACE_MODEL_VERSION}-{detection_mode}"
+    if detection_mode == "adaptive":
+        key += f"-{EXPECTED_FACE_PX}-{ADAPTIVE_MIN_SIDE}"
+    elif detection_mode == "tiled":
+        key += f"-{TILE_SIZE}x{TILE_OVERLAP}"
+    return key
+
+# A course-scoped upload matches faces against the enrolled students only;
+# faces left unknown are then looked up in the whole roster to spot students
+# from other courses (reported, not recorded). false skips that lookup.
+COURSE_FALLBACK_MATCH = os.environ.get("COURSE_FALLBACK_MATCH", "true").lower() not in ("0", "false", "no", "off")
+
+class FaceRecognition(NamedTuple):
+    recognized_ids: List[int]
+    unknown_count: int
+    # Students outside the upload's course, found by the fallback lookup
+    unenrolled_ids: List[int]
+    face_locations: List[Tuple[int, int, int, int]]
+    encodings: np.ndarray
+    roster_version: int
+    # Seconds per stage (detect / encode / match), for metrics in the API process
+    timings: Optional[Dict[str, float]] = None
+    # Set when recognition failed: the result is empty, not "no faces", and must not be cached
+    error: Optional[str] = None
+
+def match_encoding_ids(encodings: np.ndarray, scope: Optional[Sequence[int]] = None,
+                       tolerance: float = DEFAULT_TOLERANCE,
+                       one_to_one: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-face form of match_encodings: (Student ID or UNKNOWN, distance) for
+    each encoding. With `scope`, IDs from outside it are students found by
+    the fallback lookup. one_to_one=False lets several encodings match the
+    same student (see matching.match_faces).
+    """
+    encodings = np.asarray(encodings, dtype=np.float32)
+    with roster.lock:
+        if scope is None:
+            # One batched distance matrix + one-to-one assignment for all faces at once
+            return match_faces(encodings, roster.ids, roster.embeddings, tolerance=tolerance,
+                               backend=roster.backend, collapse=roster.row_count != len(roster),
+                               one_to_one=one_to_one)
+        # Exact search over the class's rows only: cost follows class size, not roster size
+        scope_ids, scope_embeddings = roster.subset(scope)
+        matched_ids, distances = match_faces(encodings, scope_ids, scope_embeddings, tolerance=tolerance,
+                                             one_to_one=one_to_one)
+        unmatched = np.flatnonzero(matched_ids == UNKNOWN)
+        if COURSE_FALLBACK_MATCH and len(unmatched):
+            others, other_distances = match_faces(encodings[unmatched], roster.ids, roster.embeddings,
+                                                  tolerance=tolerance, backend=roster.backend,
+                                                  collapse=roster.row_count != len(roster),
+                                                  one_to_one=one_to_one)
+            # An enrolled hit here was already claimed by a closer face in the scoped pass
+            outside = (others != UNKNOWN) & ~np.isin(others, np.asarray(scope, dtype=np.int64))
+            matched_ids[unmatched[outside]] = others[outside]
+            distances[unmatched[outside]] = other_distances[outside]
+    return matched_ids, distances
+
+def match_encodings(encodings: np.ndarray,
+                    scope: Optional[Sequence[int]] = None) -> Tuple[List[int], int, List[int]]:
     """
+    Matches already-computed face encodings against the current roster or,
+    with `scope` (a course's enrolled Student IDs), against just those students.
     Returns:
-        recognized_ids: List of Student IDs identified
+        recognized_ids: List of Student IDs identified (within scope, if given)
         unknown_count: Number of faces detected but NOT identified
+        unenrolled_ids: Students outside the scope identified by the fallback lookup
     """
+    total_faces = len(encodings)
+    matched_ids, _ = match_encoding_ids(encodings, scope)
+    matched = [int(i) for i in matched_ids if i != UNKNOWN]
+    enrolled = None if scope is None else {int(i) for i in scope}
+    recognized_ids = [i for i in matched if enrolled is None or i in enrolled]
+    unenrolled_ids = [i for i in matched if enrolled is not None and i not in enrolled]
+    # Assignment is one-to-one, so every face is either one distinct student or unknown
+    unknown_count = total_faces - len(recognized_ids) - len(unenrolled_ids)
+    
+    return recognized_ids, unknown_count, unenrolled_ids
+
+def recognize(image: Union[str, np.ndarray], detection_mode: str = DEFAULT_DETECTION_MODE,
+              face_locations: Optional[List[Tuple[int, int, int, int]]] = None,
+              scope: Optional[Sequence[int]] = None) -> FaceRecognition:
+    """
+    Detect, encode and match, keeping the intermediate boxes and encodings so
+    callers can cache them.
+    Accepts an image path or an already-decoded RGB array.
+    detection_mode: one of DETECTION_MODES.
+    face_locations: boxes already detected elsewhere (e.g. tiles run in parallel); skips detection.
+    scope: enrolled Student IDs of the upload's course (see match_encodings).
+    """
+    empty = FaceRecognition([], 0, [], [], np.empty((0, roster_store.EMBEDDING_DIM), dtype=np.float32), roster.version)
     if not face_recognition:
-        return [], 0
+        return empty._replace(error="Face Recognition Engine is unavailable.")
         
     try:
-       unknown_image = face_recognition.load_image_file(image_path)
-       # Use HOG model (faster) or cnn (slower but accurate)
-       face_locations = face_recognition.face_locations(unknown_image)
+       timings = {}
+       start = time.perf_counter()
+       unknown_image = face_recognition.load_image_file(image) if isinstance(image, str) else image
+       if face_locations is None:
+           face_locations = detect_faces(unknown_image, detection_mode)
+           timings["detect"] = time.perf_counter() - start
+       # Encodings always come from the full-resolution pixels
+       start = time.perf_counter()
        face_encodings = face_recognition.face_encodings(unknown_image, face_locations)
+       encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, roster_store.EMBEDDING_DIM)
+       timings["encode"] = time.perf_counter() - start
        
-       present_student_ids = []
-       total_faces = len(face_locations)
-       
-       if not known_face_encodings:
-           return [], total_faces
-
-       for face_encoding in face_encodings:
-           # Tolerance 0.6 is standard
-           matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=0.6)
-           face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-           
-           if len(matches) > 0:
-               best_match_index = np.argmin(face_distances)
-               if matches[best_match_index]:
-                   present_student_ids.append(known_face_ids[best_match_index])
-               
-       recognized_ids = list(set(present_student_ids))
-       unknown_count = total_faces - len(present_student_ids) 
-       # Note: if one person is matched twice (error), unknown might verify weirdly. 
-       # But generally correct for simple cases.
-       if unknown_count < 0: unknown_count = 0
-       
-       return recognized_ids, unknown_count
+       start = time.perf_counter()
+       with roster.lock:
+           version = roster.version
+           recognized_ids, unknown_count, unenrolled_ids = match_encodings(encodings, scope)
+       timings["match"] = time.perf_counter() - start
+       return FaceRecognition(recognized_ids, unknown_count, unenrolled_ids, list(face_locations), encodings,
+                              version, timings)
        
     except Exception as e:
         print(f"Face Rec Failed: {e}")
-        return [], 0
+        return empty._replace(error=str(e) or type(e).__name__)
+
+def recognize_faces(image: Union[str, np.ndarray], detection_mode: str = DEFAULT_DETECTION_MODE,
+                    face_locations: Optional[List[Tuple[int, int, int, int]]] = None) -> Tuple[List[int], int]:
+    """
+    Accepts an image path or an already-decoded RGB array.
+    Returns:
+        recognized_ids: List of Student IDs identified
+        unknown_count: Number of faces detected but NOT identified
+    """
+    result = recognize(image, detection_mode, face_locations)
+    return result.recognized_ids, result.unknown_count
 
 # --- AI / Vibe Analysis ---
 # Using Salesforce BLIP (Bootstrapping Language-Image Pre-training)
 # This runs LOCALLY and is free (no API limits).
-try:
-    from transformers import BlipProcessor, BlipForConditionalGeneration
+# The model is loaded on first use (or by the API's background warmup), so
+# scripts that never caption don't pay for it. CAPTIONING_ENABLED=false
+# turns captioning off entirely.
+BLIP_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+CAPTIONING_ENABLED = os.environ.get("CAPTIONING_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+
+# CPU inference profiles (CAPTION_PROFILE). benchmark_caption_profiles.py
+# compares latency, memory and caption agreement against "baseline":
+#   baseline    - fp32, default torch context (the original path)
+#   fp32        - fp32 under torch.inference_mode(); same captions, less overhead
+#   int8        - dynamic int8 quantization of every Linear layer (~1/4 of the
+#                 fp32 weight memory), under inference mode
+#   int8-traced - int8 plus a TorchScript-traced vision encoder
+CAPTION_PROFILES = {
+    "baseline": {"inference_mode": False, "quantize": False, "trace": False},
+    "fp32": {"inference_mode": True, "quantize": False, "trace": False},
+    "int8": {"inference_mode": True, "quantize": True, "trace": False},
+    "int8-traced": {"inference_mode": True, "quantize": True, "trace": True},
+}
+CAPTION_PROFILE = os.environ.get("CAPTION_PROFILE", "fp32")
+if CAPTION_PROFILE not in CAPTION_PROFILES:
+    print(f"Warning: unknown CAPTION_PROFILE '{CAPTION_PROFILE}', using fp32")
+    CAPTION_PROFILE = "fp32"
+
+# Intra-op threads for torch in this process; 0 leaves torch's default (all cores).
+# Inference workers pin this so several of them don't oversubscribe the CPU.
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", "0"))
+
+blip_processor = None
+blip_model = None
+_blip_lock = threading.Lock()
+_blip_load_error: Optional[str] = None
+
+def load_captioning_model() -> bool:
+    """
+    Loads BLIP once per process. Safe to call from several threads.
+    Returns True if the model is ready.
+    """
+    global blip_processor, blip_model, _blip_load_error
+    if not CAPTIONING_ENABLED:
+        return False
+    if blip_model is not None:
+        return True
+    
+    with _blip_lock:
+        if blip_model is None and _blip_load_error is None:
+            try:
+                from transformers import BlipProcessor, BlipForConditionalGeneration
+                
+                import torch
+                
+                if TORCH_THREADS > 0:
+                    torch.set_num_threads(TORCH_THREADS)
+                
+                print(f"Loading AI Model (BLIP, profile {CAPTION_PROFILE})...")
+                profile = CAPTION_PROFILES[CAPTION_PROFILE]
+                processor = BlipProcessor.from_pretrained(BLIP_MODEL_NAME)
+                model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL_NAME)
+                model.eval()
+                if profile["quantize"]:
+                    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                if profile["trace"]:
+                    _trace_vision_model(model, processor)
+                blip_processor, blip_model = processor, model
+                print("AI Model Loaded Successfully.")
+            except Exception as e:
+                print(f"Warning: Could not load local AI model: {e}")
+                _blip_load_error = str(e)
+    return blip_model is not None
+
+def _trace_vision_model(model, processor):
+    """
+    Swaps BLIP's vision encoder for a TorchScript trace of it. The encoder is
+    a fixed-shape ViT (every image is resized to the same input size), so one
+    trace covers all inputs; the text decoder loops over tokens and stays eager.
+    Falls back to the eager encoder if tracing fails.
+    """
     import torch
     
-    print("Loading AI Model (BLIP)...")
-    blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-    print("AI Model Loaded Successfully.")
-except Exception as e:
-    print(f"Warning: Could not load local AI model: {e}")
-    blip_processor = None
-    blip_model = None
+    size = processor.image_processor.size
+    example = torch.zeros(1, 3, size["height"], size["width"])
+    
+    class VisionEncoder(torch.nn.Module):
+        def __init__(self, vision_model):
+            super().__init__()
+            self.vision_model = vision_model
+        
+        def forward(self, pixel_values):
+            return self.vision_model(pixel_values=pixel_values, return_dict=False)
+    
+    class TracedVisionModel(torch.nn.Module):
+        # generate() calls vision_model(pixel_values=..., ...) and reads outputs[0]
+        def __init__(self, traced):
+            super().__init__()
+            self.traced = traced
+        
+        def forward(self, pixel_values=None, **kwargs):
+            return self.traced(pixel_values)
+    
+    try:
+        with torch.inference_mode():
+            traced = torch.jit.trace(VisionEncoder(model.vision_model).eval(), example, check_trace=False)
+            traced = torch.jit.freeze(traced)
+        model.vision_model = TracedVisionModel(traced)
+    except Exception as e:
+        print(f"Warning: Could not trace BLIP vision encoder, keeping eager: {e}")
+
+def captioning_status() -> str:
+    """One of: disabled, loaded, failed, not_loaded."""
+    if not CAPTIONING_ENABLED:
+        return "disabled"
+    if blip_model is not None:
+        return "loaded"
+    if _blip_load_error is not None:
+        return "failed"
+    return "not_loaded"
 
-def analyze_classroom_vibe(image_path: str) -> str:
+# Fallback texts; anything else is a real caption (and worth caching)
+CAPTION_DISABLED = "AI Analysis Disabled"
+CAPTION_UNAVAILABLE = "AI Analysis Unavailable (Model not loaded)"
+CAPTION_ERROR = "Error analyzing image."
+CAPTION_FALLBACKS = (CAPTION_DISABLED, CAPTION_UNAVAILABLE, CAPTION_ERROR)
+CAPTION_PROMPT = "a photography of a classroom with students"
+
+def caption_cache_key() -> str:
+    """Identifies everything that determines a caption."""
+    # Quantized profiles can word captions differently, so they don't share entries
+    precision = "int8" if CAPTION_PROFILES[CAPTION_PROFILE]["quantize"] else "fp32"
+    return f"{BLIP_MODEL_NAME.replace('/', '_')}-{precision}-{hashlib.sha1(CAPTION_PROMPT.encode()).hexdigest()[:8]}"
+
+def _inference_context():
+    import torch
+    if CAPTION_PROFILES[CAPTION_PROFILE]["inference_mode"]:
+        return torch.inference_mode()
+    return contextlib.nullcontext()
+
+def caption_images(images: List[Union[str, np.ndarray]]) -> List[str]:
     """
-    Generates a caption/vibe check for the classroom image using local BLIP model.
+    Captions several images with a single batched BLIP forward pass.
+    Accepts image paths and/or already-decoded RGB arrays; returns one
+    assessment per image, in order.
     """
-    if not blip_model or not blip_processor:
-        return "AI Analysis Unavailable (Model not loaded)"
+    if not CAPTIONING_ENABLED:
+        return [CAPTION_DISABLED] * len(images)
+    if not load_captioning_model():
+        return [CAPTION_UNAVAILABLE] * len(images)
+    if not images:
+        return []
         
     try:
-        image = Image.open(image_path).convert('RGB')
+        pil_images = [Image.open(image).convert('RGB') if isinstance(image, str) else Image.fromarray(image) for image in images]
         
         # Determine prompt based on context
-        text = "a photography of a classroom with students"
+        # (same prompt for every image, so the batch needs no padding)
+        text = [CAPTION_PROMPT] * len(pil_images)
         
-        inputs = blip_processor(image, text, return_tensors="pt")
+        inputs = blip_processor(pil_images, text, return_tensors="pt")
         
-        out = blip_model.generate(**inputs, max_new_tokens=50)
-        caption = blip_processor.decode(out[0], skip_special_tokens=True)
+        with _inference_context():
+            out = blip_model.generate(**inputs, max_new_tokens=50)
+        captions = blip_processor.batch_decode(out, skip_special_tokens=True)
         
         # Simple heuristic expansion to match "Vibe Analysis" feel
-        return f"Assessment: {caption}. Engagement appears normal."
+        return [f"Assessment: {caption}. Engagement appears normal." for caption in captions]
     except Exception as e:
         print(f"AI Analysis Failed: {e}")
-        return "Error analyzing image."
+        return [CAPTION_ERROR] * len(images)
+
+def analyze_classroom_vibe(image: Union[str, np.ndarray]) -> str:
+    """
+    Generates a caption/vibe check for the classroom image using local BLIP model.
+    Accepts an image path or an already-decoded RGB array.
+    """
+    return caption_images([image])[0]
@@ -0,0 +1,178 @@
+"""
+In-process job queue for attendance uploads.
+
+`POST /attendance/mark` holds the connection for the whole detection and
+captioning run; under load clients time out and retry, doubling the work.
+`POST /attendance/jobs` instead enqueues the upload and returns a job ID at
+once. A fixed number of consumers (ATTENDANCE_JOB_WORKERS) drain a bounded
+queue (ATTENDANCE_QUEUE_SIZE); when it is full, submit() raises QueueFull and
+the API answers 503 with a Retry-After estimated from recent job durations.
+
+Each job records its stage events (detected, matched, captioned, saved) so
+clients can poll `GET /attendance/jobs/{id}` or follow them live over SSE.
+Finished jobs are kept for ATTENDANCE_JOB_TTL_S seconds. Everything lives in
+the API process: no broker, and queued jobs are lost on restart.
+"""
+import asyncio
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ATTENDANCE_QUEUE_SIZE = int(os.environ.get("ATTENDANCE_QUEUE_SIZE", "32"))
+ATTENDANCE_JOB_WORKERS = int(os.environ.get("ATTENDANCE_JOB_WORKERS", "4"))
+ATTENDANCE_JOB_TTL_S = float(os.environ.get("ATTENDANCE_JOB_TTL_S", "3600"))
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Called as progress(stage, details) while a job runs
+Progress = Callable[[str, Dict[str, Any]], None]
+
+
+class QueueFull(Exception):
+    """The job queue is at capacity; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Attendance queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, payload: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Dropped once the job starts so queued uploads are the only bytes held
+        self.payload: Optional[Dict[str, Any]] = payload
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def _notify(self):
+        # Wake everyone waiting on this change; later waiters get a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def report(self, stage: str, details: Optional[Dict[str, Any]] = None):
+        self.events.append({"stage": stage, "at": time.time(), **(details or {})})
+        self._notify()
+
+    def finish(self, status: str, result=None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self.report(status, {"error": error} if error else None)
+
+    async def follow(self):
+        """
+        Yields every event of this job, past and future, until it finishes.
+        """
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "stages": [event["stage"] for event in self.events],
+            "events": self.events,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    def __init__(self, handler: Callable[[Dict[str, Any], Progress], Awaitable[Dict[str, Any]]],
+                 maxsize: int = ATTENDANCE_QUEUE_SIZE, workers: int = ATTENDANCE_JOB_WORKERS,
+                 ttl_s: float = ATTENDANCE_JOB_TTL_S):
+        self.handler = handler
+        self.maxsize = max(1, maxsize)
+        self.workers = max(1, workers)
+        self.ttl_s = ttl_s
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumers: List[asyncio.Task] = []
+        # Moving average of job run time, for Retry-After
+        self._avg_job_s = 5.0
+
+    def start(self):
+        # Must be called from the running event loop (API startup)
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    def shutdown(self):
+        for task in self._consumers:
+            task.cancel()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_job_s * (self.depth + 1) / self.workers))
+
+    def submit(self, payload: Dict[str, Any]) -> Job:
+        if self._queue is None:
+            raise RuntimeError("JobQueue.start() has not been called")
+        self._prune()
+        job = Job(payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(self.retry_after())
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        # Jobs are in submission order, so stop at the first one still within TTL
+        cutoff = time.time() - self.ttl_s
+        for job_id in list(self.jobs):
+            job = self.jobs[job_id]
+            if job.created_at >= cutoff:
+                break
+            if job.finished:
+                del self.jobs[job_id]
+
+    async def _consume(self):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            payload, job.payload = job.payload, None
+            start = time.perf_counter()
+            try:
+                result = await self.handler(payload, job.report)
+                job.finish(DONE, result=result)
+            except asyncio.CancelledError:
+                job.finish(FAILED, error="Server shutting down")
+                raise
+            except Exception as e:
+                print(f"Attendance job {job.id} failed: {e}")
+                job.finish(FAILED, error=str(e))
+            finally:
+                self._avg_job_s = 0.8 * self._avg_job_s + 0.2 * (time.perf_counter() - start)
+                self._queue.task_done()
@@ -0,0 +1,216 @@
+"""
+Attendance statistics, maintained incrementally.
+
+Per-student rates computed from raw records mean scanning sessions x roster
+rows. Instead, three summary tables are updated in the same transaction as the
+writes that change them:
+
+    StudentAttendanceStats  present / total / last seen, per student
+    SessionAttendanceStats  present / total, per session
+    DailyAttendanceStats    sessions / present / total, per calendar day
+
+Each upload costs three set-based statements (INSERT ... SELECT from the
+session's records, upserting), a correction three single-row updates, and
+reads are primary-key lookups. `rebuild()` recomputes everything from the raw
+records (see rebuild_stats.py).
+"""
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from models import AttendanceSession, SessionAttendanceStats, StudentAttendanceStats
+
+PRESENT = "PRESENT"
+ABSENT = "ABSENT"
+STATUSES = (PRESENT, ABSENT)
+
+# strftime formats over the daily table's ISO dates
+BUCKETS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+
+def _rate(present: int, total: int) -> Optional[float]:
+    return present / total if total else None
+
+
+def record_session(db: Session, session_id: int):
+    """
+    Folds a freshly written session's records into the summaries.
+    Call inside the transaction that inserted them.
+    """
+    params = {"session_id": session_id}
+    db.execute(text("""
+        INSERT INTO studentattendancestats (student_id, present_count, total_count, last_seen_at)
+        SELECT r.student_id, r.status = 'PRESENT', 1, CASE WHEN r.status = 'PRESENT' THEN s.created_at END
+        FROM attendancerecord r JOIN attendancesession s ON s.id = r.session_id
+        WHERE r.session_id = :session_id
+        ON CONFLICT (student_id) DO UPDATE SET
+            present_count = present_count + excluded.present_count,
+            total_count = total_count + excluded.total_count,
+            last_seen_at = COALESCE(MAX(last_seen_at, excluded.last_seen_at), last_seen_at, excluded.last_seen_at)
+    """), params)
+    db.execute(text("""
+        INSERT INTO sessionattendancestats (session_id, present_count, total_count)
+        SELECT :session_id, COALESCE(SUM(status = 'PRESENT'), 0), COUNT(*)
+        FROM attendancerecord WHERE session_id = :session_id
+    """), params)
+    db.execute(text("""
+        INSERT INTO dailyattendancestats (day, session_count, present_count, total_count)
+        SELECT date(s.created_at), 1, present_count, total_count
+        FROM sessionattendancestats st JOIN attendancesession s ON s.id = st.session_id
+        WHERE st.session_id = :session_id
+        ON CONFLICT (day) DO UPDATE SET
+            session_count = session_count + 1,
+            present_count = present_count + excluded.present_count,
+            total_count = total_count + excluded.total_count
+    """), params)
+
+
+def correct_record(db: Session, student_id: int, session_id: int, old_status: str, new_status: str):
+    """
+    Adjusts the summaries for one record changing status. Call inside the
+    transaction that updates the record.
+    """
+    if old_status == new_status:
+        return
+    delta = 1 if new_status == PRESENT else -1
+    params = {"delta": delta, "student_id": student_id, "session_id": session_id}
+    db.execute(text("""
+        UPDATE sessionattendancestats SET present_count = present_count + :delta
+        WHERE session_id = :session_id
+    """), params)
+    db.execute(text("""
+        UPDATE dailyattendancestats SET present_count = present_count + :delta
+        WHERE day = (SELECT date(created_at) FROM attendancesession WHERE id = :session_id)
+    """), params)
+    # last_seen_at may move either way, so take it from the student's records
+    # (composite (student_id, session_id) index: touches only this student's rows)
+    db.execute(text("""
+        UPDATE studentattendancestats SET
+            present_count = present_count + :delta,
+            last_seen_at = (
+                SELECT MAX(s.created_at) FROM attendancerecord r JOIN attendancesession s ON s.id = r.session_id
+                WHERE r.student_id = :student_id AND r.status = 'PRESENT'
+            )
+        WHERE student_id = :student_id
+    """), params)
+
+
+def remove_student(db: Session, student_id: int):
+    """
+    Takes a student's records out of the summaries. Call before deleting them.
+    """
+    params = {"student_id": student_id}
+    db.execute(text("""
+        UPDATE sessionattendancestats SET
+            present_count = present_count - (r.status = 'PRESENT'),
+            total_count = total_count - 1
+        FROM attendancerecord r
+        WHERE r.session_id = sessionattendancestats.session_id AND r.student_id = :student_id
+    """), params)
+    db.execute(text("""
+        UPDATE dailyattendancestats SET
+            present_count = present_count - d.present,
+            total_count = total_count - d.total
+        FROM (
+            SELECT date(s.created_at) AS day, SUM(r.status = 'PRESENT') AS present, COUNT(*) AS total
+            FROM attendancerecord r JOIN attendancesession s ON s.id = r.session_id
+            WHERE r.student_id = :student_id
+            GROUP BY date(s.created_at)
+        ) AS d
+        WHERE dailyattendancestats.day = d.day
+    """), params)
+    db.execute(text("DELETE FROM studentattendancestats WHERE student_id = :student_id"), params)
+
+
+def rebuild(db: Session):
+    """
+    Recomputes all summaries from the raw records. Commits.
+    """
+    for table in ("studentattendancestats", "sessionattendancestats", "dailyattendancestats"):
+        db.execute(text(f"DELETE FROM {table}"))
+    db.execute(text("""
+        INSERT INTO studentattendancestats (student_id, present_count, total_count, last_seen_at)
+        SELECT r.student_id, SUM(r.status = 'PRESENT'), COUNT(*),
+               MAX(CASE WHEN r.status = 'PRESENT' THEN s.created_at END)
+        FROM attendancerecord r JOIN attendancesession s ON s.id = r.session_id
+        GROUP BY r.student_id
+    """))
+    db.execute(text("""
+        INSERT INTO sessionattendancestats (session_id, present_count, total_count)
+        SELECT s.id, COALESCE(SUM(r.status = 'PRESENT'), 0), COUNT(r.id)
+        FROM attendancesession s LEFT JOIN attendancerecord r ON r.session_id = s.id
+        GROUP BY s.id
+    """))
+    db.execute(text("""
+        INSERT INTO dailyattendancestats (day, session_count, present_count, total_count)
+        SELECT date(s.created_at), COUNT(*), SUM(st.present_count), SUM(st.total_count)
+        FROM sessionattendancestats st JOIN attendancesession s ON s.id = st.session_id
+        GROUP BY date(s.created_at)
+    """))
+    db.commit()
+
+
+def rebuild_if_missing(db: Session) -> bool:
+    """
+    Builds the summaries for a database that has sessions from before they
+    existed. Returns True if a rebuild ran.
+    """
+    has_sessions = db.exec(select(AttendanceSession.id).limit(1)).first() is not None
+    has_stats = db.exec(select(SessionAttendanceStats.session_id).limit(1)).first() is not None
+    if has_sessions and not has_stats:
+        print("Building attendance statistics from existing records...")
+        rebuild(db)
+        return True
+    return False
+
+
+def student_stats(db: Session, student_id: int) -> Optional[Dict[str, Any]]:
+    row = db.get(StudentAttendanceStats, student_id)
+    if row is None:
+        return None
+    return {
+        "student_id": row.student_id,
+        "present_count": row.present_count,
+        "total_count": row.total_count,
+        "attendance_rate": _rate(row.present_count, row.total_count),
+        "last_seen_at": row.last_seen_at,
+    }
+
+
+def session_stats(db: Session, session_id: int) -> Optional[Dict[str, Any]]:
+    row = db.get(SessionAttendanceStats, session_id)
+    if row is None:
+        return None
+    return {
+        "session_id": row.session_id,
+        "present_count": row.present_count,
+        "total_count": row.total_count,
+        "attendance_rate": _rate(row.present_count, row.total_count),
+    }
+
+
+def bucketed_stats(db: Session, bucket: str = "day", since: Optional[date] = None,
+                   until: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Attendance per day / week / month in [since, until), from the daily table
+    (one row per calendar day, however many sessions or students).
+    """
+    fmt = BUCKETS[bucket]
+    rows = db.execute(text(f"""
+        SELECT strftime('{fmt}', day) AS bucket, SUM(session_count), SUM(present_count), SUM(total_count)
+        FROM dailyattendancestats
+        WHERE (:since IS NULL OR day >= :since) AND (:until IS NULL OR day < :until)
+        GROUP BY bucket ORDER BY bucket
+    """), {"since": since.isoformat() if since else None, "until": until.isoformat() if until else None}).all()
+    return [
+        {
+            "bucket": label,
+            "session_count": sessions,
+            "present_count": present,
+            "total_count": total,
+            "attendance_rate": _rate(present, total),
+        }
+        for label, sessions, present, total in rows
+    ]
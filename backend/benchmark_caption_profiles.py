@@ -0,0 +1,115 @@
+"""
+Compares BLIP CPU inference profiles (CAPTION_PROFILE) against the original
+fp32 path ("baseline").
+
+Each profile runs in a fresh subprocess so its memory is measured in
+isolation. Reports model load time, per-image latency, peak RSS, and how
+closely its captions agree with the baseline's (exact matches and mean word
+overlap).
+
+Usage:
+    python benchmark_caption_profiles.py --images-dir ../dataset/test --threads 4
+    python benchmark_caption_profiles.py --profiles baseline int8 --batch-size 4
+"""
+import argparse
+import difflib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_profile(args):
+    """
+    Child process: load one profile, caption the images, print a JSON summary.
+    """
+    import ai_engine
+    from benchmark_captioning import load_images
+
+    images = load_images(args.images_dir, args.images)
+    start = time.perf_counter()
+    if not ai_engine.load_captioning_model():
+        raise SystemExit("BLIP model could not be loaded (is CAPTIONING_ENABLED off?)")
+    load_time = time.perf_counter() - start
+
+    # Warm up kernels and allocator before timing
+    ai_engine.caption_images(images[:1])
+
+    captions = []
+    latencies = []
+    for i in range(0, len(images), args.batch_size):
+        batch = images[i:i + args.batch_size]
+        start = time.perf_counter()
+        captions.extend(ai_engine.caption_images(batch))
+        latencies.append((time.perf_counter() - start) / len(batch))
+
+    print(json.dumps({
+        "profile": ai_engine.CAPTION_PROFILE,
+        "load_s": load_time,
+        "latency_s": float(np.mean(latencies)),
+        "rss_mb": rss_mb(),
+        "captions": captions,
+    }))
+
+
+def similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a.split(), b.split()).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["baseline", "fp32", "int8", "int8-traced"])
+    parser.add_argument("--images", type=int, default=16, help="Images to caption per profile")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=0, help="TORCH_THREADS for every profile (0 = torch default)")
+    parser.add_argument("--images-dir", default=None, help="Caption these images instead of synthetic ones")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_profile(args)
+        return
+
+    profiles = args.profiles if "baseline" in args.profiles else ["baseline"] + args.profiles
+    if args.images_dir is None:
+        print("Note: synthetic images make caption agreement meaningless; pass --images-dir for real photos.\n")
+
+    results = {}
+    for profile in profiles:
+        print(f"Running {profile}...")
+        env = dict(os.environ, CAPTION_PROFILE=profile, TORCH_THREADS=str(args.threads), CAPTIONING_ENABLED="true")
+        cmd = [sys.executable, __file__, "--child", "--images", str(args.images), "--batch-size", str(args.batch_size)]
+        if args.images_dir:
+            cmd += ["--images-dir", args.images_dir]
+        out = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"  {profile} failed:\n{out.stderr}")
+            continue
+        results[profile] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    baseline = results.get("baseline")
+    if baseline is None:
+        raise SystemExit("Baseline run failed; nothing to compare against")
+
+    print(f"\n{args.images} images, batch size {args.batch_size}, threads {args.threads or 'default'}\n")
+    print("| Profile | Load (s) | Latency/img (s) | Speedup | Peak RSS (MB) | Exact match | Word overlap |")
+    print("|---------|----------|-----------------|---------|---------------|-------------|--------------|")
+    for profile, r in results.items():
+        pairs = list(zip(baseline["captions"], r["captions"]))
+        exact = np.mean([a == b for a, b in pairs])
+        overlap = np.mean([similarity(a, b) for a, b in pairs])
+        print(f"| {profile} | {r['load_s']:.1f} | {r['latency_s']:.3f} | {baseline['latency_s'] / r['latency_s']:.2f}x "
+              f"| {r['rss_mb']:.0f} | {exact:.0%} | {overlap:.1%} |")
+
+
+if __name__ == "__main__":
+    main()
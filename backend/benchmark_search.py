@@ -0,0 +1,82 @@
+"""
+Benchmarks roster search backends on synthetic 128-d embeddings.
+
+Reports recall@1 (agreement with exact search) and queries/sec for the exact
+path and for IVF at several nprobe settings.
+
+Usage:
+    python benchmark_search.py --roster-size 50000 --queries 1000 --nprobe 1 4 8 16 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from search_backends import ExactSearch, IVFSearch
+
+
+def make_synthetic_roster(n: int, dim: int = 128, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """
+    Clustered embeddings with roughly dlib-like geometry: distinct people sit
+    ~0.8-1.2 apart, so a 0.6 tolerance separates them.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=0.08, size=(n_clusters, dim))
+    labels = rng.integers(0, n_clusters, size=n)
+    return (centers[labels] + rng.normal(scale=0.06, size=(n, dim))).astype(np.float32)
+
+
+def make_queries(roster: np.ndarray, n: int, noise: float = 0.025, seed: int = 1) -> np.ndarray:
+    """
+    New photos of enrolled students: roster rows plus per-photo noise (~0.3 away).
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(roster), size=n)
+    return (roster[picks] + rng.normal(scale=noise, size=(n, roster.shape[1]))).astype(np.float32)
+
+
+def time_search(backend, queries: np.ndarray, roster: np.ndarray, batch_size: int):
+    rows = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        _, r = backend.search(queries[i:i + batch_size], roster, k=1)
+        rows.append(r[:, 0])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(rows), len(queries) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roster-size", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=200, help="Faces per query batch (one classroom photo)")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default 4*sqrt(N))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    print(f"Generating {args.roster_size} roster embeddings and {args.queries} queries...")
+    roster = make_synthetic_roster(args.roster_size)
+    queries = make_queries(roster, args.queries)
+
+    exact_rows, exact_qps = time_search(ExactSearch(), queries, roster, args.batch_size)
+
+    print("\n| Backend | recall@1 | queries/sec | speedup |")
+    print("|---------|----------|-------------|---------|")
+    print(f"| exact | 100.00% | {exact_qps:,.0f} | 1.00x |")
+
+    ivf = IVFSearch(nlist=args.nlist, min_size=0)
+    start = time.perf_counter()
+    ivf.build(roster)
+    build_time = time.perf_counter() - start
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        rows, qps = time_search(ivf, queries, roster, args.batch_size)
+        recall = np.mean(rows == exact_rows)
+        print(f"| ivf nlist={len(ivf.centroids)} nprobe={nprobe} | {recall:.2%} | {qps:,.0f} | {qps / exact_qps:.2f}x |")
+
+    print(f"\nIVF build (k-means + assignment): {build_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Offline benchmark suite for the recognition engine.
+
+Times each stage on its own, with synthetic inputs so runs are reproducible
+on any machine and need no dataset:
+
+    roster_load  load_roster_embeddings from a packed store of N students
+    match        one classroom's faces matched against a roster of N students,
+                 and against only their course's enrolled students
+    detect       face detection per mode on generated classroom-sized images
+    encode       face encodings for a batch of known face boxes
+    caption      BLIP caption of one image (skipped if BLIP can't load)
+
+Roster sizes default to 40, 1k, 10k and 100k. Results are written as JSON;
+`compare` flags benchmarks whose median got slower between two runs and exits
+non-zero if any did.
+
+Usage:
+    python benchmarks.py run --output bench.json
+    python benchmarks.py run --only match roster_load --sizes 1000 100000
+    python benchmarks.py run --images-dir ../images --output bench.json
+    python benchmarks.py compare baseline.json bench.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+import ai_engine
+import roster_store
+from benchmark_search import make_queries, make_synthetic_roster
+from models import Student
+
+BENCHMARKS = ("roster_load", "match", "detect", "encode", "caption")
+DEFAULT_SIZES = [40, 1000, 10000, 100000]
+# Faces in one classroom photo
+CLASS_FACES = 40
+# Students enrolled in the course for scoped matching
+COURSE_SIZE = 60
+IMAGE_SIZES = [(1280, 720), (1920, 1080)]
+
+
+def measure(fn: Callable[[], object], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    return {
+        "median_ms": float(np.median(times)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "min_ms": float(times.min()),
+        "mean_ms": float(times.mean()),
+        "repeats": repeats,
+    }
+
+
+def generate_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    Smooth gradients plus noise: detection cost depends on image size, not content.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    return np.clip(base + rng.normal(scale=20, size=base.shape), 0, 255).astype(np.uint8)
+
+
+def load_images(images_dir: Optional[str]) -> Dict[str, np.ndarray]:
+    if images_dir:
+        files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+        if not files:
+            raise SystemExit(f"No images found in {images_dir}")
+        return {f: np.asarray(Image.open(os.path.join(images_dir, f)).convert('RGB')) for f in files}
+    return {f"{w}x{h}": generate_image(w, h) for w, h in IMAGE_SIZES}
+
+
+def face_grid(image: np.ndarray, count: int, size: int = 120) -> List[tuple]:
+    # Non-overlapping (top, right, bottom, left) boxes laid out in rows
+    h, w = image.shape[:2]
+    per_row = max(1, w // size)
+    boxes = []
+    for i in range(count):
+        top, left = (i // per_row) * size % max(1, h - size), (i % per_row) * size
+        boxes.append((top, left + size, top + size, left))
+    return boxes
+
+
+def bench_roster_load(sizes: List[int], repeats: int) -> Dict[str, Dict]:
+    results = {}
+    primary, samples = roster_store.PRIMARY, roster_store.SAMPLES
+    try:
+        for n in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                roster_store.PRIMARY = roster_store.StoreFiles(os.path.join(tmp, "e.f32"), os.path.join(tmp, "i.i64"))
+                roster_store.SAMPLES = roster_store.StoreFiles(os.path.join(tmp, "s.f32"), os.path.join(tmp, "si.i64"))
+                ids = np.arange(1, n + 1, dtype=np.int64)
+                roster_store.append_embeddings(ids, make_synthetic_roster(n), roster_store.PRIMARY)
+                students = [Student(id=int(i), name=f"S{i}", student_id=f"R{i}",
+                                    face_encoding_path=roster_store.EMBEDDINGS_FILE) for i in ids]
+                results[f"roster_load[n={n}]"] = {
+                    **measure(lambda: ai_engine.load_roster_embeddings(students), repeats),
+                    "roster_size": n,
+                }
+    finally:
+        roster_store.PRIMARY, roster_store.SAMPLES = primary, samples
+    return results
+
+
+def bench_match(sizes: List[int], repeats: int) -> Dict[str, Dict]:
+    results = {}
+    for n in sizes:
+        embeddings = make_synthetic_roster(n)
+        ai_engine.roster.rebuild(np.arange(1, n + 1, dtype=np.int64), embeddings)
+        queries = make_queries(embeddings, CLASS_FACES)
+        results[f"match[n={n},faces={CLASS_FACES}]"] = {
+            **measure(lambda: ai_engine.match_encodings(queries), repeats),
+            "roster_size": n,
+            "faces": CLASS_FACES,
+        }
+        # Distinct enrolled students matched against just their course (no
+        # face is left unknown, so the cross-course fallback never runs)
+        course = np.arange(1, min(n, COURSE_SIZE) + 1, dtype=np.int64)
+        rng = np.random.default_rng(1)
+        present = embeddings[:min(len(course), CLASS_FACES)]
+        course_queries = (present + rng.normal(scale=0.025, size=present.shape)).astype(np.float32)
+        results[f"match[n={n},course={len(course)},faces={CLASS_FACES}]"] = {
+            **measure(lambda: ai_engine.match_encodings(course_queries, course), repeats),
+            "roster_size": n,
+            "course_size": len(course),
+            "faces": CLASS_FACES,
+        }
+    return results
+
+
+def bench_detect(images: Dict[str, np.ndarray], repeats: int) -> Dict[str, Dict]:
+    results = {}
+    for name, image in images.items():
+        for mode in ai_engine.DETECTION_MODES:
+            faces = len(ai_engine.detect_faces(image, mode))
+            results[f"detect[{mode},{name}]"] = {
+                **measure(lambda: ai_engine.detect_faces(image, mode), repeats, warmup=0),
+                "faces": faces,
+            }
+    return results
+
+
+def bench_encode(images: Dict[str, np.ndarray], repeats: int, faces: int = 20) -> Dict[str, Dict]:
+    results = {}
+    for name, image in images.items():
+        boxes = face_grid(image, faces)
+        results[f"encode[faces={faces},{name}]"] = {
+            **measure(lambda: ai_engine.face_recognition.face_encodings(image, boxes), repeats),
+            "faces": faces,
+        }
+    return results
+
+
+def bench_caption(images: Dict[str, np.ndarray], repeats: int) -> Dict[str, Dict]:
+    if not ai_engine.load_captioning_model():
+        print(f"  caption: skipped (captioning {ai_engine.captioning_status()})")
+        return {}
+    name, image = next(iter(images.items()))
+    return {f"caption[{name}]": {**measure(lambda: ai_engine.caption_images([image]), repeats),
+                                 "profile": ai_engine.CAPTION_PROFILE}}
+
+
+def environment() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "search_backend": type(ai_engine.roster.backend).__name__,
+        "caption_profile": ai_engine.CAPTION_PROFILE,
+    }
+
+
+def run(args) -> Dict[str, object]:
+    only = args.only or BENCHMARKS
+    images = load_images(args.images_dir) if {"detect", "encode", "caption"} & set(only) else {}
+    results: Dict[str, Dict] = {}
+    for name in only:
+        print(f"Running {name}...")
+        if name == "roster_load":
+            results.update(bench_roster_load(args.sizes, args.repeats))
+        elif name == "match":
+            results.update(bench_match(args.sizes, args.repeats))
+        elif name == "detect":
+            results.update(bench_detect(images, args.repeats))
+        elif name == "encode":
+            results.update(bench_encode(images, args.repeats))
+        elif name == "caption":
+            results.update(bench_caption(images, max(1, args.repeats // 2)))
+
+    print("\n| Benchmark | median (ms) | p95 (ms) |")
+    print("|-----------|-------------|----------|")
+    for key, stats in results.items():
+        print(f"| {key} | {stats['median_ms']:.2f} | {stats['p95_ms']:.2f} |")
+    return {"environment": environment(), "results": results}
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, min_delta_ms: float) -> List[str]:
+    """
+    Returns the benchmarks whose median grew by more than `threshold` (relative)
+    and `min_delta_ms` (absolute, so sub-millisecond noise isn't flagged).
+    """
+    regressions = []
+    old, new = baseline["results"], current["results"]
+    print("| Benchmark | baseline (ms) | current (ms) | change | |")
+    print("|-----------|---------------|--------------|--------|-|")
+    for key in sorted(set(old) | set(new)):
+        if key not in old or key not in new:
+            before = f"{old[key]['median_ms']:.2f}" if key in old else "-"
+            after = f"{new[key]['median_ms']:.2f}" if key in new else "-"
+            print(f"| {key} | {before} | {after} | | only in one run |")
+            continue
+        before, after = old[key]["median_ms"], new[key]["median_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold and after - before > min_delta_ms:
+            flag = "REGRESSION"
+            regressions.append(key)
+        elif change < -threshold and before - after > min_delta_ms:
+            flag = "faster"
+        print(f"| {key} | {before:.2f} | {after:.2f} | {change:+.1%} | {flag} |")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Benchmarks to run (default: all)")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Roster sizes")
+    run_parser.add_argument("--repeats", type=int, default=10, help="Timed runs per benchmark")
+    run_parser.add_argument("--images-dir", default=None, help="Use these images instead of generated ones")
+    run_parser.add_argument("--output", default=None, help="Write results JSON here")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown that counts (0.10 = 10%%)")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Micro-batching front end for BLIP captioning.
+
+Concurrent uploads each used to pay for a full BLIP forward pass. Requests
+are now queued; a collector takes the first waiting request, then keeps
+collecting for up to CAPTION_BATCH_WAIT_MS or until CAPTION_BATCH_SIZE
+requests are queued, and sends the whole group to the inference pool as one
+batched `generate`. Each caller awaits only its own caption.
+
+At most one batch per inference worker is in flight; while they run, the
+next batch is already being collected. When nothing is in flight there is
+nothing to wait for, so whatever is queued goes out at once: a lone upload
+never pays the batch window. With captioning disabled, callers get the
+placeholder straight away.
+"""
+import asyncio
+import os
+import time
+from typing import List, Optional, Tuple
+
+import ai_engine
+import metrics
+from inference_pool import ImageInput, InferencePool
+
+CAPTION_BATCH_SIZE = int(os.environ.get("CAPTION_BATCH_SIZE", "8"))
+CAPTION_BATCH_WAIT_MS = float(os.environ.get("CAPTION_BATCH_WAIT_MS", "50"))
+
+
+class CaptionBatcher:
+    def __init__(self, inference: InferencePool, max_batch: int = CAPTION_BATCH_SIZE,
+                 max_wait_ms: float = CAPTION_BATCH_WAIT_MS):
+        self.inference = inference
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        # Strong references so running batches aren't garbage collected
+        self._batches = set()
+
+    def _ensure_started(self):
+        # Created lazily so they bind to the running event loop
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._in_flight = asyncio.Semaphore(max(1, self.inference.workers))
+            self._collector = asyncio.create_task(self._collect())
+
+    async def caption(self, image: ImageInput) -> str:
+        if not ai_engine.CAPTIONING_ENABLED:
+            return ai_engine.CAPTION_DISABLED
+        if self.max_batch == 1:
+            return await self.inference.analyze_classroom_vibe(image)
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if not self._batches:
+                # Idle pool: waiting would only add latency
+                while len(batch) < self.max_batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+            deadline = loop.time() + self.max_wait
+            while self._batches and len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: List[Tuple[ImageInput, asyncio.Future]]):
+        try:
+            start = time.perf_counter()
+            captions = await self.inference.caption_batch([image for image, _ in batch])
+            # Not a per-request stage: one batch serves several requests
+            metrics.CAPTION_BATCH_SECONDS.observe(time.perf_counter() - start)
+            metrics.CAPTION_BATCH_SIZE.observe(len(batch))
+            for (_, future), caption in zip(batch, captions):
+                if not future.done():
+                    future.set_result(caption)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._in_flight.release()
+
+    def shutdown(self):
+        if self._collector is not None:
+            self._collector.cancel()
@@ -1,13 +1,83 @@
+from sqlalchemy import event, inspect
 from sqlmodel import SQLModel, create_engine, Session
 from models import *
+import os
 
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+# WAL lets readers (history pages, worker roster syncs) proceed while an
+# upload's write transaction is open; the busy timeout makes a second writer
+# wait instead of failing with "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+
+connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+engine = create_engine(
+    sqlite_url,
+    connect_args=connect_args,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+)
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL: a power cut can lose the last commits but never corrupts the file
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def ensure_columns():
+    """
+    Migration for existing database.db files: adds nullable columns that were
+    added to models after their table was created. Idempotent.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    added = []
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"Warning: cannot add NOT NULL column {table.name}.{column.name} to an existing table")
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                added.append(f"{table.name}.{column.name}")
+    if added:
+        print(f"Added columns: {', '.join(added)}")
+
+def ensure_indexes():
+    """
+    Migration for existing database.db files: create_all only creates missing
+    tables, so indexes added to models later are created here. Idempotent.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    created = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    if created:
+        print(f"Created indexes: {', '.join(created)}")
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
 
 def create_db_and_tables():
+    # Columns first: new indexes may be on new columns
+    ensure_columns()
+    ensure_indexes()
     SQLModel.metadata.create_all(engine)
 
 def get_session():
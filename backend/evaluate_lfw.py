@@ -1,174 +1,211 @@
+"""
+Face recognition accuracy on LFW (Labeled Faces in the Wild).
 
+For each person with at least --min-faces images, one image is enrolled in the
+roster and the rest are matched against it.
+
+LFW images are already cropped around the face, so by default each image is
+encoded with the whole crop as its known face location (no detection pass);
+--detect runs HOG detection first, as the classroom pipeline does. Encoding
+runs across a process pool, and the encodings of every image are cached on
+disk keyed by the dataset contents and encoding settings, so re-scoring (other
+tolerances, another roster image per person) takes seconds. Scoring is one
+distance matrix for all test images.
+
+Usage:
+    python evaluate_lfw.py
+    python evaluate_lfw.py --tolerance 0.5 0.55 0.6 --report /tmp/lfw.md
+    python evaluate_lfw.py --detect --workers 8
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
 import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import pandas as pd
 from sklearn.datasets import fetch_lfw_people
 from sklearn.metrics import classification_report, accuracy_score, precision_recall_fscore_support
-import face_recognition
-import cv2
-import os
 
-def evaluate_lfw():
-    print("Fetching LFW dataset (this may take a while)...")
-    # Load LFW dataset: only people with at least 20 images to ensure enough data
-    lfw_people = fetch_lfw_people(min_faces_per_person=20, resize=None) # resize=None for full quality
-    
-    n_samples, h, w, c = lfw_people.images.shape if len(lfw_people.images.shape) == 4 else (*lfw_people.images.shape, 1)
-    
-    # If images are grayscale (h,w), convert to RGB for face_recognition
-    images = lfw_people.images
-    if len(images.shape) == 3:
-        # (N, H, W) -> (N, H, W, 3)
-        images_rgb = []
-        for img in images:
-             # Scikit-learn LFW images are float32 in [0, 1] usually, but face_rec needs uint8
-             # Actually fetch_lfw_people returns float [0, 255] or [0,1] depending.
-             # Let's inspect ONE image
-             pass 
-        # Easier: Just handle inside the loop
-        
-    target_names = lfw_people.target_names
-    n_classes = target_names.shape[0]
-
-    print(f"Dataset Size: {n_samples} images")
-    print(f"Classes: {n_classes}")
-
-    # Strategy:
-    # For each person, take the 1st image as "Roster" (Known).
-    # Take the rest as "Test" (Unknown).
-    
-    known_encodings = []
-    known_names = []
-    
-    test_images = []
-    test_labels = [] # True Name
-    
-    print("Building Roster and Test Set...")
-    
-    # Group indices by target ID
-    from collections import defaultdict
+from matching import distance_matrix
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_REPORT = os.path.join(BASE_DIR, "..", "docs", "lfw_evaluation_report.md")
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, "static", "cache", "lfw")
+CHUNK_SIZE = 64
+UNKNOWN = "Unknown"
+
+
+def to_rgb_uint8(images: np.ndarray) -> np.ndarray:
+    # sklearn returns float images, in [0, 1] or [0, 255] depending on version; grayscale unless color=True
+    if images.max() <= 1.0:
+        images = images * 255
+    images = images.astype(np.uint8)
+    if images.ndim == 3:
+        images = np.repeat(images[..., None], 3, axis=-1)
+    return np.ascontiguousarray(images)
+
+
+def _encode_chunk(job):
+    import face_recognition
+    images, detect, jitters, model = job
+    encodings = np.zeros((len(images), 128), dtype=np.float32)
+    found = np.zeros(len(images), dtype=bool)
+    for i, image in enumerate(images):
+        h, w = image.shape[:2]
+        locations = None if detect else [(0, w, h, 0)]
+        result = face_recognition.face_encodings(image, locations, num_jitters=jitters, model=model)
+        if result:
+            encodings[i] = result[0]
+            found[i] = True
+    return encodings, found
+
+
+def cache_path(cache_dir: str, images: np.ndarray, targets: np.ndarray, detect: bool, jitters: int, model: str) -> str:
+    digest = hashlib.sha1()
+    digest.update(str(images.shape).encode())
+    digest.update(images.tobytes())
+    digest.update(targets.tobytes())
+    key = f"{digest.hexdigest()[:16]}_{'detect' if detect else 'crop'}_j{jitters}_{model}"
+    return os.path.join(cache_dir, f"lfw_{key}.npz")
+
+
+def encode_all(images: np.ndarray, targets: np.ndarray, workers: int, detect: bool, jitters: int,
+               model: str, cache_dir: str):
+    """
+    Encodings for every image: (encodings (N, 128), found (N,), encode seconds or None if cached).
+    """
+    path = cache_path(cache_dir, images, targets, detect, jitters, model)
+    if os.path.exists(path):
+        cached = np.load(path)
+        print(f"Using cached encodings from {path}")
+        return cached["encodings"], cached["found"], None
+
+    workers = workers or os.cpu_count() or 1
+    print(f"Encoding {len(images)} images with {workers} workers ({'detection' if detect else 'known crop locations'})...")
+    start = time.perf_counter()
+    jobs = [(images[i:i + CHUNK_SIZE], detect, jitters, model) for i in range(0, len(images), CHUNK_SIZE)]
+    encodings, found = [], []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for i, (chunk_encodings, chunk_found) in enumerate(pool.map(_encode_chunk, jobs)):
+            encodings.append(chunk_encodings)
+            found.append(chunk_found)
+            print(f"  {min((i + 1) * CHUNK_SIZE, len(images))}/{len(images)} encoded")
+    elapsed = time.perf_counter() - start
+    encodings, found = np.concatenate(encodings), np.concatenate(found)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, encodings=encodings, found=found)
+    os.replace(tmp_path, path)
+    return encodings, found, elapsed
+
+
+def split(targets: np.ndarray, found: np.ndarray, roster_image: int):
+    """
+    Roster row per person (their roster_image-th image, if a face was found
+    in it) and the remaining images of enrolled people as the test set.
+    """
     class_indices = defaultdict(list)
-    for idx, target in enumerate(lfw_people.target):
+    for idx, target in enumerate(targets):
         class_indices[target].append(idx)
-        
-    # Process
-    roster_count = 0
-    test_count = 0
-    
-    for target_id, indices in class_indices.items():
-        name = target_names[target_id]
-        
-        # 1. Register first image
-        roster_idx = indices[0]
-        roster_img = lfw_people.images[roster_idx]
-        
-        # Convert to uint8 (0-255)
-        if roster_img.max() <= 1.0:
-            roster_img = (roster_img * 255).astype(np.uint8)
-        else:
-            roster_img = roster_img.astype(np.uint8)
-            
-        if len(roster_img.shape) == 2:
-            roster_img = cv2.cvtColor(roster_img, cv2.COLOR_GRAY2RGB)
-            
-        encodings = face_recognition.face_encodings(roster_img)
-        if len(encodings) > 0:
-            known_encodings.append(encodings[0])
-            known_names.append(name)
-            roster_count += 1
-            
-            # 2. Add rest to test
-            for test_idx in indices[1:]:
-                test_img = lfw_people.images[test_idx]
-                if test_img.max() <= 1.0:
-                    test_img = (test_img * 255).astype(np.uint8)
-                else:
-                    test_img = test_img.astype(np.uint8)
-                    
-                if len(test_img.shape) == 2:
-                    test_img = cv2.cvtColor(test_img, cv2.COLOR_GRAY2RGB)
-                
-                test_images.append(test_img)
-                test_labels.append(name)
-                test_count += 1
-        else:
-            print(f"Skipping {name} - No face found in roster image")
-
-    print(f"Roster Size: {roster_count} people")
-    print(f"Test Set Size: {test_count} images")
-    
-    # Run Evaluation
-    print("Running Inference...")
-    y_true = []
-    y_pred = []
-    latencies = []
-    
-    for i, unknown_image in enumerate(test_images):
-        start_time = time.time()
-        
-        # Detect Face
-        # We can pass locations if we assume 1 face (LFW usually is centered), 
-        # but let's test the full pipeline detection
-        encodings = face_recognition.face_encodings(unknown_image)
-        
-        predicted_name = "Unknown"
-        
-        if len(encodings) > 0:
-            # Match
-            face_encoding = encodings[0]
-            matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
-            face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-            
-            if len(matches) > 0:
-                best_match_index = np.argmin(face_distances)
-                if matches[best_match_index]:
-                    predicted_name = known_names[best_match_index]
-        
-        latency = time.time() - start_time
-        latencies.append(latency)
-        
-        y_true.append(test_labels[i])
-        y_pred.append(predicted_name)
-        
-        if i % 20 == 0:
-            print(f"Processed {i}/{len(test_images)}...")
-            
-    # Metrics
-    accuracy = accuracy_score(y_true, y_pred)
-    # We use weighted average to account for class imbalance
-    precision, recall, f1, _ = precision_recall_fscore_support(y_true, y_pred, average='weighted', zero_division=0)
-    avg_latency = np.mean(latencies)
-    
-    print("\n--- LFW Evaluation Results ---")
-    print(f"Accuracy:  {accuracy:.2%}")
-    print(f"Precision: {precision:.2%}")
-    print(f"Recall:    {recall:.2%}")
-    print(f"F1 Score:  {f1:.2%}")
-    print(f"Avg Latency: {avg_latency:.4f}s")
-    
-    # Save detailed report
-    report_file = "/home/deepak/Desktop/Gen-AI-Classroom-Attendance-System/docs/lfw_evaluation_report.md"
-    
-    with open(report_file, "w") as f:
+    roster_idx, test_idx, skipped = [], [], []
+    for target, indices in class_indices.items():
+        pick = indices[roster_image % len(indices)]
+        if not found[pick]:
+            skipped.append(target)
+            continue
+        roster_idx.append(pick)
+        test_idx.extend(i for i in indices if i != pick)
+    return np.array(roster_idx), np.array(test_idx), skipped
+
+
+def score(encodings, found, targets, target_names, roster_idx, test_idx, tolerances):
+    """
+    Predicted names per tolerance, from one distance matrix. Test images with
+    no face found are predicted Unknown.
+    """
+    distances = distance_matrix(encodings[test_idx], encodings[roster_idx])
+    best = np.argmin(distances, axis=1)
+    best_distance = distances[np.arange(len(best)), best]
+    roster_names = target_names[targets[roster_idx]]
+    predictions = {}
+    for tolerance in tolerances:
+        accept = found[test_idx] & (best_distance <= tolerance)
+        predictions[tolerance] = np.where(accept, roster_names[best], UNKNOWN)
+    return predictions
+
+
+def write_report(path, args, roster_count, test_count, rows, y_true, y_pred, encode_seconds, n_images):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
         f.write("# LFW Evaluation Report\n\n")
-        f.write(f"**Dataset**: LFW (min_faces_per_person=20)\n")
+        f.write(f"**Dataset**: LFW (min_faces_per_person={args.min_faces})\n")
         f.write(f"**Roster Size**: {roster_count}\n")
-        f.write(f"**Test Images**: {test_count}\n\n")
-        
-        f.write("| Metric | Value |\n")
-        f.write("|--------|-------|\n")
-        f.write(f"| Accuracy | {accuracy:.2%} |\n")
-        f.write(f"| Precision (Weighted) | {precision:.2%} |\n")
-        f.write(f"| Recall (Weighted) | {recall:.2%} |\n")
-        f.write(f"| F1 Score (Weighted) | {f1:.2%} |\n")
-        f.write(f"| Avg Latency | {avg_latency:.4f}s |\n\n")
-        
-        f.write("## Detailed Classification Report\n")
+        f.write(f"**Test Images**: {test_count}\n")
+        f.write(f"**Face locations**: {'HOG detection' if args.detect else 'known crop'}\n")
+        if encode_seconds is not None:
+            f.write(f"**Encoding**: {n_images / encode_seconds:.1f} images/s ({args.workers or os.cpu_count()} workers)\n")
+        f.write("\n| Tolerance | Accuracy | Precision (Weighted) | Recall (Weighted) | F1 Score (Weighted) |\n")
+        f.write("|-----------|----------|----------------------|-------------------|---------------------|\n")
+        for tolerance, accuracy, precision, recall, f1 in rows:
+            f.write(f"| {tolerance} | {accuracy:.2%} | {precision:.2%} | {recall:.2%} | {f1:.2%} |\n")
+        f.write(f"\n## Detailed Classification Report (tolerance {rows[0][0]})\n")
         f.write("```\n")
         f.write(classification_report(y_true, y_pred, zero_division=0))
         f.write("\n```\n")
 
-    print(f"Report saved to {report_file}")
+
+def evaluate_lfw(args):
+    print("Fetching LFW dataset (this may take a while)...")
+    lfw_people = fetch_lfw_people(min_faces_per_person=args.min_faces, resize=None)
+    images = to_rgb_uint8(lfw_people.images)
+    targets, target_names = lfw_people.target, lfw_people.target_names
+    print(f"Dataset Size: {len(images)} images")
+    print(f"Classes: {len(target_names)}")
+
+    encodings, found, encode_seconds = encode_all(images, targets, args.workers, args.detect, args.jitters,
+                                                  args.model, args.cache_dir)
+
+    start = time.perf_counter()
+    roster_idx, test_idx, skipped = split(targets, found, args.roster_image)
+    for target in skipped:
+        print(f"Skipping {target_names[target]} - No face found in roster image")
+    print(f"Roster Size: {len(roster_idx)} people")
+    print(f"Test Set Size: {len(test_idx)} images")
+
+    predictions = score(encodings, found, targets, target_names, roster_idx, test_idx, args.tolerance)
+    y_true = target_names[targets[test_idx]]
+    rows = []
+    print("\n--- LFW Evaluation Results ---")
+    for tolerance, y_pred in predictions.items():
+        accuracy = accuracy_score(y_true, y_pred)
+        # Weighted average to account for class imbalance
+        precision, recall, f1, _ = precision_recall_fscore_support(y_true, y_pred, average='weighted', zero_division=0)
+        rows.append((tolerance, accuracy, precision, recall, f1))
+        print(f"tolerance {tolerance}: accuracy {accuracy:.2%}, precision {precision:.2%}, "
+              f"recall {recall:.2%}, F1 {f1:.2%}")
+    print(f"Scoring: {time.perf_counter() - start:.2f}s")
+    if encode_seconds is not None:
+        print(f"Encoding: {encode_seconds:.1f}s ({len(images) / encode_seconds:.1f} images/s)")
+
+    write_report(args.report, args, len(roster_idx), len(test_idx), rows, y_true,
+                 predictions[args.tolerance[0]], encode_seconds, len(images))
+    print(f"Report saved to {args.report}")
+
 
 if __name__ == "__main__":
-    evaluate_lfw()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-faces", type=int, default=20, help="Only people with at least this many images")
+    parser.add_argument("--tolerance", type=float, nargs="+", default=[0.6],
+                        help="Match tolerance(s); the first one gets the detailed report")
+    parser.add_argument("--roster-image", type=int, default=0, help="Which image of each person to enroll")
+    parser.add_argument("--detect", action="store_true", help="Detect faces instead of using the known crop")
+    parser.add_argument("--jitters", type=int, default=1, help="num_jitters for face_encodings")
+    parser.add_argument("--model", default="small", choices=("small", "large"), help="Landmark model")
+    parser.add_argument("--workers", type=int, default=0, help="Encoding processes (default: all cores)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Where encodings are cached")
+    parser.add_argument("--report", default=DEFAULT_REPORT, help="Markdown report path")
+    evaluate_lfw(parser.parse_args())
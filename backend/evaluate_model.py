@@ -1,5 +1,5 @@
-import os
 import json
+import argparse
 import time
 import numpy as np
 from pathlib import Path
@@ -7,13 +7,16 @@ from sqlmodel import Session, select
 from database import engine, create_db_and_tables
 from models import Student
 import ai_engine
-from typing import List, Dict
+import result_cache
+from matching import assign, collapse_by_student, distance_matrix, DEFAULT_TOLERANCE
+from typing import List, Dict, Optional, Tuple
 
 # Setup paths
 BASE_DIR = Path(__file__).resolve().parent
 IMAGES_DIR = BASE_DIR.parent / "images"
 LABELS_FILE = BASE_DIR / "test_labels.json"
-REPORT_FILE = Path("/home/deepak/.gemini/antigravity/brain/343821c5-1118-42f0-b405-e97ae5d19bed/evaluation_report.md")
+REPORT_FILE = BASE_DIR.parent / "docs" / "evaluation_report.md"
+STRATEGIES = ("hungarian", "nearest")
 
 def load_ground_truth():
     with open(LABELS_FILE, 'r') as f:
@@ -24,8 +27,8 @@ def get_student_map(session: Session) -> Dict[int, str]:
     students = session.exec(select(Student)).all()
     return {s.id: s.student_id for s in students}
 
-def ensure_artifacts_dir():
-    REPORT_FILE.parent.mkdir(parents=True, exist_ok=True)
+def ensure_artifacts_dir(report_file: Path):
+    report_file.parent.mkdir(parents=True, exist_ok=True)
 
 def calculate_metrics(tp, fp, fn):
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0
@@ -34,21 +37,12 @@ def calculate_metrics(tp, fp, fn):
     accuracy = tp / (tp + fp + fn) # Basic definition for object detection context
     return precision, recall, f1, accuracy
 
-def main():
-    print("Starting Evaluation...")
-    ensure_artifacts_dir()
-    
-    # Initialize DB and Models
-    create_db_and_tables()
-    with Session(engine) as session:
-        students = session.exec(select(Student)).all()
-        print(f"Loading {len(students)} students from DB...")
-        ai_engine.load_roster_embeddings(students)
-        student_map = get_student_map(session)
-
-    ground_truth = load_ground_truth()
-    
-    results = []
+def evaluate_mode(detection_mode: str, ground_truth: Dict[str, List[str]], student_map: Dict[int, str]):
+    """
+    Runs recognition over every labelled image with one detection mode.
+    Returns (per-image report rows, summary dict).
+    """
+    rows = []
     total_latency = 0
     total_images = 0
     
@@ -57,25 +51,18 @@ def main():
     total_fp = 0
     total_fn = 0
 
-    report_lines = []
-    report_lines.append("# Evaluation Report\n")
-    report_lines.append(f"**Date**: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-    report_lines.append("## Per-Image Analysis\n")
-    report_lines.append("| Image | Latency (s) | Wanted IDs | Predicted IDs | TP | FP | FN |")
-    report_lines.append("|-------|-------------|------------|---------------|----|----|----|")
-
     for filename, expected_ids in ground_truth.items():
         image_path = IMAGES_DIR / filename
         if not image_path.exists():
             print(f"Warning: Image {filename} not found in {IMAGES_DIR}. Skipping.")
             continue
             
-        print(f"Processing {filename}...")
+        print(f"Processing {filename} ({detection_mode})...")
         
         start_time = time.time()
         # Run Inference
         try:
-            recognized_int_ids, unknown_count = ai_engine.recognize_faces(str(image_path))
+            recognized_int_ids, unknown_count = ai_engine.recognize_faces(str(image_path), detection_mode)
         except Exception as e:
             print(f"Error processing {filename}: {e}")
             continue
@@ -99,32 +86,259 @@ def main():
         total_fp += fp
         total_fn += fn
         
-        report_lines.append(f"| {filename} | {latency:.4f} | {', '.join(expected_ids)} | {', '.join(predicted_ids)} | {tp} | {fp} | {fn} |")
+        rows.append(f"| {filename} | {latency:.4f} | {', '.join(expected_ids)} | {', '.join(predicted_ids)} | {tp} | {fp} | {fn} |")
 
     # Aggregate Metrics
     precision, recall, f1, accuracy = calculate_metrics(total_tp, total_fp, total_fn)
     avg_latency = total_latency / total_images if total_images > 0 else 0
+    summary = {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "accuracy": accuracy,
+        "avg_latency": avg_latency,
+    }
+    return rows, summary
+
+# --- Threshold / strategy sweep ---
+# Detection and encoding dominate evaluation time but don't depend on the
+# tolerance, so the sweep runs them once per image and mode (cached by content
+# hash in static/cache, like uploads) and then scores every tolerance and
+# assignment strategy from each image's face-by-student distance matrix.
+
+def cached_encodings(image_path: Path, detection_mode: str) -> Tuple[Optional[np.ndarray], bool]:
+    """
+    Face encodings for an image, detected and encoded at most once per mode.
+    Returns (encodings, cache_hit); encodings is None if recognition failed,
+    and failures are not cached, so the next run retries them.
+    """
+    data = image_path.read_bytes()
+    digest = result_cache.image_hash(data)
+    key = ai_engine.face_cache_key(detection_mode)
+    cached = result_cache.load_faces(digest, key)
+    if cached is not None:
+        return cached[1], True
+    result = ai_engine.recognize(ai_engine.decode_image(data), detection_mode)
+    if result.error is not None:
+        return None, False
+    result_cache.save_faces(digest, key, result.face_locations, result.encodings)
+    return result.encodings, False
+
+def sweep_counts(distances: np.ndarray, is_expected: np.ndarray, n_expected: int,
+                 tolerances: np.ndarray, strategy: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    TP / FP / FN at every tolerance for one image.
+    distances: (faces, students); is_expected: (students,) whether each is in the ground truth.
+    """
+    tp = np.zeros(len(tolerances), dtype=np.int64)
+    fp = np.zeros(len(tolerances), dtype=np.int64)
+    if distances.size:
+        if strategy == "nearest":
+            # Each face claims its nearest student; a student is predicted from
+            # the lowest tolerance at which any face claims them
+            best = np.argmin(distances, axis=1)
+            claim = np.full(distances.shape[1], np.inf)
+            np.minimum.at(claim, best, distances[np.arange(len(best)), best])
+            predicted = claim[:, None] <= tolerances[None, :]
+            tp = (predicted & is_expected[:, None]).sum(axis=0)
+            fp = (predicted & ~is_expected[:, None]).sum(axis=0)
+        else:
+            # One-to-one assignment changes with the tolerance, so solve per
+            # value; on a class-sized matrix each solve is microseconds
+            for i, tolerance in enumerate(tolerances):
+                _, cols = assign(distances, tolerance)
+                tp[i] = is_expected[cols].sum()
+                fp[i] = len(cols) - tp[i]
+    return tp, fp, n_expected - tp
+
+def recommend(curve: Dict[str, np.ndarray], min_precision: Optional[float] = None) -> int:
+    """
+    Index of the recommended tolerance: the best F1 or, with min_precision,
+    the best recall that keeps precision at or above it. Ties go to the middle
+    of the tied range, the point furthest from either edge.
+    """
+    if min_precision is not None and (curve["precision"] >= min_precision).any():
+        score = np.where(curve["precision"] >= min_precision, curve["recall"], -1.0)
+    else:
+        score = curve["f1"]
+    tied = np.flatnonzero(np.isclose(score, score.max()))
+    return int(tied[len(tied) // 2])
+
+def sweep(args, ground_truth: Dict[str, List[str]], student_map: Dict[int, str]):
+    tolerances = np.linspace(args.tolerance_range[0], args.tolerance_range[1], int(args.tolerance_range[2]))
+    with ai_engine.roster.lock:
+        roster_ids, roster_embeddings = ai_engine.roster.ids.copy(), ai_engine.roster.embeddings.copy()
+    curves = {}
+    failures: Dict[str, List[str]] = {}
+    for detection_mode in args.modes:
+        start = time.perf_counter()
+        hits = 0
+        per_image = []
+        failed = failures[detection_mode] = []
+        for filename, expected_ids in ground_truth.items():
+            image_path = IMAGES_DIR / filename
+            if not image_path.exists():
+                print(f"Warning: Image {filename} not found in {IMAGES_DIR}. Skipping.")
+                continue
+            encodings, cache_hit = cached_encodings(image_path, detection_mode)
+            if encodings is None:
+                # Scoring it as "no faces" would count every expected student as missed
+                print(f"Warning: recognition failed on {filename} ({detection_mode}); left out of the sweep.")
+                failed.append(filename)
+                continue
+            hits += cache_hit
+            if len(encodings) and len(roster_ids):
+                distances, student_ids = collapse_by_student(distance_matrix(encodings, roster_embeddings), roster_ids)
+            else:
+                distances, student_ids = np.empty((len(encodings), 0)), np.empty(0, dtype=np.int64)
+            expected = set(expected_ids)
+            is_expected = np.array([student_map.get(int(i)) in expected for i in student_ids], dtype=bool)
+            per_image.append((distances, is_expected, len(expected)))
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for strategy in args.strategies:
+            tp = fp = fn = 0
+            for distances, is_expected, n_expected in per_image:
+                counts = sweep_counts(distances, is_expected, n_expected, tolerances, strategy)
+                tp, fp, fn = tp + counts[0], fp + counts[1], fn + counts[2]
+            precision = np.divide(tp, tp + fp, out=np.zeros(len(tolerances)), where=(tp + fp) > 0)
+            recall = np.divide(tp, tp + fn, out=np.zeros(len(tolerances)), where=(tp + fn) > 0)
+            f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(tolerances)),
+                           where=(precision + recall) > 0)
+            curves[(detection_mode, strategy)] = {"tolerance": tolerances, "precision": precision,
+                                                  "recall": recall, "f1": f1, "tp": tp, "fp": fp, "fn": fn}
+        print(f"{detection_mode}: {len(per_image)} images detected/encoded in {encode_seconds:.2f}s "
+              f"({hits} cached, {len(failed)} failed), {len(tolerances)} tolerances x "
+              f"{len(args.strategies)} strategies scored in {time.perf_counter() - start:.3f}s")
+    return curves, failures
+
+def sweep_report(args, curves, failures: Dict[str, List[str]]) -> List[str]:
+    lines = ["## Threshold Sweep\n",
+             f"{len(next(iter(curves.values()))['tolerance'])} tolerances from {args.tolerance_range[0]} "
+             f"to {args.tolerance_range[1]}; current default {DEFAULT_TOLERANCE}.\n",
+             "| Mode | Strategy | Recommended tolerance | Precision | Recall | F1 |",
+             "|------|----------|-----------------------|-----------|--------|----|"]
+    best_key, best_index = None, None
+    for key, curve in curves.items():
+        i = recommend(curve, args.min_precision)
+        lines.append(f"| {key[0]} | {key[1]} | {curve['tolerance'][i]:.3f} | {curve['precision'][i]:.2%} | "
+                     f"{curve['recall'][i]:.2%} | {curve['f1'][i]:.2%} |")
+        if best_key is None or curve["f1"][i] > curves[best_key]["f1"][best_index]:
+            best_key, best_index = key, i
+
+    curve = curves[best_key]
+    print(f"\nRecommended operating point: {best_key[0]} detection, {best_key[1]} assignment, "
+          f"tolerance {curve['tolerance'][best_index]:.3f} (precision {curve['precision'][best_index]:.2%}, "
+          f"recall {curve['recall'][best_index]:.2%}, F1 {curve['f1'][best_index]:.2%})")
+    lines.append(f"\n**Recommended**: `{best_key[0]}` detection, `{best_key[1]}` assignment, "
+                 f"tolerance **{curve['tolerance'][best_index]:.3f}**\n")
+    lines.append(f"### Precision / recall curve ({best_key[0]}, {best_key[1]})\n")
+    lines.append("| Tolerance | Precision | Recall | F1 | TP | FP | FN |")
+    lines.append("|-----------|-----------|--------|----|----|----|----|")
+    for i, tolerance in enumerate(curve["tolerance"]):
+        marker = " **<-**" if i == best_index else ""
+        lines.append(f"| {tolerance:.3f} | {curve['precision'][i]:.2%} | {curve['recall'][i]:.2%} | "
+                     f"{curve['f1'][i]:.2%} | {curve['tp'][i]} | {curve['fp'][i]} | {curve['fn'][i]} |{marker}")
+    if any(failures.values()):
+        lines.append("\n### Images left out (recognition failed)\n")
+        for mode, filenames in failures.items():
+            if filenames:
+                lines.append(f"- {mode}: {', '.join(filenames)}")
+    return lines
+
+def write_curves(path: str, curves):
+    with open(path, "w") as f:
+        json.dump([
+            {"mode": mode, "strategy": strategy, **{name: values.tolist() for name, values in curve.items()}}
+            for (mode, strategy), curve in curves.items()
+        ], f, indent=2)
+    print(f"Curves saved to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate recognition against test_labels.json")
+    parser.add_argument("--modes", nargs="+", default=list(ai_engine.DETECTION_MODES), choices=ai_engine.DETECTION_MODES,
+                        help="Detection modes to compare (latency vs recall)")
+    parser.add_argument("--report", type=Path, default=REPORT_FILE, help="Markdown report path")
+    parser.add_argument("--sweep", action="store_true",
+                        help="Sweep tolerances and assignment strategies over cached detections instead of timing each mode")
+    parser.add_argument("--tolerance-range", type=float, nargs=3, default=[0.3, 0.8, 50], metavar=("START", "STOP", "COUNT"),
+                        help="Tolerance grid for --sweep")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=STRATEGIES,
+                        help="hungarian: one-to-one assignment (what the API uses); nearest: each face takes its nearest student")
+    parser.add_argument("--min-precision", type=float, default=None,
+                        help="Recommend the highest-recall tolerance with at least this precision (default: best F1)")
+    parser.add_argument("--curves", default=None, help="Also write the sweep curves as JSON here")
+    args = parser.parse_args()
+    
+    print("Starting Evaluation...")
+    ensure_artifacts_dir(args.report)
+    
+    # Initialize DB and Models
+    create_db_and_tables()
+    with Session(engine) as session:
+        students = session.exec(select(Student)).all()
+        print(f"Loading {len(students)} students from DB...")
+        # Read-only: only the API process rewrites the store
+        ai_engine.load_roster_embeddings(students, compact=False)
+        student_map = get_student_map(session)
+
+    ground_truth = load_ground_truth()
+    
+    report_lines = []
+    report_lines.append("# Evaluation Report\n")
+    report_lines.append(f"**Date**: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
+    if args.sweep:
+        curves, failures = sweep(args, ground_truth, student_map)
+        report_lines.extend(sweep_report(args, curves, failures))
+        if args.curves:
+            write_curves(args.curves, curves)
+        with open(args.report, "w") as f:
+            f.write("\n".join(report_lines))
+        print(f"Report saved to {args.report}")
+        return
+    
+    summaries = {}
+    for detection_mode in args.modes:
+        rows, summary = evaluate_mode(detection_mode, ground_truth, student_map)
+        summaries[detection_mode] = summary
+        
+        report_lines.append(f"## Per-Image Analysis ({detection_mode} detection)\n")
+        report_lines.append("| Image | Latency (s) | Wanted IDs | Predicted IDs | TP | FP | FN |")
+        report_lines.append("|-------|-------------|------------|---------------|----|----|----|")
+        report_lines.extend(rows)
+        
+        report_lines.append(f"\n## Aggregate Metrics ({detection_mode} detection)\n")
+        report_lines.append("| Metric | Value |")
+        report_lines.append("|--------|-------|")
+        report_lines.append(f"| **Precision** | {summary['precision']:.2%} |")
+        report_lines.append(f"| **Recall** | {summary['recall']:.2%} |")
+        report_lines.append(f"| **F1 Score** | {summary['f1']:.2%} |")
+        report_lines.append(f"| **Accuracy** (TP / All) | {summary['accuracy']:.2%} |")
+        report_lines.append(f"| **Average Latency** | {summary['avg_latency']:.4f}s |\n")
 
     print("\n--- Summary ---")
-    print(f"Precision: {precision:.2%}")
-    print(f"Recall:    {recall:.2%}")
-    print(f"F1 Score:  {f1:.2%}")
-    print(f"Avg Latency: {avg_latency:.4f}s")
-
-    report_lines.append("\n## Aggregate Metrics\n")
-    report_lines.append("| Metric | Value |")
-    report_lines.append("|--------|-------|")
-    report_lines.append(f"| **Precision** | {precision:.2%} |")
-    report_lines.append(f"| **Recall** | {recall:.2%} |")
-    report_lines.append(f"| **F1 Score** | {f1:.2%} |")
-    report_lines.append(f"| **Accuracy** (TP / All) | {accuracy:.2%} |")
-    report_lines.append(f"| **Average Latency** | {avg_latency:.4f}s |")
+    print(f"{'Mode':<10} {'Precision':>10} {'Recall':>10} {'F1':>10} {'Latency':>10}")
+    for detection_mode, summary in summaries.items():
+        print(f"{detection_mode:<10} {summary['precision']:>10.2%} {summary['recall']:>10.2%} {summary['f1']:>10.2%} {summary['avg_latency']:>9.4f}s")
+
+    if len(summaries) > 1:
+        baseline = summaries[args.modes[0]]
+        report_lines.append("## Detection Mode Trade-off\n")
+        report_lines.append(f"Expected face size: {ai_engine.EXPECTED_FACE_PX}px (adaptive scale down to {ai_engine.detection_scale():.2f}, "
+                            f"long side kept >= {ai_engine.ADAPTIVE_MIN_SIDE}px)\n")
+        report_lines.append(f"| Mode | Avg Latency (s) | Speedup vs {args.modes[0]} | Recall | Precision | F1 |")
+        report_lines.append("|------|-----------------|---------|--------|-----------|----|")
+        for detection_mode, summary in summaries.items():
+            speedup = baseline["avg_latency"] / summary["avg_latency"] if summary["avg_latency"] > 0 else 0
+            report_lines.append(f"| {detection_mode} | {summary['avg_latency']:.4f} | {speedup:.2f}x | {summary['recall']:.2%} | {summary['precision']:.2%} | {summary['f1']:.2%} |")
     
     # Save Report
-    with open(REPORT_FILE, "w") as f:
+    with open(args.report, "w") as f:
         f.write("\n".join(report_lines))
         
-    print(f"Report saved to {REPORT_FILE}")
+    print(f"Report saved to {args.report}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,76 @@
+"""
+Per-student face templates for multi-sample enrollment.
+
+A student enrolled from several photos is searched as a small, fixed-size set
+of rows instead of every sample: with up to TEMPLATE_PROTOTYPES + 1 samples
+the samples themselves, beyond that their centroid plus TEMPLATE_PROTOTYPES
+prototypes (the samples nearest the centres of a k-means over them, so each
+prototype is a real face rather than a blend). Matching cost therefore grows
+with the number of students, not with the number of photos taken of them.
+
+The matcher scores a face against a student by the closest row of their
+template (see matching.py), so results still collapse to one per student.
+"""
+import os
+from typing import Tuple
+
+import numpy as np
+
+TEMPLATE_PROTOTYPES = int(os.environ.get("TEMPLATE_PROTOTYPES", "3"))
+
+
+def _prototypes(samples: np.ndarray, k: int, iters: int = 10) -> np.ndarray:
+    # Deterministic farthest-point initialisation, then Lloyd's iterations
+    centers = [samples[np.argmax(np.linalg.norm(samples - samples.mean(axis=0), axis=1))]]
+    for _ in range(1, k):
+        dist = np.min([np.linalg.norm(samples - c, axis=1) for c in centers], axis=0)
+        centers.append(samples[np.argmax(dist)])
+    centers = np.array(centers)
+    for _ in range(iters):
+        labels = np.argmin(np.linalg.norm(samples[:, None, :] - centers[None, :, :], axis=2), axis=1)
+        for j in range(k):
+            members = samples[labels == j]
+            if len(members):
+                centers[j] = members.mean(axis=0)
+    # Snap each centre to its nearest real sample (distinct samples only)
+    nearest = np.argmin(np.linalg.norm(samples[:, None, :] - centers[None, :, :], axis=2), axis=0)
+    return samples[np.unique(nearest)]
+
+
+def build_template(samples, prototypes: int = TEMPLATE_PROTOTYPES) -> np.ndarray:
+    """
+    (n, 128) samples of one student -> (k, 128) template rows, k <= prototypes + 1.
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(len(samples), -1)
+    if len(samples) <= prototypes + 1:
+        return samples
+    centroid = samples.mean(axis=0, keepdims=True)
+    return np.vstack([centroid, _prototypes(samples, prototypes)]).astype(np.float32)
+
+
+def build_roster(primary_ids: np.ndarray, primary_embeddings: np.ndarray,
+                 sample_ids: np.ndarray, sample_embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Combines primary embeddings (one per student) with extra samples into
+    template rows. Students without extra samples keep their single row, and
+    with no extra samples at all the primary arrays are returned untouched
+    (still zero-copy).
+    """
+    if len(sample_ids) == 0:
+        return primary_ids, primary_embeddings
+
+    sample_ids = np.asarray(sample_ids)
+    has_samples = np.isin(primary_ids, sample_ids)
+    ids = [np.asarray(primary_ids[~has_samples])]
+    embeddings = [np.asarray(primary_embeddings[~has_samples])]
+
+    order = np.argsort(sample_ids, kind="stable")
+    sorted_ids = sample_ids[order]
+    for row in np.flatnonzero(has_samples):
+        student_id = primary_ids[row]
+        lo, hi = np.searchsorted(sorted_ids, student_id, side="left"), np.searchsorted(sorted_ids, student_id, side="right")
+        samples = np.vstack([primary_embeddings[row:row + 1], sample_embeddings[order[lo:hi]]])
+        template = build_template(samples)
+        ids.append(np.full(len(template), student_id, dtype=np.int64))
+        embeddings.append(template)
+    return np.concatenate(ids), np.concatenate(embeddings).astype(np.float32)
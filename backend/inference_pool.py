@@ -0,0 +1,292 @@
+"""
+Process pool for CPU-bound inference (face detection/encoding, BLIP captioning).
+
+Face and caption models hold the GIL for seconds at a time, so running them in
+an `async def` endpoint freezes the whole uvicorn worker. Endpoints await
+InferencePool methods instead; the work runs in separate processes, each with
+its own loaded models and its own roster snapshot. Roster-dependent tasks
+carry the API's roster version plus the index changes (enrollments,
+deletions) that the workers may not have seen yet; a worker that is behind
+replays them, and only rebuilds from the DB + roster store when it has
+fallen further behind than the change log reaches (or after a full reload).
+
+INFERENCE_WORKERS sets the pool size (default 2). 0 runs inference on a thread
+in the API process instead, which still keeps the event loop free but does
+not scale across cores. CAPTION_WARMUP=false skips loading BLIP at startup
+(it is then loaded by the first upload).
+
+Each worker pins torch to its share of the cores (cpu_count / workers, or
+TORCH_THREADS if set); left at torch's default, every worker would spin up a
+thread per core and they'd thrash each other.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+import ai_engine
+from roster_index import RosterChange
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "2"))
+CAPTION_WARMUP = os.environ.get("CAPTION_WARMUP", "true").lower() not in ("0", "false", "no", "off")
+
+# Roster version this worker process last synced to (worker-side state)
+_worker_roster_version: Optional[int] = None
+
+
+def _init_worker(torch_threads: int):
+    # Runs before any model is loaded in this worker, so the setting sticks
+    ai_engine.TORCH_THREADS = torch_threads
+
+
+class RosterSync(NamedTuple):
+    """The API's roster version, and changes for workers that are behind it."""
+    version: int
+    changes: List[RosterChange]
+
+
+def _catch_up(sync: RosterSync) -> bool:
+    # Replays the changes after this worker's version; False if they don't reach back to it
+    missing = [change for change in sync.changes if change.version > _worker_roster_version]
+    if not missing or missing[0].version != _worker_roster_version + 1 or missing[-1].version != sync.version:
+        return False
+    ai_engine.roster.apply_changes(missing)
+    return True
+
+
+def _sync_roster(sync: RosterSync):
+    global _worker_roster_version
+    if _worker_roster_version == sync.version:
+        return
+    if _worker_roster_version is not None and _catch_up(sync):
+        _worker_roster_version = sync.version
+        return
+    from sqlmodel import Session, select
+    from database import engine
+    from models import Student
+
+    with Session(engine) as session:
+        students = session.exec(select(Student)).all()
+    ai_engine.load_roster_embeddings(students, compact=False)
+    _worker_roster_version = sync.version
+
+
+def _synced_task(sync: RosterSync, fn, *args):
+    """
+    Brings this worker's roster up to `sync` and runs fn. Returns (pid,
+    roster version, result) so the pool knows how far each worker has got.
+    """
+    _sync_roster(sync)
+    return os.getpid(), _worker_roster_version, fn(*args)
+
+
+class SharedImage(NamedTuple):
+    """
+    Picklable handle to a decoded image in shared memory, so several workers
+    can read one decode without each receiving a copy.
+    """
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+# What inference tasks accept: a path, a decoded array (in-process), or a shared handle
+ImageInput = Union[str, np.ndarray, SharedImage]
+
+
+@contextmanager
+def _resolve(image: ImageInput):
+    if not isinstance(image, SharedImage):
+        yield image
+        return
+    # Spawned workers share the API process's resource tracker, so attaching
+    # here doesn't take ownership; the API process unlinks the block.
+    shm = SharedMemory(name=image.name)
+    array = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+    try:
+        yield array
+    finally:
+        del array
+        shm.close()
+
+
+def _recognize_task(image: ImageInput, detection_mode: str,
+                    face_locations=None, scope=None) -> ai_engine.FaceRecognition:
+    with _resolve(image) as resolved:
+        result = ai_engine.recognize(resolved, detection_mode, face_locations, scope)
+    # Report the API's roster version, which is what the snapshot corresponds to
+    return result._replace(roster_version=_worker_roster_version)
+
+
+def _detection_job_task(image: ImageInput, job):
+    with _resolve(image) as resolved:
+        return ai_engine.run_detection_job(resolved, job)
+
+
+def _caption_task(image: ImageInput) -> str:
+    with _resolve(image) as resolved:
+        return ai_engine.analyze_classroom_vibe(resolved)
+
+
+def _caption_batch_task(images: List[ImageInput]) -> List[str]:
+    with ExitStack() as stack:
+        resolved = [stack.enter_context(_resolve(image)) for image in images]
+        try:
+            return ai_engine.caption_images(resolved)
+        finally:
+            # Views must be gone before the shared blocks are closed
+            del resolved
+
+
+def _video_task(path: str, detection_mode: str, scope=None):
+    import video_attendance
+    result = video_attendance.video_attendance(path, detection_mode, scope)
+    return result._replace(roster_version=_worker_roster_version)
+
+
+def _encode_task(image_path: str):
+    return ai_engine.encode_face(image_path)
+
+
+def _warmup_task() -> str:
+    ai_engine.load_captioning_model()
+    return ai_engine.captioning_status()
+
+
+class InferencePool:
+    def __init__(self, workers: int = INFERENCE_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Captioning model state across the pool, as reported by warmup().
+        # "lazy" means no warmup: each worker loads BLIP on its first caption.
+        self.captioning_status = ai_engine.captioning_status()
+        if self.captioning_status == "not_loaded" and not CAPTION_WARMUP:
+            self.captioning_status = "lazy"
+        # Roster version each worker process (by pid) last reported
+        self._worker_versions: Dict[int, int] = {}
+        if workers > 0:
+            # spawn, not fork: forking a process that already holds torch/dlib
+            # threads can deadlock, and every worker should load its own models.
+            torch_threads = ai_engine.TORCH_THREADS or max(1, (os.cpu_count() or 1) // workers)
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(torch_threads,),
+            )
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _roster_sync(self) -> RosterSync:
+        roster = ai_engine.roster
+        with roster.lock:
+            # Only the changes the furthest-behind worker is missing; workers
+            # not heard from yet may be anywhere, so they get the whole log
+            known = self._worker_versions.values()
+            floor = min(known) if len(self._worker_versions) >= self.workers else roster.change_log_base
+            changes = roster.changes_since(floor)
+            if changes is None:
+                changes = roster.changes_since(roster.change_log_base)
+            return RosterSync(roster.version, changes)
+
+    async def _run_synced(self, fn, *args):
+        pid, version, result = await self._run(_synced_task, self._roster_sync(), fn, *args)
+        self._worker_versions[pid] = version
+        return result
+
+    @contextmanager
+    def share(self, image: np.ndarray):
+        """
+        Makes a decoded image available to workers for the duration of the block.
+        Yields something recognize / analyze_classroom_vibe accept.
+        """
+        if self._executor is None:
+            yield image
+            return
+        shm = SharedMemory(create=True, size=max(1, image.nbytes))
+        try:
+            shared = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+            shared[...] = image
+            del shared
+            yield SharedImage(shm.name, image.shape, image.dtype.str)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    async def recognize(self, image: ImageInput,
+                        detection_mode: str = ai_engine.DEFAULT_DETECTION_MODE,
+                        scope: Optional[Tuple[int, ...]] = None) -> ai_engine.FaceRecognition:
+        """
+        scope: enrolled Student IDs to match against (a course), or None for the whole roster.
+        """
+        if self._executor is None:
+            # Same process: the live roster index is already current
+            return await self._run(ai_engine.recognize, image, detection_mode, None, scope)
+        
+        face_locations = None
+        detect_seconds = None
+        if detection_mode == "tiled" and isinstance(image, SharedImage):
+            # Fan the tiles out across the pool, then merge duplicates from the overlaps
+            start = time.perf_counter()
+            jobs = ai_engine.tiled_detection_plan(image.shape)
+            per_job = await asyncio.gather(*(self._run(_detection_job_task, image, job) for job in jobs))
+            with _resolve(image) as resolved:
+                retries = ai_engine.tiled_retry_plan(resolved, jobs, per_job)
+            per_job += await asyncio.gather(*(self._run(_detection_job_task, image, job) for job in retries))
+            face_locations = ai_engine.non_max_suppression([box for boxes in per_job for box in boxes])
+            detect_seconds = time.perf_counter() - start
+        result = await self._run_synced(_recognize_task, image, detection_mode, face_locations, scope)
+        if detect_seconds is not None:
+            result = result._replace(timings={**(result.timings or {}), "detect": detect_seconds})
+        return result
+
+    async def analyze_classroom_vibe(self, image: ImageInput) -> str:
+        return await self._run(_caption_task, image)
+
+    async def caption_batch(self, images: List[ImageInput]) -> List[str]:
+        return await self._run(_caption_batch_task, images)
+
+    async def video_attendance(self, path: str, detection_mode: str = "adaptive",
+                               scope: Optional[Tuple[int, ...]] = None):
+        """
+        Processes a whole video in one worker (see video_attendance.py).
+        scope: enrolled Student IDs to match against (a course), or None for the whole roster.
+        """
+        if self._executor is None:
+            import video_attendance
+            return await self._run(video_attendance.video_attendance, path, detection_mode, scope)
+        return await self._run_synced(_video_task, path, detection_mode, scope)
+
+    async def encode_face(self, image_path: str):
+        return await self._run(_encode_task, image_path)
+
+    async def warmup(self):
+        """
+        Loads the captioning model in every worker in the background, so the
+        first upload doesn't pay for it. Each warmup task occupies its worker
+        while loading, so one task per worker lands one on each.
+        """
+        if not ai_engine.CAPTIONING_ENABLED:
+            return
+        self.captioning_status = "loading"
+        results = await asyncio.gather(
+            *(self._run(_warmup_task) for _ in range(max(1, self.workers))),
+            return_exceptions=True,
+        )
+        if all(r == "loaded" for r in results):
+            self.captioning_status = "loaded"
+        else:
+            self.captioning_status = "failed"
+            print(f"Captioning warmup failed: {results}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
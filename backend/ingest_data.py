@@ -1,58 +1,175 @@
 
+import argparse
+import json
+import multiprocessing
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 # Fix path to import modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from database import engine, Session, create_db_and_tables
 from models import Student
-from ai_engine import register_face
+from ai_engine import encode_face
+import roster_store
 from sqlmodel import select
 
-def ingest_roster():
+ROSTER_DIR = "static/roster"
+MANIFEST_FILE = os.path.join(ROSTER_DIR, "ingest_manifest.jsonl")
+
+# Manifest outcomes that don't need redoing on resume ("error" is retried)
+REGISTERED = "registered"
+NO_FACE = "no_face"
+ERROR = "error"
+
+def parse_filename(filename: str):
+    # Parse filename format: Name_ID.ext
+    name_part = os.path.splitext(filename)[0]
+    if "_" in name_part:
+        parts = name_part.split("_")
+        return parts[0], parts[1]
+    return name_part, f"UNK-{name_part}"
+
+def _file_key(path: str) -> str:
+    # A replaced photo (new size or mtime) is ingested again
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+def load_manifest(path: str) -> dict:
+    """
+    file key -> last manifest entry. The manifest is append-only JSON lines,
+    so a torn final line (interrupted mid-write) is simply ignored.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            done[entry["key"]] = entry
+    return done
+
+def _encode_file(job):
+    path, retry_upsample = job
+    try:
+        # Errors must surface: a file recorded as no_face is never retried
+        return encode_face(path, retry_upsample=retry_upsample, raise_errors=True), None
+    except Exception as e:
+        return None, str(e)
+
+def _commit_batch(session: Session, batch, manifest_file, retry_upsample: bool):
+    """
+    Inserts one batch of students and appends their embeddings.
+    Order matters for crash safety: ids come from the flush, the embeddings
+    are appended before the commit (an orphaned row for an uncommitted id is
+    superseded or compacted away), and the manifest is written last, so an
+    interrupted batch is simply redone. The store lock is held from before
+    the flush to after the commit, so an API compaction can't drop the rows
+    in between.
+    """
+    students = [Student(name=name, student_id=student_id, face_encoding_path=roster_store.EMBEDDINGS_FILE)
+                for _, name, student_id, _ in batch]
+    with roster_store.locked():
+        session.add_all(students)
+        session.flush()
+        roster_store.append_embeddings([s.id for s in students], [encoding for _, _, _, encoding in batch])
+        session.commit()
+    for key, name, student_id, _ in batch:
+        manifest_file.write(json.dumps({"key": key, "student_id": student_id, "status": REGISTERED,
+                                        "retry_upsample": retry_upsample}) + "\n")
+    manifest_file.flush()
+    os.fsync(manifest_file.fileno())
+
+def ingest_roster(roster_dir: str = ROSTER_DIR, workers: int = 0, batch_size: int = 64,
+                  manifest_path: str = MANIFEST_FILE, retry_upsample: bool = True):
+    """
+    Enrolls every Name_ID.jpg photo in roster_dir that isn't in the DB yet.
+    Faces are encoded across a process pool; students are committed in
+    batches; progress is checkpointed to the manifest so a rerun after an
+    interruption picks up where it stopped.
+    """
     create_db_and_tables()
-    roster_dir = "static/roster"
-    
+    start = time.perf_counter()
+
     # Files to ingest
-    files = [f for f in os.listdir(roster_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    
+    files = sorted(f for f in os.listdir(roster_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    manifest = load_manifest(manifest_path)
+
+    # One query for every existing ID instead of one per file
     with Session(engine) as session:
-        for filename in files:
-            # Parse filename format: Name_ID.ext
-            try:
-                name_part = os.path.splitext(filename)[0]
-                if "_" in name_part:
-                    parts = name_part.split("_")
-                    name = parts[0]
-                    student_id = parts[1]
-                else:
-                    name = name_part
-                    student_id = f"UNK-{name_part}"
-                
-                # Check if exists
-                statement = select(Student).where(Student.student_id == student_id)
-                existing = session.exec(statement).first()
-                
-                if existing:
-                    print(f"Skipping {name} ({student_id}) - Already exists")
-                    continue
-                
-                print(f"Processing {name} ({student_id})...")
-                file_path = os.path.join(roster_dir, filename)
-                
-                # Register face
-                encoding_path = register_face(student_id, file_path)
-                
-                if encoding_path:
-                    student = Student(name=name, student_id=student_id, face_encoding_path=encoding_path)
-                    session.add(student)
-                    session.commit()
-                    print(f"Successfully registered {name}")
-                else:
-                    print(f"Failed to find face in {filename}")
-                    
-            except Exception as e:
-                print(f"Error processing {filename}: {e}")
+        existing_ids = set(session.exec(select(Student.student_id)).all())
+
+    counts = {"existing": 0, "checkpointed": 0, "duplicate": 0, REGISTERED: 0, NO_FACE: 0, ERROR: 0}
+    todo = []
+    queued_ids = set()
+    for filename in files:
+        name, student_id = parse_filename(filename)
+        path = os.path.join(roster_dir, filename)
+        key = _file_key(path)
+        if student_id in existing_ids:
+            counts["existing"] += 1
+            continue
+        previous = manifest.get(key)
+        # A no-face result only stands if this run wouldn't try harder than that one did
+        if previous and (previous["status"] == REGISTERED or
+                         (previous["status"] == NO_FACE and (previous.get("retry_upsample") or not retry_upsample))):
+            counts["checkpointed"] += 1
+            continue
+        if student_id in queued_ids:
+            print(f"Skipping {filename} - student ID {student_id} already taken by another file")
+            counts["duplicate"] += 1
+            continue
+        queued_ids.add(student_id)
+        todo.append((key, name, student_id, path))
+
+    skipped = counts["existing"] + counts["checkpointed"] + counts["duplicate"]
+    print(f"{len(files)} photos: {len(todo)} to process, {skipped} skipped "
+          f"({counts['existing']} already enrolled, {counts['checkpointed']} done in a previous run)")
+
+    workers = workers or os.cpu_count() or 1
+    batch = []
+    encode_start = time.perf_counter()
+    with Session(engine) as session, open(manifest_path, "a") as manifest_file, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        jobs = [(path, retry_upsample) for _, _, _, path in todo]
+        for i, (encoding, error) in enumerate(pool.map(_encode_file, jobs, chunksize=4)):
+            key, name, student_id, path = todo[i]
+            if encoding is not None:
+                batch.append((key, name, student_id, encoding))
+                counts[REGISTERED] += 1
+            else:
+                status = ERROR if error else NO_FACE
+                print(f"Failed to find face in {os.path.basename(path)}" if status == NO_FACE
+                      else f"Error processing {os.path.basename(path)}: {error}")
+                counts[status] += 1
+                manifest_file.write(json.dumps({"key": key, "student_id": student_id, "status": status,
+                                                "retry_upsample": retry_upsample}) + "\n")
+            if len(batch) >= batch_size:
+                _commit_batch(session, batch, manifest_file, retry_upsample)
+                batch = []
+                done = i + 1
+                rate = done / (time.perf_counter() - encode_start)
+                print(f"  {done}/{len(todo)} processed ({rate:.1f} photos/s)")
+        if batch:
+            _commit_batch(session, batch, manifest_file, retry_upsample)
+
+    elapsed = time.perf_counter() - start
+    print(f"\nIngested {counts[REGISTERED]} students in {elapsed:.1f}s "
+          f"({len(todo) / max(elapsed, 1e-9):.1f} photos/s with {workers} workers)")
+    print(f"  no face: {counts[NO_FACE]}, errors: {counts[ERROR]}, skipped: {skipped}")
+    return counts
 
 if __name__ == "__main__":
-    ingest_roster()
+    parser = argparse.ArgumentParser(description="Enroll students from Name_ID.jpg photos in static/roster.")
+    parser.add_argument("--roster-dir", default=ROSTER_DIR)
+    parser.add_argument("--workers", type=int, default=0, help="Encoding processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Students per DB commit")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="Checkpoint file for resuming")
+    parser.add_argument("--no-upsample-retry", action="store_true",
+                        help="Skip the slow 2x-upsample retry for photos with no face found")
+    args = parser.parse_args()
+    ingest_roster(args.roster_dir, args.workers, args.batch_size, args.manifest, not args.no_upsample_retry)
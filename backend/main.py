@@ -1,13 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlmodel import Session, select
-from typing import List
+from sqlmodel import Session, select, delete, insert
+from typing import List, Optional, Tuple
+from datetime import date, datetime
 import shutil
 import os
+import asyncio
+import json
+import time
 from contextlib import asynccontextmanager
-from database import create_db_and_tables, get_session
-from models import Student, AttendanceSession, AttendanceRecord
-from ai_engine import register_face, recognize_faces, analyze_classroom_vibe, load_roster_embeddings
+from database import create_db_and_tables, get_session, engine
+from models import (Student, AttendanceSession, AttendanceRecord, AttendanceCorrection, Course, Enrollment,
+                    CourseCreate, EnrollmentChange)
+from ai_engine import load_roster_embeddings, roster, DETECTION_MODES, DEFAULT_DETECTION_MODE, add_face_sample
+from inference_pool import InferencePool, CAPTION_WARMUP
+from pipeline import AttendancePipeline, PipelineResult
+from caption_batcher import CaptionBatcher
+from roster_index import RosterCorruptionError
+from attendance_jobs import JobQueue, QueueFull
+import pagination
+import attendance_stats
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor
+import roster_store
+import result_cache
+import metrics
+from PIL import Image
 
 # Lifespan header removed as on_startup is used below
 
@@ -27,19 +45,94 @@ app.add_middleware(
 # Mount static files to serve images clearly
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    Times every request, and reports the stages it went through in a
+    Server-Timing header (see metrics.py).
+    """
+    timings = metrics.begin_request()
+    profiler = metrics.start_profiler()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - start
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        if profiler is not None:
+            metrics.finish_profiler(profiler, elapsed, f"{request.method} {route}")
+    metrics.REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+    response.headers["Server-Timing"] = metrics.server_timing({**timings, "total": elapsed})
+    return response
+
+# Face/BLIP inference runs here, off the event loop (see inference_pool.py)
+inference = InferencePool()
+captioner = CaptionBatcher(inference)
+pipeline = AttendancePipeline(inference, captioner)
+
+def reload_roster(session: Session):
+    # Held across the query: compaction must not drop rows of students
+    # another process (ingest) is committing right now
+    with roster_store.locked():
+        students = session.exec(select(Student)).all()
+        load_roster_embeddings(students)
+
+def update_roster(session: Session, change):
+    """
+    Applies a single-student change to the in-memory roster index.
+    Falls back to a full reload only if the index turns out to be corrupt.
+    """
+    try:
+        change()
+    except RosterCorruptionError as e:
+        print(f"Roster index corrupt ({e}). Rebuilding...")
+        reload_roster(session)
+
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
     # Initial load
-    from database import engine
     with Session(engine) as session:
-        students = session.exec(select(Student)).all()
-        load_roster_embeddings(students)
+        reload_roster(session)
+        attendance_stats.rebuild_if_missing(session)
+
+@app.on_event("startup")
+async def start_background_work():
+    # Not awaited: the API starts serving while models load in the background
+    if CAPTION_WARMUP:
+        app.state.warmup_task = asyncio.create_task(inference.warmup())
+    jobs.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    jobs.shutdown()
+    captioner.shutdown()
+    inference.shutdown()
 
 @app.get("/")
 def read_root():
     return {"message": "Gen-AI Classroom Attendance System API"}
 
+@app.get("/health/ready")
+def readiness():
+    """
+    Reports whether the roster and the captioning model are loaded.
+    Ready once startup loading has finished; a failed BLIP load only degrades
+    the analysis text, so it doesn't hold readiness back.
+    """
+    captioning = inference.captioning_status
+    return {
+        "ready": roster.version > 0 and captioning not in ("loading", "not_loaded"),
+        "roster_size": len(roster),
+        "captioning": captioning,
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Stage latencies, face counts, cache hits and roster size in Prometheus text format."""
+    metrics.ROSTER_SIZE.set(len(roster))
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/students/")
 async def create_student(
     name: str = Form(...),
@@ -59,96 +152,353 @@ async def create_student(
     
     # Process Face Encoding
     try:
-        encoding_path = register_face(student_id, file_path)
+        encoding = await inference.encode_face(file_path)
     except Exception as e:
          raise HTTPException(status_code=400, detail=f"Error processing face: {str(e)}")
 
-    if not encoding_path:
+    if encoding is None:
         raise HTTPException(status_code=400, detail="No face found in image")
 
-    student = Student(name=name, student_id=student_id, face_encoding_path=encoding_path)
+    student = Student(name=name, student_id=student_id, face_encoding_path=roster_store.EMBEDDINGS_FILE)
     session.add(student)
     session.commit()
     session.refresh(student)
     
-    # Reload embeddings
-    students = session.exec(select(Student)).all()
-    load_roster_embeddings(students)
+    # Embeddings are keyed by DB id, so append only once the row exists
+    roster_store.append_embedding(student.id, encoding)
+    update_roster(session, lambda: roster.add(student.id, encoding))
     
     return student
 
-@app.post("/attendance/mark")
-async def mark_attendance(
+@app.post("/students/{student_id}/photos")
+async def add_student_photo(
+    student_id: int,
     file: UploadFile = File(...),
     session: Session = Depends(get_session)
 ):
-    # Save Classroom Image
-    file_path = f"static/uploads/{file.filename}"
+    """
+    Enrolls another photo of an existing student (different lighting, angle,
+    glasses...). The student is then matched against a compact template built
+    from all their photos.
+    """
+    student = session.get(Student, student_id)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    # Kept out of static/roster itself so ingest_data doesn't take them for new students
+    os.makedirs("static/roster/samples", exist_ok=True)
+    file_path = f"static/roster/samples/{student.student_id}_{os.path.basename(file.filename)}"
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
-        
-    # 1. Recognize Faces
-    present_student_ids, unknown_count = recognize_faces(file_path)
     
-    # 2. Analyze Vibe
-    analysis = analyze_classroom_vibe(file_path)
+    try:
+        encoding = await inference.encode_face(file_path)
+    except Exception as e:
+         raise HTTPException(status_code=400, detail=f"Error processing face: {str(e)}")
     
-    # 3. Save Session
-    att_session = AttendanceSession(classroom_image_path=file_path, ai_analysis_report=analysis)
-    session.add(att_session)
-    session.commit()
-    session.refresh(att_session)
-    
-    # 4. Create Records
-    all_students = session.exec(select(Student)).all()
-    records = []
-    
-    records_to_return = []
-    
-    for student in all_students:
-        status = "PRESENT" if student.id in present_student_ids else "ABSENT"
-        record = AttendanceRecord(
-            session_id=att_session.id,
-            student_id=student.id,
-            status=status
-        )
-        session.add(record)
-        # We delay appending to header response list until we have IDs
+    if encoding is None:
+        raise HTTPException(status_code=400, detail="No face found in image")
+    
+    template = add_face_sample(student.id, encoding)
+    update_roster(session, lambda: roster.add(student.id, template))
+    
+    return {"student_id": student.id, "template_rows": len(template)}
+
+def course_scope(session: Session, course_id: Optional[int]) -> Optional[Tuple[int, ...]]:
+    """Enrolled Student IDs of a course (None: no course, match the whole roster)."""
+    if course_id is None:
+        return None
+    if not session.get(Course, course_id):
+        raise HTTPException(status_code=404, detail="Course not found")
+    return tuple(session.exec(select(Enrollment.student_id).where(Enrollment.course_id == course_id)).all())
+
+@app.post("/attendance/mark")
+async def mark_attendance(
+    file: UploadFile = File(...),
+    detection_mode: str = Form(DEFAULT_DETECTION_MODE),
+    course_id: Optional[int] = Form(None),
+    session: Session = Depends(get_session)
+):
+    if detection_mode not in DETECTION_MODES:
+        raise HTTPException(status_code=400, detail=f"detection_mode must be one of {', '.join(DETECTION_MODES)}")
+    scope = course_scope(session, course_id)
+    
+    # 1 + 2. Decode once, then recognize faces and analyze vibe concurrently
+    # (the classroom image is saved by content hash, off the critical path;
+    # repeat uploads are served from the result cache)
+    data = await file.read()
+    try:
+        result = await pipeline.run(data, file.filename, detection_mode, scope=scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return save_attendance(session, result, course_id)
+
+def save_attendance(session: Session, result: PipelineResult, course_id: Optional[int] = None) -> dict:
+    """
+    Writes the session and one record per student (per enrolled student, for
+    a course's session), and builds the response.
+    A fixed handful of statements regardless of roster size: the records go in
+    as one bulk INSERT ... RETURNING, and the response is assembled from rows
+    already in hand rather than re-read per student.
+    """
+    present_student_ids = set(result.present_student_ids)
+    
+    with metrics.timed("db_write"):
+        # 3. Save Session (flush assigns its id; session and records commit together)
+        att_session = AttendanceSession(classroom_image_path=result.image_path, ai_analysis_report=result.analysis,
+                                        course_id=course_id)
+        session.add(att_session)
+        session.flush()
+        session_id = att_session.id
         
-    session.commit() 
-    
-    # Re-fetch or iterate to get IDs. 
-    # Since we need to return the specific list we just made, let's query them by session_id
-    saved_records = session.exec(select(AttendanceRecord).where(AttendanceRecord.session_id == att_session.id)).all()
-    
-    # Map back to shape
-    for record in saved_records:
-        # We need the student name, so we can access record.student (lazy load) or map manually
-        records_to_return.append({
-            "id": record.id,
-            "student_id": record.student_id,
-            "status": record.status,
+        # 4. Create Records
+        query = select(Student.id, Student.name, Student.student_id)
+        if course_id is not None:
+            query = query.join(Enrollment, Enrollment.student_id == Student.id).where(Enrollment.course_id == course_id)
+        students = session.exec(query).all()
+        rows = [
+            {
+                "session_id": session_id,
+                "student_id": student_db_id,
+                "status": "PRESENT" if student_db_id in present_student_ids else "ABSENT",
+                "confidence": 0.0,
+            }
+            for student_db_id, _, _ in students
+        ]
+        record_ids = {}
+        if rows:
+            inserted = session.execute(
+                insert(AttendanceRecord).returning(AttendanceRecord.id, AttendanceRecord.student_id),
+                rows,
+            )
+            record_ids = {student_db_id: record_id for record_id, student_db_id in inserted}
+        attendance_stats.record_session(session, session_id)
+        session.commit()
+    
+    records_to_return = [
+        {
+            "id": record_ids[student_db_id],
+            "student_id": student_db_id,
+            "status": row["status"],
             "confidence": 1.0,
             "student": {
-                "id": record.student.id,
-                "name": record.student.name,
-                "student_id": record.student.student_id
+                "id": student_db_id,
+                "name": name,
+                "student_id": roll_number
             }
-        })
+        }
+        for (student_db_id, name, roll_number), row in zip(students, rows)
+    ]
+    
+    unenrolled_present = []
+    if result.unenrolled_ids:
+        unenrolled_present = [
+            {"id": student_db_id, "name": name, "student_id": roll_number}
+            for student_db_id, name, roll_number in session.exec(
+                select(Student.id, Student.name, Student.student_id).where(Student.id.in_(result.unenrolled_ids))
+            )
+        ]
     
     return {
-        "session_id": att_session.id,
-        "present_count": len(present_student_ids),
-        "total_students": len(all_students),
-        "unknown_faces_count": unknown_count,
-        "analysis": analysis,
+        "session_id": session_id,
+        "course_id": course_id,
+        "present_count": len(result.present_student_ids),
+        "total_students": len(students),
+        "unknown_faces_count": result.unknown_count,
+        "analysis": result.analysis,
+        "cache_hits": result.cache_hits,
+        # Recognized, but not enrolled in this course: reported, no record written
+        "unenrolled_present": unenrolled_present,
         "records": records_to_return
     }
 
+@app.post("/attendance/video")
+async def mark_attendance_from_video(
+    file: UploadFile = File(...),
+    detection_mode: str = Form("adaptive"),
+    course_id: Optional[int] = Form(None),
+    session: Session = Depends(get_session)
+):
+    """
+    Attendance from a short classroom video: faces are tracked across sampled
+    frames and each track votes on its identity (see video_attendance.py).
+    The frame with the most faces becomes the session image and is captioned.
+    With a course_id, tracks are matched against the course first; students
+    from other courses are reported as unenrolled rather than recorded.
+    """
+    if detection_mode not in DETECTION_MODES:
+        raise HTTPException(status_code=400, detail=f"detection_mode must be one of {', '.join(DETECTION_MODES)}")
+    scope = course_scope(session, course_id)
+
+    data = await file.read()
+    video_path = result_cache.upload_path(result_cache.image_hash(data), file.filename)
+    await asyncio.to_thread(result_cache.save_upload, data, video_path)
+    try:
+        with metrics.timed("video"):
+            video = await inference.video_attendance(video_path, detection_mode, scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if video.keyframe is None:
+        raise HTTPException(status_code=400, detail="No frames could be decoded from the video")
+
+    image_path = os.path.splitext(video_path)[0] + "_keyframe.jpg"
+    await asyncio.to_thread(Image.fromarray(video.keyframe).save, image_path)
+    with inference.share(video.keyframe) as shared:
+        analysis = await captioner.caption(shared)
+
+    result = PipelineResult(
+        image_path=image_path,
+        present_student_ids=video.recognized_ids,
+        unknown_count=video.unknown_count,
+        analysis=analysis,
+        cache_hits=[],
+        unenrolled_ids=video.unenrolled_ids,
+    )
+    response = save_attendance(session, result, course_id)
+    response["video"] = {
+        "duration_s": round(video.duration_s, 2),
+        "frames_sampled": video.frames_sampled,
+        "processing_s": round(video.processing_s, 2),
+        # Processing time as a fraction of the video's length (below 1 = faster than real time)
+        "realtime_factor": round(video.processing_s / video.duration_s, 3) if video.duration_s else None,
+        "tracks": video.tracks,
+    }
+    return response
+
+@app.patch("/attendance/records/{record_id}")
+def correct_attendance_record(record_id: int, correction: AttendanceCorrection, session: Session = Depends(get_session)):
+    """Manual correction of one record (e.g. a missed face); statistics follow."""
+    if correction.status not in attendance_stats.STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(attendance_stats.STATUSES)}")
+    record = session.get(AttendanceRecord, record_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Record not found")
+    
+    old_status = record.status
+    record.status = correction.status
+    session.add(record)
+    attendance_stats.correct_record(session, record.student_id, record.session_id, old_status, correction.status)
+    session.commit()
+    session.refresh(record)
+    return record
+
+async def process_attendance_job(payload: dict, progress) -> dict:
+    result = await pipeline.run(payload["data"], payload["filename"], payload["detection_mode"], progress,
+                                payload["scope"])
+    
+    def save():
+        with Session(engine) as session:
+            return save_attendance(session, result, payload["course_id"])
+    
+    response = await asyncio.to_thread(save)
+    progress("saved", {"session_id": response["session_id"]})
+    return response
+
+# Bounded queue behind POST /attendance/jobs (see attendance_jobs.py)
+jobs = JobQueue(process_attendance_job)
+
+@app.post("/attendance/jobs", status_code=202)
+async def submit_attendance_job(
+    file: UploadFile = File(...),
+    detection_mode: str = Form(DEFAULT_DETECTION_MODE),
+    course_id: Optional[int] = Form(None),
+    session: Session = Depends(get_session)
+):
+    """
+    Queues an attendance upload and returns immediately. Poll
+    /attendance/jobs/{job_id}, or follow /attendance/jobs/{job_id}/events (SSE).
+    A course's enrollment is read at submission.
+    """
+    if detection_mode not in DETECTION_MODES:
+        raise HTTPException(status_code=400, detail=f"detection_mode must be one of {', '.join(DETECTION_MODES)}")
+    scope = course_scope(session, course_id)
+    
+    data = await file.read()
+    try:
+        job = jobs.submit({"data": data, "filename": file.filename, "detection_mode": detection_mode,
+                           "course_id": course_id, "scope": scope})
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "queue_depth": jobs.depth,
+        "status_url": f"/attendance/jobs/{job.id}",
+        "events_url": f"/attendance/jobs/{job.id}/events",
+    }
+
+@app.get("/attendance/jobs/{job_id}")
+def get_attendance_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/attendance/jobs/{job_id}/events")
+async def follow_attendance_job(job_id: str):
+    """
+    Server-sent events: one event per stage (detected, matched, captioned,
+    saved), then done or failed. The done event carries the full result.
+    """
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def stream():
+        async for event in job.follow():
+            if event["stage"] == "done":
+                event = {**event, "result": job.result}
+            yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/sessions/")
-def get_sessions(session: Session = Depends(get_session)):
-    sessions = session.exec(select(AttendanceSession)).all()
-    return sessions
+def get_sessions(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    full: bool = False,
+    session: Session = Depends(get_session)
+):
+    """
+    Sessions newest first, one page at a time. Pass the returned next_cursor
+    to get the next page. ai_analysis_report is only included with full=true.
+    """
+    try:
+        items, next_cursor = pagination.sessions_page(session, limit, cursor, since, until, full)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/sessions/export")
+def export_sessions(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    full: bool = True,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """
+    Streams every matching session as a JSON array (or one object per line
+    with format=ndjson) without building the whole export in memory.
+    """
+    def encode(item):
+        return json.dumps(item, default=lambda value: value.isoformat())
+    
+    def stream():
+        items = pagination.iter_sessions(engine, since, until, full)
+        if format == "ndjson":
+            for item in items:
+                yield encode(item) + "\n"
+            return
+        yield "["
+        for i, item in enumerate(items):
+            yield ("," if i else "") + encode(item)
+        yield "]"
+    
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(stream(), media_type=media_type)
 
 @app.get("/sessions/{session_id}")
 def get_session_details(session_id: int, session: Session = Depends(get_session)):
@@ -158,8 +508,18 @@ def get_session_details(session_id: int, session: Session = Depends(get_session)
     return att_session
 
 @app.get("/students/")
-def get_students(session: Session = Depends(get_session)):
-    return session.exec(select(Student)).all()
+def get_students(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    full: bool = False,
+    session: Session = Depends(get_session)
+):
+    """Students in enrollment order, one page at a time (see get_sessions)."""
+    try:
+        items, next_cursor = pagination.students_page(session, limit, cursor, full)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.delete("/students/{student_id}")
 def delete_student(student_id: int, session: Session = Depends(get_session)):
@@ -167,21 +527,138 @@ def delete_student(student_id: int, session: Session = Depends(get_session)):
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Remove files if they exist
-    if student.face_encoding_path and os.path.exists(student.face_encoding_path):
+    # Remove legacy per-student pickle if it exists.
+    if student.face_encoding_path and student.face_encoding_path.endswith(".pkl") and os.path.exists(student.face_encoding_path):
         os.remove(student.face_encoding_path)
+    # Purge the packed store rows before the ID is freed: SQLite reuses a
+    # deleted max ID, and the next student must not inherit these embeddings
+    for files in (roster_store.PRIMARY, roster_store.SAMPLES):
+        roster_store.purge_ids([student_id], files)
     
     # Delete associated attendance records first (Manual Cascade)
     # This prevents IntegrityError because student_id is NOT NULL
-    records = session.exec(select(AttendanceRecord).where(AttendanceRecord.student_id == student_id)).all()
-    for record in records:
-        session.delete(record)
-        
+    attendance_stats.remove_student(session, student_id)
+    session.execute(delete(AttendanceRecord).where(AttendanceRecord.student_id == student_id))
+    session.execute(delete(Enrollment).where(Enrollment.student_id == student_id))
     session.delete(student)
     session.commit()
     
-    # Reload embeddings
-    students = session.exec(select(Student)).all()
-    load_roster_embeddings(students)
+    update_roster(session, lambda: roster.remove(student_id))
     
     return {"ok": True}
+
+@app.post("/courses/")
+def create_course(course: CourseCreate, session: Session = Depends(get_session)):
+    if session.exec(select(Course.id).where(Course.code == course.code)).first() is not None:
+        raise HTTPException(status_code=409, detail="A course with this code already exists")
+    db_course = Course(code=course.code, name=course.name)
+    session.add(db_course)
+    session.commit()
+    session.refresh(db_course)
+    return db_course
+
+@app.get("/courses/")
+def get_courses(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """Courses in creation order, one page at a time (see get_sessions)."""
+    try:
+        items, next_cursor = pagination.courses_page(session, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/courses/{course_id}")
+def get_course(course_id: int, session: Session = Depends(get_session)):
+    course = session.get(Course, course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return course
+
+@app.post("/courses/{course_id}/enrollments")
+def enroll_students(course_id: int, change: EnrollmentChange, session: Session = Depends(get_session)):
+    """Enrolls students in a course; students already enrolled are left as they are."""
+    student_ids = set(change.student_ids)
+    scope = set(course_scope(session, course_id))
+    known = set(session.exec(select(Student.id).where(Student.id.in_(student_ids))).all())
+    if known != student_ids:
+        raise HTTPException(status_code=404, detail=f"Students not found: {sorted(student_ids - known)}")
+    
+    new_ids = sorted(student_ids - scope)
+    if new_ids:
+        session.execute(insert(Enrollment), [{"course_id": course_id, "student_id": i} for i in new_ids])
+        session.commit()
+    return {"course_id": course_id, "enrolled": new_ids, "total_enrolled": len(scope) + len(new_ids)}
+
+@app.delete("/courses/{course_id}/enrollments/{student_id}")
+def unenroll_student(course_id: int, student_id: int, session: Session = Depends(get_session)):
+    enrollment = session.get(Enrollment, (course_id, student_id))
+    if not enrollment:
+        raise HTTPException(status_code=404, detail="Enrollment not found")
+    session.delete(enrollment)
+    session.commit()
+    return {"ok": True}
+
+@app.get("/courses/{course_id}/students")
+def get_course_students(
+    course_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """Students enrolled in a course, one page at a time (see get_students)."""
+    if not session.get(Course, course_id):
+        raise HTTPException(status_code=404, detail="Course not found")
+    try:
+        items, next_cursor = pagination.students_page(session, limit, cursor, course_id=course_id)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/stats/students/")
+def get_student_stats(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """Attendance rate, counts and last-seen time per student, paginated."""
+    try:
+        items, next_cursor = pagination.student_stats_page(session, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/stats/students/{student_id}")
+def get_one_student_stats(student_id: int, session: Session = Depends(get_session)):
+    stats = attendance_stats.student_stats(session, student_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No attendance recorded for this student")
+    return stats
+
+@app.get("/stats/sessions/{session_id}")
+def get_session_stats(session_id: int, session: Session = Depends(get_session)):
+    stats = attendance_stats.session_stats(session, session_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return stats
+
+@app.get("/stats/attendance")
+def get_attendance_over_time(
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    session: Session = Depends(get_session)
+):
+    """Attendance rate per day, week or month in [since, until)."""
+    return attendance_stats.bucketed_stats(session, bucket, since, until)
+
+@app.post("/roster/reload")
+def reload_roster_index(session: Session = Depends(get_session)):
+    """Explicit full rebuild of the in-memory roster index from the store."""
+    try:
+        reload_roster(session)
+    except RosterCorruptionError as e:
+        raise HTTPException(status_code=500, detail=f"Roster store is corrupt: {e}")
+    return {"ok": True, "size": len(roster), "version": roster.version}
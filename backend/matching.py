@@ -0,0 +1,122 @@
+"""
+Faces-by-roster matching.
+
+All detected faces are compared against the whole roster in one batched
+distance computation, then faces are assigned to students one-to-one
+(Hungarian algorithm) so the same student can never be claimed by two faces.
+
+A student may own several roster rows (a multi-photo template); their
+distance to a face is the closest of those rows, so assignment is always
+between faces and students.
+"""
+from typing import Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# Tolerance 0.6 is standard for dlib 128-d embeddings
+DEFAULT_TOLERANCE = 0.6
+
+UNKNOWN = -1
+
+
+def distance_matrix(faces: np.ndarray, roster: np.ndarray) -> np.ndarray:
+    """
+    Euclidean distances between every face and every roster embedding, shape (F, N).
+    Uses |a - b|^2 = |a|^2 + |b|^2 - 2 a.b so the bulk of the work is one matrix multiply.
+    """
+    faces = np.asarray(faces, dtype=np.float32).reshape(len(faces), -1)
+    roster = np.asarray(roster, dtype=np.float32)
+    squared = (
+        np.einsum("ij,ij->i", faces, faces)[:, None]
+        + np.einsum("ij,ij->i", roster, roster)[None, :]
+        - 2.0 * (faces @ roster.T)
+    )
+    # Rounding can push identical vectors slightly negative
+    np.maximum(squared, 0.0, out=squared)
+    return np.sqrt(squared, out=squared)
+
+
+def collapse_by_student(distances: np.ndarray, row_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduces (F, R) face-to-row distances to (F, S) face-to-student distances
+    (minimum over each student's rows). Returns (distances, student_ids).
+    """
+    order = np.argsort(row_ids, kind="stable")
+    sorted_ids = row_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    if len(starts) == len(row_ids):
+        # One row per student: nothing to collapse
+        return distances, row_ids
+    return np.minimum.reduceat(distances[:, order], starts, axis=1), sorted_ids[starts]
+
+
+def assign(distances: np.ndarray, tolerance: float = DEFAULT_TOLERANCE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Globally optimal one-to-one assignment of faces (rows) to roster entries (columns).
+    Maximises the number of pairs within tolerance, then minimises their total distance.
+    Returns:
+        face_rows, roster_cols: matched pairs
+    """
+    feasible = distances <= tolerance
+    rows = np.flatnonzero(feasible.any(axis=1))
+    cols = np.flatnonzero(feasible.any(axis=0))
+    if len(rows) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # Only faces/students with at least one feasible pair take part in the solve
+    sub = distances[np.ix_(rows, cols)]
+    # Any infeasible pair costs more than a full set of feasible ones, so the
+    # solver never trades a match away to shave distance off the others.
+    penalty = tolerance * min(len(rows), len(cols)) + 1.0
+    cost = np.where(sub <= tolerance, sub, penalty)
+    r, c = linear_sum_assignment(cost)
+    ok = sub[r, c] <= tolerance
+    return rows[r[ok]], cols[c[ok]]
+
+
+def match_faces(face_encodings, roster_ids: np.ndarray, roster_embeddings: np.ndarray,
+                tolerance: float = DEFAULT_TOLERANCE, backend=None,
+                candidates_per_face: int = 8, collapse: bool = True,
+                one_to_one: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    With an approximate search backend, only the top `candidates_per_face`
+    rows per face are scored and assigned; otherwise the whole roster is.
+    Pass collapse=False when every student is known to have a single row,
+    to skip grouping rows by student. one_to_one=False gives every face its
+    nearest student within tolerance, for faces that may be the same person
+    (several encodings of one video track).
+    Returns:
+        student_ids: (F,) matched Student ID per face, UNKNOWN (-1) if unmatched
+        distances: (F,) distance to the matched student, inf if unmatched
+    """
+    n_faces = len(face_encodings)
+    student_ids = np.full(n_faces, UNKNOWN, dtype=np.int64)
+    matched_distances = np.full(n_faces, np.inf, dtype=np.float32)
+    if n_faces == 0 or len(roster_ids) == 0:
+        return student_ids, matched_distances
+
+    cols = None
+    if backend is not None:
+        cols = backend.candidate_rows(np.asarray(face_encodings, dtype=np.float32), roster_embeddings, candidates_per_face)
+    if cols is None:
+        cols = np.arange(len(roster_ids))
+        distances = distance_matrix(face_encodings, roster_embeddings)
+    else:
+        distances = distance_matrix(face_encodings, roster_embeddings[cols])
+
+    col_ids = np.asarray(roster_ids)[cols]
+    if distances.shape[1] == 0:
+        # An approximate backend can come back with no candidates at all
+        return student_ids, matched_distances
+    if collapse:
+        distances, col_ids = collapse_by_student(distances, col_ids)
+    if one_to_one:
+        face_rows, sub_cols = assign(distances, tolerance)
+    else:
+        nearest = np.argmin(distances, axis=1)
+        face_rows = np.flatnonzero(distances[np.arange(n_faces), nearest] <= tolerance)
+        sub_cols = nearest[face_rows]
+    student_ids[face_rows] = col_ids[sub_cols]
+    matched_distances[face_rows] = distances[face_rows, sub_cols]
+    return student_ids, matched_distances
@@ -0,0 +1,212 @@
+"""
+Latency and throughput metrics for the attendance hot path.
+
+Stages (decode, detect, encode, match, caption, db_write, ...) are timed where
+they run and observed into histograms, exposed in Prometheus text format at
+GET /metrics. Stages timed during an HTTP request are also collected for that
+request and returned in its `Server-Timing` header, so a slow upload shows
+where its time went straight from the browser's network panel.
+
+Work done in inference worker processes can't see the request, so those
+functions return their timings (FaceRecognition.timings) and the API process
+records them with `record_stages`.
+
+SLOW_REQUEST_PROFILE_MS > 0 turns on a sampling profiler (pyinstrument, if
+installed): one request at a time is profiled, and if it takes longer than
+the threshold its profile is written to PROFILE_DIR as HTML.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SLOW_REQUEST_PROFILE_MS = float(os.environ.get("SLOW_REQUEST_PROFILE_MS", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FACE_BUCKETS = (0, 1, 5, 10, 20, 40, 80, 160, 320)
+
+
+def _label_str(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return super().render() + [f"{self.name}{_label_str(self.labelnames, key)} {value}"
+                                   for key, value in values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        lines = super().render()
+        for key, (counts, total, count) in values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {bucket_count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency",
+                            ("method", "route", "status"))
+STAGE_SECONDS = Histogram("attendance_stage_duration_seconds", "Time spent per attendance pipeline stage",
+                          ("stage",))
+FACES = Histogram("attendance_faces_detected", "Faces found per processed upload", buckets=FACE_BUCKETS)
+UPLOADS = Counter("attendance_uploads_total", "Attendance uploads processed")
+CACHE_HITS = Counter("attendance_cache_hits_total", "Uploads served from the result cache, per stage", ("stage",))
+CAPTION_BATCH_SECONDS = Histogram("caption_batch_duration_seconds", "BLIP time per caption batch")
+CAPTION_BATCH_SIZE = Histogram("caption_batch_size", "Images per caption batch", buckets=(1, 2, 4, 8, 16, 32))
+ROSTER_SIZE = Gauge("roster_students", "Students in the in-memory roster index")
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# Stage timings of the HTTP request being handled (None outside requests)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def begin_request() -> Dict[str, float]:
+    """
+    Starts collecting stage timings for the current request. Tasks and threads
+    spawned from it share the returned dict.
+    """
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_stages(timings: Optional[Dict[str, float]]):
+    for stage, seconds in (timings or {}).items():
+        record_stage(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+_profiling = threading.Lock()
+_profiler_missing_reported = False
+
+
+def start_profiler():
+    """
+    Returns a running profiler for this request, or None if profiling is off,
+    pyinstrument isn't installed, or another request is already being profiled.
+    """
+    global _profiler_missing_reported
+    if SLOW_REQUEST_PROFILE_MS <= 0 or not _profiling.acquire(blocking=False):
+        return None
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        _profiling.release()
+        if not _profiler_missing_reported:
+            print("SLOW_REQUEST_PROFILE_MS is set but pyinstrument is not installed; profiling disabled")
+            _profiler_missing_reported = True
+        return None
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    return profiler
+
+
+def finish_profiler(profiler, elapsed_s: float, label: str):
+    try:
+        profiler.stop()
+        if elapsed_s * 1000 >= SLOW_REQUEST_PROFILE_MS:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            safe_label = "".join(c if c.isalnum() else "_" for c in label).strip("_")
+            path = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}_{safe_label}.html")
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+            print(f"Slow request ({elapsed_s * 1000:.0f} ms) {label}: profile written to {path}")
+    finally:
+        _profiling.release()
@@ -0,0 +1,47 @@
+import os
+import pickle
+from sqlmodel import Session, select
+from database import engine
+from models import Student
+import roster_store
+
+def migrate_roster_store():
+    """
+    One-shot migration: copies every legacy static/roster/<id>_encoding.pkl
+    into the packed roster store and repoints Student.face_encoding_path.
+    Safe to re-run; already-migrated students are skipped.
+    """
+    # Locked throughout, so the final compaction matches this student list
+    with roster_store.locked(), Session(engine) as session:
+        students = session.exec(select(Student)).all()
+        print(f"Checking {len(students)} students...")
+        
+        migrated = 0
+        for student in students:
+            path = student.face_encoding_path
+            if not path or not path.endswith(".pkl"):
+                continue
+            
+            if not os.path.exists(path):
+                print(f"  [MISSING] {student.name} ({student.student_id}): {path}")
+                continue
+            
+            try:
+                with open(path, 'rb') as f:
+                    encoding = pickle.load(f)
+            except Exception as e:
+                print(f"  [ERROR] {student.name} ({student.student_id}): {e}")
+                continue
+            
+            student.face_encoding_path = roster_store.append_embedding(student.id, encoding)
+            session.add(student)
+            migrated += 1
+        
+        session.commit()
+        # Drop any duplicate rows left by an earlier interrupted run
+        roster_store.compact_store(s.id for s in students)
+        print(f"Migrated {migrated} students into {roster_store.EMBEDDINGS_FILE}.")
+        print("Legacy .pkl files were left in place; delete them once the API loads the new store.")
+
+if __name__ == "__main__":
+    migrate_roster_store()
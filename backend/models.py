@@ -1,6 +1,6 @@
 from typing import Optional, List
-from sqlmodel import Field, SQLModel, Relationship
-from datetime import datetime
+from sqlmodel import Field, SQLModel, Relationship, Index
+from datetime import date, datetime
 
 class Student(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -10,20 +10,65 @@ class Student(SQLModel, table=True):
     
     attendance_records: List["AttendanceRecord"] = Relationship(back_populates="student")
 
+class Course(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    code: str = Field(unique=True, index=True)
+    name: str
+
+class Enrollment(SQLModel, table=True):
+    # The (course_id, student_id) key serves "who is in this course"; the
+    # student_id index serves removing a student from every course
+    course_id: int = Field(foreign_key="course.id", primary_key=True)
+    student_id: int = Field(foreign_key="student.id", primary_key=True, index=True)
+
 class AttendanceSession(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.now)
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
     classroom_image_path: str
     ai_analysis_report: Optional[str] = Field(default=None, description="Gen-AI analysis of the classroom")
+    # None: matched against, and recorded for, the whole roster
+    course_id: Optional[int] = Field(default=None, foreign_key="course.id", index=True)
     
     records: List["AttendanceRecord"] = Relationship(back_populates="session")
 
 class AttendanceRecord(SQLModel, table=True):
+    # (student_id, session_id) also serves lookups by student_id alone
+    __table_args__ = (Index("ix_attendancerecord_student_id_session_id", "student_id", "session_id"),)
+    
     id: Optional[int] = Field(default=None, primary_key=True)
-    session_id: int = Field(foreign_key="attendancesession.id")
+    session_id: int = Field(foreign_key="attendancesession.id", index=True)
     student_id: int = Field(foreign_key="student.id")
     status: str = Field(default="PRESENT") # PRESENT, ABSENT
     confidence: float = Field(default=0.0)
     
     session: AttendanceSession = Relationship(back_populates="records")
     student: Student = Relationship(back_populates="attendance_records")
+
+# Summary tables maintained by attendance_stats.py alongside every write to
+# AttendanceRecord, so rates never need a scan of the records.
+class StudentAttendanceStats(SQLModel, table=True):
+    student_id: int = Field(foreign_key="student.id", primary_key=True)
+    present_count: int = Field(default=0)
+    total_count: int = Field(default=0)
+    last_seen_at: Optional[datetime] = None
+
+class SessionAttendanceStats(SQLModel, table=True):
+    session_id: int = Field(foreign_key="attendancesession.id", primary_key=True)
+    present_count: int = Field(default=0)
+    total_count: int = Field(default=0)
+
+class DailyAttendanceStats(SQLModel, table=True):
+    day: date = Field(primary_key=True)
+    session_count: int = Field(default=0)
+    present_count: int = Field(default=0)
+    total_count: int = Field(default=0)
+
+class AttendanceCorrection(SQLModel):
+    status: str
+
+class CourseCreate(SQLModel):
+    code: str
+    name: str
+
+class EnrollmentChange(SQLModel):
+    student_ids: List[int]
@@ -0,0 +1,150 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Pages are fetched with `WHERE (sort key) < (last key seen) ORDER BY ... LIMIT n`
+rather than OFFSET, so every page costs the same index range scan no matter
+how deep into the history it is. The cursor handed to clients is the last
+row's sort key, base64-encoded; it is opaque to them.
+
+List endpoints return a light projection by default (no ai_analysis_report,
+no encoding paths); pass full=true for every column.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlmodel import Session, select
+
+from models import AttendanceSession, Course, Enrollment, Student, StudentAttendanceStats
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 500
+
+SESSION_SUMMARY_COLUMNS = (AttendanceSession.id, AttendanceSession.created_at, AttendanceSession.classroom_image_path,
+                           AttendanceSession.course_id)
+STUDENT_SUMMARY_COLUMNS = (Student.id, Student.name, Student.student_id)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*key) -> str:
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in key])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Tuple[type, ...]) -> List[Any]:
+    """
+    The key encoded in `cursor`, checked to hold one value of each of `types`
+    so a tampered cursor is a 400, not a failed query.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(key, list) or len(key) != len(types):
+        raise InvalidCursor("Malformed cursor")
+    # bool is an int to isinstance, but never a valid id
+    if any(isinstance(value, bool) or not isinstance(value, t) for value, t in zip(key, types)):
+        raise InvalidCursor("Malformed cursor")
+    return key
+
+
+def _page(db: Session, query, limit: int, cursor_key) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # One extra row tells us whether there is a next page
+    rows = db.exec(query.limit(limit + 1)).all()
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = encode_cursor(*cursor_key(items[-1])) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def sessions_page(db: Session, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  full: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Sessions newest first, optionally within [since, until).
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    columns = SESSION_SUMMARY_COLUMNS + ((AttendanceSession.ai_analysis_report,) if full else ())
+    query = select(*columns)
+    if since is not None:
+        query = query.where(AttendanceSession.created_at >= since)
+    if until is not None:
+        query = query.where(AttendanceSession.created_at < until)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, (str, int))
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except ValueError:
+            raise InvalidCursor("Malformed cursor")
+        query = query.where(tuple_(AttendanceSession.created_at, AttendanceSession.id) < (created_at, last_id))
+    query = query.order_by(AttendanceSession.created_at.desc(), AttendanceSession.id.desc())
+    return _page(db, query, limit, lambda item: (item["created_at"], item["id"]))
+
+
+def students_page(db: Session, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                  full: bool = False, course_id: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Students in enrollment (id) order, optionally only those enrolled in one
+    course. Returns (items, next_cursor).
+    """
+    columns = STUDENT_SUMMARY_COLUMNS + ((Student.face_encoding_path,) if full else ())
+    query = select(*columns)
+    if course_id is not None:
+        query = query.join(Enrollment, Enrollment.student_id == Student.id).where(Enrollment.course_id == course_id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, (int,))
+        query = query.where(Student.id > last_id)
+    query = query.order_by(Student.id)
+    return _page(db, query, limit, lambda item: (item["id"],))
+
+
+def courses_page(db: Session, limit: int = DEFAULT_PAGE_SIZE,
+                 cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Courses in id order. Returns (items, next_cursor).
+    """
+    query = select(Course.id, Course.code, Course.name)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, (int,))
+        query = query.where(Course.id > last_id)
+    query = query.order_by(Course.id)
+    return _page(db, query, limit, lambda item: (item["id"],))
+
+
+def student_stats_page(db: Session, limit: int = DEFAULT_PAGE_SIZE,
+                       cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Per-student attendance summaries in student id order. Returns (items, next_cursor).
+    """
+    query = select(StudentAttendanceStats.student_id, Student.name, Student.student_id.label("roll_number"),
+                   StudentAttendanceStats.present_count, StudentAttendanceStats.total_count,
+                   StudentAttendanceStats.last_seen_at).join(Student, Student.id == StudentAttendanceStats.student_id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, (int,))
+        query = query.where(StudentAttendanceStats.student_id > last_id)
+    query = query.order_by(StudentAttendanceStats.student_id)
+    items, next_cursor = _page(db, query, limit, lambda item: (item["student_id"],))
+    for item in items:
+        item["attendance_rate"] = item["present_count"] / item["total_count"] if item["total_count"] else None
+    return items, next_cursor
+
+
+def iter_sessions(engine, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  full: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Every matching session, fetched a page at a time so memory stays flat.
+    Each page uses a short-lived DB session so an export never pins a connection.
+    """
+    cursor = None
+    while True:
+        with Session(engine) as db:
+            items, cursor = sessions_page(db, EXPORT_BATCH_SIZE, cursor, since, until, full)
+        yield from items
+        if cursor is None:
+            return
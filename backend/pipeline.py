@@ -0,0 +1,170 @@
+"""
+Attendance pipeline for one classroom upload.
+
+The uploaded bytes are decoded once into a shared array; face recognition and
+BLIP captioning then run concurrently on that array in the inference pool,
+while the original bytes are written to disk alongside them. End-to-end
+latency is roughly max(recognition, caption) instead of the sum of both plus
+a decode each.
+
+Captions go through the CaptionBatcher, so concurrent uploads share one
+batched BLIP pass.
+
+Results are cached by content hash (see result_cache.py): a repeat upload
+skips decoding and inference entirely, and only re-runs matching if the
+roster has changed since.
+
+With a `scope` (a course's enrolled Student IDs) faces are matched against
+that class only; see ai_engine.match_encodings for the cross-course fallback.
+
+An optional `progress(stage, details)` callback hears "detected", "matched"
+and "captioned" as each finishes (job API, see attendance_jobs.py). Stage
+timings, face counts and cache hits go to metrics.py.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import ai_engine
+import metrics
+import result_cache
+from caption_batcher import CaptionBatcher
+from inference_pool import InferencePool
+
+
+@dataclass
+class PipelineResult:
+    image_path: str
+    present_student_ids: List[int]
+    unknown_count: int
+    analysis: str
+    # Stages served from cache: any of "faces", "match", "caption"
+    cache_hits: List[str]
+    # Students from outside the upload's course spotted by the fallback lookup
+    unenrolled_ids: List[int] = field(default_factory=list)
+
+
+def _report(progress: Optional[Callable[[str, Dict[str, Any]], None]], stage: str, **details):
+    if progress is not None:
+        progress(stage, details)
+
+
+def _match_current_roster(encodings, scope=None) -> Tuple[int, Tuple[List[int], int, List[int]]]:
+    with ai_engine.roster.lock:
+        return ai_engine.roster.version, ai_engine.match_encodings(encodings, scope)
+
+
+class AttendancePipeline:
+    def __init__(self, inference: InferencePool, captioner: CaptionBatcher):
+        self.inference = inference
+        self.captioner = captioner
+        self.matches = result_cache.MatchMemo()
+
+    async def run(self, data: bytes, filename: str,
+                  detection_mode: str = ai_engine.DEFAULT_DETECTION_MODE,
+                  progress: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                  scope: Optional[Tuple[int, ...]] = None) -> PipelineResult:
+        digest = await asyncio.to_thread(result_cache.image_hash, data)
+        image_path = result_cache.upload_path(digest, filename)
+        face_key = ai_engine.face_cache_key(detection_mode)
+        # The same photo matched for two courses gives two different results
+        match_key = (digest, face_key, frozenset(scope) if scope is not None else None)
+        caption_key = ai_engine.caption_cache_key()
+
+        # Persisting the original never blocks inference; it overlaps with it
+        save = asyncio.create_task(asyncio.to_thread(result_cache.save_upload, data, image_path))
+        try:
+            cached_faces = await asyncio.to_thread(result_cache.load_faces, digest, face_key)
+            analysis = await asyncio.to_thread(result_cache.load_caption, digest, caption_key)
+            cache_hits = []
+            if analysis is not None:
+                cache_hits.append("caption")
+                _report(progress, "captioned", cached=True)
+
+            recognition = None
+            if cached_faces is None or analysis is None:
+                recognition, analysis = await self._infer(data, detection_mode, cached_faces is None, analysis,
+                                                          progress, scope)
+                # A failed recognition is served as empty but never cached, so a retry gets a real result
+                if recognition is not None and recognition.error is None:
+                    await asyncio.to_thread(result_cache.save_faces, digest, face_key,
+                                            recognition.face_locations, recognition.encodings)
+                    self.matches.put((*match_key, recognition.roster_version),
+                                     (recognition.recognized_ids, recognition.unknown_count,
+                                      recognition.unenrolled_ids))
+                if "caption" not in cache_hits and analysis not in ai_engine.CAPTION_FALLBACKS:
+                    await asyncio.to_thread(result_cache.save_caption, digest, caption_key, analysis)
+
+            if recognition is not None:
+                present_student_ids, unknown_count = recognition.recognized_ids, recognition.unknown_count
+                unenrolled_ids = recognition.unenrolled_ids
+            else:
+                cache_hits.append("faces")
+                _report(progress, "detected", faces=len(cached_faces[1]), cached=True)
+                present_student_ids, unknown_count, unenrolled_ids = await self._match_cached(
+                    match_key, cached_faces[1], cache_hits, scope)
+                _report(progress, "matched", present=len(present_student_ids), unknown=unknown_count,
+                        cached="match" in cache_hits)
+        finally:
+            await save
+
+        metrics.UPLOADS.inc()
+        for stage in cache_hits:
+            metrics.CACHE_HITS.inc(stage=stage)
+        return PipelineResult(
+            image_path=image_path,
+            present_student_ids=present_student_ids,
+            unknown_count=unknown_count,
+            analysis=analysis,
+            cache_hits=cache_hits,
+            unenrolled_ids=unenrolled_ids,
+        )
+
+    async def _infer(self, data: bytes, detection_mode: str, need_faces: bool, analysis, progress=None,
+                     scope=None):
+        """
+        Decodes once and runs whichever of recognition / captioning is missing, concurrently.
+        """
+        try:
+            with metrics.timed("decode"):
+                image = await asyncio.to_thread(ai_engine.decode_image, data)
+        except OSError as e:
+            raise ValueError(f"Could not decode uploaded image: {e}")
+
+        async def recognize(shared):
+            # "recognize" is the whole round trip; the worker reports detect / encode / match inside it
+            with metrics.timed("recognize"):
+                recognition = await self.inference.recognize(shared, detection_mode, scope)
+            metrics.record_stages(recognition.timings)
+            metrics.FACES.observe(len(recognition.face_locations))
+            # Detection and matching run as one worker task, so both land together
+            _report(progress, "detected", faces=len(recognition.face_locations))
+            _report(progress, "matched", present=len(recognition.recognized_ids), unknown=recognition.unknown_count)
+            return recognition
+
+        async def caption(shared):
+            with metrics.timed("caption"):
+                caption = await self.captioner.caption(shared)
+            _report(progress, "captioned")
+            return caption
+
+        with self.inference.share(image) as shared:
+            recognition_task = recognize(shared) if need_faces else None
+            caption_task = caption(shared) if analysis is None else None
+            results = await asyncio.gather(*(t for t in (recognition_task, caption_task) if t is not None))
+
+        recognition = results.pop(0) if need_faces else None
+        if caption_task is not None:
+            analysis = results.pop(0)
+        return recognition, analysis
+
+    async def _match_cached(self, match_key: tuple, encodings, cache_hits: List[str], scope=None):
+        memo = self.matches.get((*match_key, ai_engine.roster.version))
+        if memo is not None:
+            cache_hits.append("match")
+            return memo
+        # Roster changed since these encodings were matched: re-match only (milliseconds)
+        with metrics.timed("match"):
+            version, result = await asyncio.to_thread(_match_current_roster, encodings, scope)
+        self.matches.put((*match_key, version), result)
+        return result
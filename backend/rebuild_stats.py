@@ -0,0 +1,19 @@
+import time
+from sqlmodel import Session
+from database import engine, create_db_and_tables
+import attendance_stats
+
+def rebuild_stats():
+    """
+    Recomputes the attendance summary tables from the raw records. Use after
+    editing records outside the API, or if the summaries are ever suspected
+    to have drifted. Safe to re-run.
+    """
+    create_db_and_tables()
+    start = time.perf_counter()
+    with Session(engine) as session:
+        attendance_stats.rebuild(session)
+    print(f"Attendance statistics rebuilt in {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    rebuild_stats()
@@ -0,0 +1,114 @@
+"""
+Content-addressed cache for classroom uploads.
+
+Uploads are stored by the SHA-256 of their bytes, so a re-upload or a
+frontend retry of the same photo maps to the same file. Face boxes +
+encodings and captions are cached on disk keyed by that hash plus the model
+settings that produced them (see ai_engine.face_cache_key /
+caption_cache_key). Match results are memoised in memory per roster version,
+so a repeat upload against an unchanged roster is a hash and a lookup.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+
+UPLOADS_DIR = "static/uploads"
+CACHE_DIR = "static/cache"
+
+
+def image_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def upload_path(digest: str, filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower() or ".jpg"
+    return os.path.join(UPLOADS_DIR, f"{digest}{ext}")
+
+
+def _atomic_write(path: str, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_upload(data: bytes, path: str):
+    # Same path means same bytes, so an existing file is already correct
+    if not os.path.exists(path):
+        _atomic_write(path, lambda f: f.write(data))
+
+
+def _faces_path(digest: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, "faces", f"{digest}_{key}.npz")
+
+
+def _caption_path(digest: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, "captions", f"{digest}_{key}.txt")
+
+
+def load_faces(digest: str, key: str) -> Optional[Tuple[List[Tuple[int, int, int, int]], np.ndarray]]:
+    """
+    Returns (face_locations, encodings) or None on a miss.
+    """
+    path = _faces_path(digest, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as cached:
+            locations = [tuple(int(v) for v in box) for box in cached["locations"]]
+            return locations, cached["encodings"]
+    except Exception as e:
+        print(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+
+
+def save_faces(digest: str, key: str, face_locations, encodings: np.ndarray):
+    locations = np.asarray(face_locations, dtype=np.int32).reshape(-1, 4)
+    _atomic_write(
+        _faces_path(digest, key),
+        lambda f: np.savez(f, locations=locations, encodings=np.asarray(encodings, dtype=np.float32)),
+    )
+
+
+def load_caption(digest: str, key: str) -> Optional[str]:
+    path = _caption_path(digest, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def save_caption(digest: str, key: str, caption: str):
+    _atomic_write(_caption_path(digest, key), lambda f: f.write(caption.encode("utf-8")))
+
+
+class MatchMemo:
+    """
+    Small in-memory LRU of match results keyed by (image hash, detection
+    settings, course scope, roster version). A roster change bumps the
+    version, so stale entries simply stop being hit and age out.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[List[int], int, List[int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[List[int], int, List[int]]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Tuple[List[int], int, List[int]]):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
@@ -0,0 +1,252 @@
+"""
+In-memory roster index: the embedding matrix the matcher searches, plus the
+Student ID of every row. A student normally has one row; students enrolled
+from several photos have a few (their template, see face_templates.py).
+
+Single-student changes are O(1) amortized: rows live in a growable buffer
+(capacity doubles), removal swaps the last rows into the holes, and a dict maps
+Student ID -> rows (which also makes gathering one course's rows, `subset`,
+proportional to the class rather than the roster). Every change bumps
+`version`, so callers holding a snapshot can tell when it is stale. The search
+backend (see search_backends.py) is told about every change so approximate
+indexes stay in sync.
+
+The last CHANGE_LOG_SIZE single-student changes are kept as a log, so a copy
+of the index in another process (inference workers) can catch up by replaying
+them (`changes_since` / `apply_changes`) instead of rebuilding.
+"""
+import threading
+from collections import deque
+from itertools import chain
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from roster_store import EMBEDDING_DIM
+from search_backends import ExactSearch
+
+
+CHANGE_LOG_SIZE = 256
+
+
+class RosterCorruptionError(Exception):
+    """The ID -> row mapping no longer agrees with the row data; rebuild the index."""
+
+
+class RosterChange(NamedTuple):
+    # Index version this change produced
+    version: int
+    student_id: int
+    # New template rows, or None for a removal
+    embeddings: Optional[np.ndarray]
+
+
+class RosterIndex:
+    def __init__(self, dim: int = EMBEDDING_DIM, backend=None):
+        self.dim = dim
+        self.backend = backend or ExactSearch()
+        # Readers (matching) and writers (enroll/delete) share the buffer, so both take the lock.
+        self.lock = threading.RLock()
+        self.version = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._embeddings = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._rows_of: Dict[int, List[int]] = {}
+        self._changes: Deque[RosterChange] = deque()
+        # The log holds every change after this version
+        self.change_log_base = 0
+
+    def __len__(self) -> int:
+        """Number of students (not rows)."""
+        return len(self._rows_of)
+
+    def __contains__(self, student_id: int) -> bool:
+        return student_id in self._rows_of
+
+    @property
+    def row_count(self) -> int:
+        return self._size
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._embeddings[:self._size]
+
+    def snapshot(self) -> Tuple[int, np.ndarray, np.ndarray]:
+        """
+        Returns (version, ids, embeddings) as private copies, safe to use without the lock.
+        """
+        with self.lock:
+            return self.version, self.ids.copy(), self.embeddings.copy()
+
+    def subset(self, student_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (ids, embeddings) of just these students' rows, as copies. Costs
+        O(rows gathered) via the row map, not O(roster), so a course-sized
+        subset of an institution-sized roster is cheap. Unknown IDs are skipped.
+        """
+        with self.lock:
+            rows = [row for student_id in student_ids for row in self._rows_of.get(int(student_id), ())]
+            rows = np.asarray(rows, dtype=np.intp)
+            return self._ids[rows], self._embeddings[rows]
+
+    def rebuild(self, ids: np.ndarray, embeddings: np.ndarray):
+        """
+        Full rebuild. Adopts the arrays without copying (they may be read-only
+        memmaps); the first mutation afterwards moves them into a growable buffer.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(embeddings):
+            raise ValueError(f"Got {len(ids)} ids for {len(embeddings)} embeddings")
+
+        rows_of: Dict[int, List[int]] = {}
+        for row, student_id in enumerate(ids.tolist()):
+            rows_of.setdefault(student_id, []).append(row)
+
+        with self.lock:
+            self._ids = ids
+            self._embeddings = embeddings
+            self._size = len(ids)
+            self._rows_of = rows_of
+            self.backend.build(embeddings)
+            self.version += 1
+            # Replaying changes can't reproduce a rebuild
+            self._changes.clear()
+            self.change_log_base = self.version
+
+    def _log(self, student_id: int, embeddings: Optional[np.ndarray]):
+        if len(self._changes) == CHANGE_LOG_SIZE:
+            self.change_log_base = self._changes.popleft().version
+        self._changes.append(RosterChange(self.version, student_id, embeddings))
+
+    def changes_since(self, version: int) -> Optional[List[RosterChange]]:
+        """
+        Changes after `version`, oldest first, or None if the log doesn't
+        reach back that far (a rebuild since, or too many changes).
+        """
+        with self.lock:
+            if version < self.change_log_base:
+                return None
+            return [change for change in self._changes if change.version > version]
+
+    def apply_changes(self, changes: Iterable[RosterChange]):
+        """Replays another index's changes (see changes_since) on this one."""
+        with self.lock:
+            for change in changes:
+                if change.embeddings is None:
+                    self.remove(change.student_id)
+                else:
+                    self.add(change.student_id, change.embeddings)
+
+    def _ensure_capacity(self, needed: int):
+        capacity = len(self._ids)
+        if capacity >= needed and self._ids.flags.writeable and self._embeddings.flags.writeable:
+            return
+        new_capacity = max(needed, 2 * capacity, 64)
+        ids = np.empty(new_capacity, dtype=np.int64)
+        embeddings = np.empty((new_capacity, self.dim), dtype=np.float32)
+        ids[:self._size] = self._ids[:self._size]
+        embeddings[:self._size] = self._embeddings[:self._size]
+        self._ids = ids
+        self._embeddings = embeddings
+
+    def _rows(self, student_id: int) -> List[int]:
+        rows = self._rows_of[student_id]
+        for row in rows:
+            if row >= self._size or self._ids[row] != student_id:
+                raise RosterCorruptionError(f"Row {row} does not belong to student {student_id}")
+        return rows
+
+    def add(self, student_id: int, encoding):
+        """
+        Adds a student, or replaces their embedding(s) if already present.
+        `encoding` is one embedding, or a (k, dim) template.
+        """
+        vectors = np.asarray(encoding, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock:
+            if student_id in self._rows_of:
+                self.replace(student_id, vectors)
+                return
+            self._append(student_id, vectors)
+            self.version += 1
+            self._log(student_id, vectors.copy())
+
+    def _append(self, student_id: int, vectors: np.ndarray):
+        self._ensure_capacity(self._size + len(vectors))
+        rows = list(range(self._size, self._size + len(vectors)))
+        self._ids[rows] = student_id
+        self._embeddings[rows] = vectors
+        self._rows_of[student_id] = rows
+        self._size += len(vectors)
+        for row, vector in zip(rows, vectors):
+            self.backend.set_row(row, vector)
+
+    def replace(self, student_id: int, encoding):
+        vectors = np.asarray(encoding, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock:
+            rows = self._rows(student_id)
+            if len(rows) == len(vectors):
+                self._ensure_capacity(self._size)
+                self._embeddings[rows] = vectors
+                for row, vector in zip(rows, vectors):
+                    self.backend.set_row(row, vector)
+            else:
+                # Template changed size: drop the old rows, append the new ones
+                self._remove_rows(student_id)
+                self._append(student_id, vectors)
+            self.version += 1
+            self._log(student_id, vectors.copy())
+
+    def _remove_rows(self, student_id: int):
+        rows = self._rows(student_id)
+        self._ensure_capacity(self._size)
+        # Highest first, so a hole is never filled from a row that is itself about to go
+        for row in sorted(rows, reverse=True):
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._ids[row] = moved_id
+                self._embeddings[row] = self._embeddings[last]
+                moved_rows = self._rows_of[moved_id]
+                moved_rows[moved_rows.index(last)] = row
+            self.backend.move_row(last, row)
+            self._size -= 1
+        del self._rows_of[student_id]
+
+    def remove(self, student_id: int) -> bool:
+        """
+        Removes a student. Returns False if they were not in the index.
+        """
+        with self.lock:
+            if student_id not in self._rows_of:
+                return False
+            self._remove_rows(student_id)
+            self.version += 1
+            self._log(student_id, None)
+            return True
+
+    def verify(self):
+        """
+        Full O(N) consistency check, as array operations: every row is mapped
+        exactly once, to the student that owns it. About 20 ms per 100k
+        rows, so it runs after every full rebuild. Raises RosterCorruptionError.
+        """
+        with self.lock:
+            counts = np.fromiter(map(len, self._rows_of.values()), dtype=np.intp, count=len(self._rows_of))
+            if counts.sum() != self._size:
+                raise RosterCorruptionError(f"{counts.sum()} rows mapped for {self._size} rows")
+            rows = np.fromiter(chain.from_iterable(self._rows_of.values()), dtype=np.intp, count=self._size)
+            owners = np.repeat(np.fromiter(self._rows_of, dtype=np.int64, count=len(self._rows_of)), counts)
+            if self._size and (rows.min() < 0 or rows.max() >= self._size):
+                raise RosterCorruptionError("Row map points outside the index")
+            if self._size and np.bincount(rows, minlength=self._size).max() != 1:
+                raise RosterCorruptionError("Rows mapped more than once")
+            wrong = np.flatnonzero(self._ids[rows] != owners)
+            if len(wrong):
+                raise RosterCorruptionError(f"Row {rows[wrong[0]]} does not belong to student {owners[wrong[0]]}")
+            if not np.isfinite(self.embeddings).all():
+                raise RosterCorruptionError("Non-finite values in roster embeddings")
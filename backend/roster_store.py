@@ -0,0 +1,233 @@
+"""
+Packed on-disk store for roster face embeddings.
+
+All embeddings live in a single contiguous float32 file (N x 128) with a
+parallel int64 file of Student IDs, so loading the roster is two opens and a
+memory map instead of one pickle per student. Rows are append-only: when a
+student is re-registered the newest row wins, and superseded rows are dropped
+when the store is compacted. A deleted student's rows are purged right away
+(`purge_ids`): SQLite hands a deleted max ID to the next student created, who
+would otherwise inherit them.
+
+Extra enrollment photos go to a second store with the same layout (SAMPLES),
+where every row counts: a student's samples are their primary embedding plus
+all of their rows there. Pass `files=SAMPLES` to use it.
+
+The API, ingest_data.py and migrate_roster_store.py write the store from
+different processes, so every read-repair, append and rewrite runs under
+`locked()`, an flock on a sidecar file next to the store. Callers that append
+before committing the students (ingest) or compact against a student list
+(the API) hold it across the DB work too, so a compaction never drops rows
+whose students are about to be committed.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers in one process are still serialized
+    fcntl = None
+
+EMBEDDING_DIM = 128
+ROSTER_DIR = "static/roster"
+EMBEDDINGS_FILE = os.path.join(ROSTER_DIR, "embeddings.f32")
+IDS_FILE = os.path.join(ROSTER_DIR, "embedding_ids.i64")
+SAMPLES_FILE = os.path.join(ROSTER_DIR, "samples.f32")
+SAMPLE_IDS_FILE = os.path.join(ROSTER_DIR, "sample_ids.i64")
+
+
+class StoreFiles(NamedTuple):
+    embeddings: str
+    ids: str
+
+
+# One embedding per student, newest wins
+PRIMARY = StoreFiles(EMBEDDINGS_FILE, IDS_FILE)
+# Additional enrollment samples, all rows kept
+SAMPLES = StoreFiles(SAMPLES_FILE, SAMPLE_IDS_FILE)
+
+LOCK_FILE_NAME = "store.lock"
+
+# Serializes appends with rewrites (compaction, purges) so neither loses the other's rows.
+# The thread lock covers this process; the flock in locked() covers the others.
+_write_lock = threading.RLock()
+_lock_depth = 0
+
+_EMBEDDING_ROW_BYTES = EMBEDDING_DIM * np.dtype(np.float32).itemsize
+_ID_ROW_BYTES = np.dtype(np.int64).itemsize
+
+
+@contextmanager
+def locked(files: StoreFiles = PRIMARY):
+    """
+    Exclusive access to the stores in files' directory, across threads and
+    processes. Reentrant within a thread. Take it before starting a DB write
+    transaction, never inside one, so it can't deadlock against SQLite's lock.
+    """
+    global _lock_depth
+    with _write_lock:
+        _lock_depth += 1
+        try:
+            if _lock_depth > 1 or fcntl is None:
+                yield
+                return
+            directory = os.path.dirname(files.embeddings) or "."
+            os.makedirs(directory, exist_ok=True)
+            # Closing the file releases the flock
+            with open(os.path.join(directory, LOCK_FILE_NAME), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+        finally:
+            _lock_depth -= 1
+
+
+def _row_count(path: str, row_bytes: int) -> int:
+    if not os.path.exists(path):
+        return 0
+    return os.path.getsize(path) // row_bytes
+
+
+def _repair(files: StoreFiles = PRIMARY) -> int:
+    """
+    Trims both files to the same whole number of rows.
+    A crash between the two appends (or mid-write) leaves one file longer than
+    the other; the shorter one is authoritative.
+    """
+    n = min(_row_count(files.embeddings, _EMBEDDING_ROW_BYTES), _row_count(files.ids, _ID_ROW_BYTES))
+    for path, row_bytes in ((files.embeddings, _EMBEDDING_ROW_BYTES), (files.ids, _ID_ROW_BYTES)):
+        if os.path.exists(path) and os.path.getsize(path) != n * row_bytes:
+            print(f"Roster store: truncating torn write in {path}")
+            with open(path, "r+b") as f:
+                f.truncate(n * row_bytes)
+    return n
+
+
+def load_store(files: StoreFiles = PRIMARY) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Memory-maps the store read-only.
+    Returns:
+        ids: (N,) int64 Student IDs
+        embeddings: (N, 128) float32 matrix, row i belongs to ids[i]
+    """
+    # Locked: the repair must not mistake another process's half-done append for a torn one
+    with locked(files):
+        n = _repair(files)
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        ids = np.memmap(files.ids, dtype=np.int64, mode="r", shape=(n,))
+        embeddings = np.memmap(files.embeddings, dtype=np.float32, mode="r", shape=(n, EMBEDDING_DIM))
+        return ids, embeddings
+
+
+def append_embedding(student_id: int, encoding, files: StoreFiles = PRIMARY) -> str:
+    """
+    Appends one embedding for a student and returns the store path, which is
+    what Student.face_encoding_path records for packed-store students.
+    """
+    os.makedirs(ROSTER_DIR, exist_ok=True)
+    vector = np.asarray(encoding, dtype=np.float32).reshape(EMBEDDING_DIM)
+    with locked(files):
+        _repair(files)
+        # Embedding first: if we die before the ID lands, _repair drops the orphan row.
+        with open(files.embeddings, "ab") as f:
+            f.write(vector.tobytes())
+        with open(files.ids, "ab") as f:
+            f.write(np.int64(student_id).tobytes())
+    return files.embeddings
+
+
+def append_embeddings(student_ids: Sequence[int], encodings, files: StoreFiles = PRIMARY) -> str:
+    """
+    Appends a batch of embeddings in one write per file (see append_embedding).
+    """
+    vectors = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    ids = np.asarray(student_ids, dtype=np.int64)
+    if len(ids) != len(vectors):
+        raise ValueError(f"Got {len(ids)} ids for {len(vectors)} embeddings")
+    os.makedirs(ROSTER_DIR, exist_ok=True)
+    with locked(files):
+        _repair(files)
+        with open(files.embeddings, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(files.ids, "ab") as f:
+            f.write(ids.tobytes())
+    return files.embeddings
+
+
+def latest_rows(ids: np.ndarray, keep_ids: Iterable[int]) -> np.ndarray:
+    """
+    Row indices (ascending) of the newest embedding for every ID in keep_ids.
+    """
+    if len(ids) == 0:
+        return np.empty(0, dtype=np.int64)
+    # np.unique returns the first occurrence, so search the reversed array to get the last one.
+    unique_ids, reversed_index = np.unique(ids[::-1], return_index=True)
+    rows = len(ids) - 1 - reversed_index
+    keep = np.fromiter(keep_ids, dtype=np.int64)
+    return np.sort(rows[np.isin(unique_ids, keep)])
+
+
+def kept_rows(ids: np.ndarray, keep_ids: Iterable[int], files: StoreFiles = PRIMARY) -> np.ndarray:
+    """
+    Rows compaction keeps: the newest per ID in PRIMARY, every row in SAMPLES.
+    """
+    if files == PRIMARY:
+        return latest_rows(ids, keep_ids)
+    return np.flatnonzero(np.isin(ids, np.fromiter(keep_ids, dtype=np.int64)))
+
+
+def rewrite_store(ids: np.ndarray, embeddings: np.ndarray, files: StoreFiles = PRIMARY):
+    """
+    Replaces the store contents (used for compaction).
+    """
+    os.makedirs(ROSTER_DIR, exist_ok=True)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    with locked(files):
+        for path, data in ((files.embeddings, embeddings), (files.ids, ids)):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+
+def compact_store(keep_ids: Iterable[int], files: StoreFiles = PRIMARY) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Drops superseded rows and rows for IDs not in keep_ids, then re-maps the store.
+    No-op (and zero-copy) when the store is already compact.
+    """
+    with locked(files):
+        ids, embeddings = load_store(files)
+        rows = kept_rows(ids, keep_ids, files)
+        if len(rows) == len(ids):
+            return ids, embeddings
+
+        print(f"Roster store: compacting {len(ids)} rows -> {len(rows)}")
+        new_ids, new_embeddings = np.array(ids[rows]), np.array(embeddings[rows])
+        # Release the old maps before replacing the files underneath them.
+        del ids, embeddings
+        rewrite_store(new_ids, new_embeddings, files)
+        return load_store(files)
+
+
+def purge_ids(student_ids: Iterable[int], files: StoreFiles = PRIMARY) -> int:
+    """
+    Drops every row of these students now rather than at the next compaction.
+    Returns the number of rows dropped. One pass over the ID column, and a
+    rewrite only if the students had rows.
+    """
+    with locked(files):
+        ids, embeddings = load_store(files)
+        drop = np.isin(ids, np.fromiter(student_ids, dtype=np.int64))
+        dropped = int(drop.sum())
+        if dropped:
+            new_ids, new_embeddings = np.array(ids[~drop]), np.array(embeddings[~drop])
+            del ids, embeddings
+            rewrite_store(new_ids, new_embeddings, files)
+        return dropped
@@ -0,0 +1,191 @@
+"""
+Search backends behind the roster index.
+
+`ExactSearch` (the default) scores every roster row. `IVFSearch` is a CPU-only
+inverted-file index: roster rows are bucketed by their nearest k-means
+centroid and a query only scores the rows in its `nprobe` closest buckets, so
+recall vs. speed is tuned with `nprobe`. Both return exact distances for the
+rows they do score.
+
+The roster index keeps a backend in sync through build / set_row / move_row,
+so single-student changes stay O(1) here too.
+"""
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+from matching import distance_matrix
+
+
+class ExactSearch:
+    name = "exact"
+
+    def build(self, embeddings: np.ndarray):
+        pass
+
+    def set_row(self, row: int, vector: np.ndarray):
+        pass
+
+    def move_row(self, src: int, dst: int):
+        pass
+
+    def candidate_rows(self, queries: np.ndarray, embeddings: np.ndarray, k: int) -> Optional[np.ndarray]:
+        """
+        Rows worth scoring for these queries; None means all of them.
+        """
+        return None
+
+    def search(self, queries: np.ndarray, embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            distances, rows: (Q, k) nearest rows per query, ascending; padded with inf / -1
+        """
+        distances = distance_matrix(queries, embeddings)
+        return _top_k(distances, np.arange(len(embeddings)), k)
+
+
+class IVFSearch:
+    """
+    Inverted-file index with exact re-ranking inside the probed lists.
+    Falls back to brute force below `min_size` rows, where training buys nothing.
+    """
+    name = "ivf"
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8, min_size: int = 2000,
+                 kmeans_iters: int = 10, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+        self._labels = np.empty(0, dtype=np.int32)
+        # Inverted lists (rows sorted by label + offsets), rebuilt lazily after changes
+        self._lists_dirty = True
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    def _train(self, embeddings: np.ndarray):
+        n = len(embeddings)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, 64 * nlist)
+        sample = np.asarray(embeddings[rng.choice(n, sample_size, replace=False)], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assignment = distance_matrix(sample, centroids).argmin(axis=1)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        self.centroids = centroids
+        self._trained_size = n
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        # Chunked so a 100k roster doesn't materialise a 100k x nlist matrix at once
+        for start in range(0, len(vectors), 8192):
+            chunk = vectors[start:start + 8192]
+            labels[start:start + len(chunk)] = distance_matrix(chunk, self.centroids).argmin(axis=1)
+        return labels
+
+    def build(self, embeddings: np.ndarray):
+        self.centroids = None
+        self._trained_size = 0
+        self._labels = np.empty(0, dtype=np.int32)
+        self._lists_dirty = True
+        if len(embeddings) >= self.min_size:
+            self._train(embeddings)
+            self._labels = self._assign(embeddings)
+
+    def set_row(self, row: int, vector: np.ndarray):
+        if self.centroids is None:
+            return
+        if row >= len(self._labels):
+            grown = np.empty(max(row + 1, 2 * len(self._labels)), dtype=np.int32)
+            grown[:len(self._labels)] = self._labels
+            self._labels = grown
+        self._labels[row] = distance_matrix(vector[None, :], self.centroids)[0].argmin()
+        self._lists_dirty = True
+
+    def move_row(self, src: int, dst: int):
+        """
+        The roster index moved its last row (src) into dst and shrank by one.
+        """
+        if self.centroids is not None and src != dst:
+            self._labels[dst] = self._labels[src]
+        self._lists_dirty = True
+
+    def _ensure_ready(self, embeddings: np.ndarray) -> bool:
+        n = len(embeddings)
+        if n < self.min_size:
+            return False
+        # Centroids drift out of date as the roster grows; retrain once it has doubled
+        if self.centroids is None or n > 2 * self._trained_size:
+            self.build(embeddings)
+        if self._lists_dirty:
+            labels = self._labels[:n]
+            self._sorted_rows = np.argsort(labels, kind="stable")
+            self._offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=len(self.centroids)))))
+            self._lists_dirty = False
+        return True
+
+    def candidate_rows(self, queries: np.ndarray, embeddings: np.ndarray, k: int) -> Optional[np.ndarray]:
+        if not self._ensure_ready(embeddings):
+            return None
+        _, rows = self.search(queries, embeddings, k)
+        return np.unique(rows[rows >= 0])
+
+    def search(self, queries: np.ndarray, embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        if not self._ensure_ready(embeddings):
+            return ExactSearch().search(queries, embeddings, k)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(distance_matrix(queries, self.centroids), nprobe - 1, axis=1)[:, :nprobe]
+        out_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, lists in enumerate(probes):
+            rows = np.concatenate([self._sorted_rows[self._offsets[l]:self._offsets[l + 1]] for l in lists])
+            if len(rows) == 0:
+                continue
+            distances = distance_matrix(queries[q:q + 1], embeddings[rows])
+            d, r = _top_k(distances, rows, k)
+            out_distances[q], out_rows[q] = d[0], r[0]
+        return out_distances, out_rows
+
+
+def _top_k(distances: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    n_queries, n = distances.shape
+    out_distances = np.full((n_queries, k), np.inf, dtype=np.float32)
+    out_rows = np.full((n_queries, k), -1, dtype=np.int64)
+    kk = min(k, n)
+    if kk == 0:
+        return out_distances, out_rows
+    part = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+    part_distances = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_distances, axis=1)
+    out_distances[:, :kk] = np.take_along_axis(part_distances, order, axis=1)
+    out_rows[:, :kk] = rows[np.take_along_axis(part, order, axis=1)]
+    return out_distances, out_rows
+
+
+def make_backend(name: Optional[str] = None):
+    """
+    Builds the backend named by `name` or the ROSTER_SEARCH_BACKEND env var
+    ("exact" or "ivf"; IVF is tuned with IVF_NLIST / IVF_NPROBE).
+    """
+    name = (name or os.environ.get("ROSTER_SEARCH_BACKEND", "exact")).lower()
+    if name == "exact":
+        return ExactSearch()
+    if name == "ivf":
+        nlist = os.environ.get("IVF_NLIST")
+        return IVFSearch(
+            nlist=int(nlist) if nlist else None,
+            nprobe=int(os.environ.get("IVF_NPROBE", "8")),
+        )
+    raise ValueError(f"Unknown roster search backend: {name}")
@@ -0,0 +1,103 @@
+import datetime
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# API tests run inference in-process and never load BLIP
+os.environ.setdefault("INFERENCE_WORKERS", "0")
+os.environ.setdefault("CAPTIONING_ENABLED", "false")
+os.environ.setdefault("CAPTION_WARMUP", "false")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs the test in an empty backend directory: the database, roster store
+    and uploads all live at paths relative to the working directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    for directory in ("static/roster", "static/uploads"):
+        os.makedirs(directory)
+    return tmp_path
+
+
+@pytest.fixture
+def api(workdir, monkeypatch):
+    """TestClient for the app, on a fresh database and roster store."""
+    pytest.importorskip("face_recognition")
+    from fastapi.testclient import TestClient
+    from sqlmodel import SQLModel
+    import database
+    import main
+    import models
+
+    # Recent SQLModel releases reject naive datetimes on write
+    monkeypatch.setattr(models.AttendanceSession.model_fields["created_at"], "default_factory",
+                        lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    # The engine resolved database.db when it was first imported, so start
+    # each test from empty tables rather than an empty file
+    database.engine.dispose()
+    SQLModel.metadata.drop_all(database.engine)
+    with TestClient(main.app) as client:
+        yield client
+    database.engine.dispose()
+
+
+class FakeFaces:
+    """
+    Face engine stand-in: every enrollment photo and classroom photo holds the
+    embeddings registered for it here, so tests pick exactly what is seen.
+    """
+
+    def __init__(self):
+        self.photos = {}
+        self.fail_next_encode = False
+
+    def enroll(self, api, name, encoding):
+        self.photos[f"{name}.jpg"] = [encoding]
+        response = api.post("/students/", data={"name": name, "student_id": name},
+                            files={"file": (f"{name}.jpg", b"photo", "image/jpeg")})
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    def classroom(self, number, encodings):
+        """Upload form for classroom photo `number` showing these faces."""
+        self.photos[f"class{number}.png"] = list(encodings)
+        pixels = np.zeros((4, 4, 3), dtype=np.uint8)
+        pixels[0, 0] = (len(encodings), number, 0)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "PNG")
+        return {"file": (f"class{number}.png", buffer.getvalue(), "image/png")}
+
+    async def encode_face(self, image_path):
+        # Extra photos are saved as <roll number>_<filename>
+        return self.photos[os.path.basename(image_path).split("_")[-1]][0]
+
+    def detect_faces(self, image, mode=None, *args):
+        return [(0, i + 1, 1, i) for i in range(int(image[0, 0, 0]))]
+
+    def face_encodings(self, image, known_face_locations=None, *args, **kwargs):
+        if self.fail_next_encode:
+            self.fail_next_encode = False
+            raise RuntimeError("transient failure")
+        return list(self.photos[f"class{int(image[0, 0, 1])}.png"])
+
+
+@pytest.fixture
+def faces(api, monkeypatch):
+    import ai_engine
+    import main
+
+    fake = FakeFaces()
+    monkeypatch.setattr(main.inference, "encode_face", fake.encode_face)
+    monkeypatch.setattr(ai_engine, "detect_faces", fake.detect_faces)
+    monkeypatch.setattr(ai_engine.face_recognition, "face_encodings", fake.face_encodings)
+    return fake
@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def test_failed_recognition_is_not_cached(api, faces):
+    rng = np.random.default_rng(1)
+    alice, bob = rng.normal(scale=0.12, size=(2, 128))
+    alice_id = faces.enroll(api, "alice", alice)
+    faces.enroll(api, "bob", bob)
+    photo = faces.classroom(1, [alice])
+
+    faces.fail_next_encode = True
+    failed = api.post("/attendance/mark", files=photo).json()
+    assert failed["present_count"] == 0
+
+    retried = api.post("/attendance/mark", files=photo).json()
+    assert "faces" not in retried["cache_hits"]
+    assert retried["present_count"] == 1
+    assert [r["student_id"] for r in retried["records"] if r["status"] == "PRESENT"] == [alice_id]
+
+    # Successful results are cached as before
+    assert "faces" in api.post("/attendance/mark", files=photo).json()["cache_hits"]
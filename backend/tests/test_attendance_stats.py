@@ -0,0 +1,94 @@
+import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine, delete
+
+import attendance_stats
+from models import AttendanceRecord, AttendanceSession, Student
+
+TABLES = {
+    "studentattendancestats": "student_id",
+    "sessionattendancestats": "session_id",
+    "dailyattendancestats": "day",
+}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def summaries(db):
+    return {table: db.execute(text(f"SELECT * FROM {table} ORDER BY {key}")).all() for table, key in TABLES.items()}
+
+
+def add_students(db, n):
+    students = [Student(name=f"s{i}", student_id=f"r{i}") for i in range(n)]
+    db.add_all(students)
+    db.commit()
+    return [student.id for student in students]
+
+
+def add_session(db, created_at, statuses):
+    """Writes a session and its records the way an upload does. Returns {student id: record}."""
+    session = AttendanceSession(created_at=created_at, classroom_image_path="x.jpg")
+    db.add(session)
+    db.flush()
+    records = {student_id: AttendanceRecord(session_id=session.id, student_id=student_id, status=status)
+               for student_id, status in statuses.items()}
+    db.add_all(records.values())
+    db.flush()
+    attendance_stats.record_session(db, session.id)
+    db.commit()
+    return records
+
+
+def correct(db, record, status):
+    old_status = record.status
+    record.status = status
+    db.add(record)
+    attendance_stats.correct_record(db, record.student_id, record.session_id, old_status, status)
+    db.commit()
+
+
+def assert_matches_rebuild(db):
+    incremental = summaries(db)
+    attendance_stats.rebuild(db)
+    assert summaries(db) == incremental
+
+
+def test_incremental_summaries_match_a_rebuild(db):
+    a, b, c = add_students(db, 3)
+    # Recent SQLModel releases reject naive datetimes on write
+    monday = datetime.datetime(2024, 3, 4, 9, 0, tzinfo=datetime.timezone.utc)
+    first = add_session(db, monday, {a: "PRESENT", b: "ABSENT", c: "PRESENT"})
+    add_session(db, monday.replace(hour=14), {a: "ABSENT", b: "PRESENT", c: "PRESENT"})
+    last = add_session(db, monday + datetime.timedelta(days=1), {a: "PRESENT", b: "ABSENT", c: "ABSENT"})
+    assert_matches_rebuild(db)
+
+    stats = attendance_stats.student_stats(db, a)
+    assert (stats["present_count"], stats["total_count"]) == (2, 3)
+    assert stats["last_seen_at"] == monday + datetime.timedelta(days=1)
+
+    # Corrections move last_seen_at both ways
+    correct(db, last[a], "ABSENT")
+    assert attendance_stats.student_stats(db, a)["last_seen_at"] == monday
+    correct(db, first[b], "PRESENT")
+    correct(db, first[b], "PRESENT")  # no-op
+    assert_matches_rebuild(db)
+
+    attendance_stats.remove_student(db, c)
+    db.execute(delete(AttendanceRecord).where(AttendanceRecord.student_id == c))
+    db.execute(delete(Student).where(Student.id == c))
+    db.commit()
+    assert attendance_stats.student_stats(db, c) is None
+    assert_matches_rebuild(db)
+
+    session_stats = attendance_stats.session_stats(db, first[a].session_id)
+    assert (session_stats["present_count"], session_stats["total_count"]) == (2, 2)
+    monday_stats = attendance_stats.bucketed_stats(db)[0]
+    assert (monday_stats["session_count"], monday_stats["present_count"], monday_stats["total_count"]) == (2, 3, 4)
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("face_recognition")
+
+import ai_engine
+from caption_batcher import CaptionBatcher
+
+
+class FakeInference:
+    workers = 1
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.batches = []
+
+    async def caption_batch(self, images):
+        self.batches.append(list(images))
+        await asyncio.sleep(self.seconds)
+        return [f"caption {image}" for image in images]
+
+
+@pytest.fixture
+def captioning_on(monkeypatch):
+    monkeypatch.setattr(ai_engine, "CAPTIONING_ENABLED", True)
+
+
+def test_lone_request_skips_batch_window(captioning_on):
+    async def run():
+        batcher = CaptionBatcher(FakeInference(seconds=0), max_batch=8, max_wait_ms=500)
+        start = time.perf_counter()
+        caption = await batcher.caption("a")
+        elapsed = time.perf_counter() - start
+        batcher.shutdown()
+        return caption, elapsed
+
+    caption, elapsed = asyncio.run(run())
+    assert caption == "caption a"
+    assert elapsed < 0.25
+
+
+def test_requests_arriving_while_busy_are_batched(captioning_on):
+    async def run():
+        inference = FakeInference(seconds=0.1)
+        batcher = CaptionBatcher(inference, max_batch=8, max_wait_ms=50)
+        first = asyncio.create_task(batcher.caption("a"))
+        await asyncio.sleep(0.01)
+        rest = [asyncio.create_task(batcher.caption(name)) for name in "bcd"]
+        captions = await asyncio.gather(first, *rest)
+        batcher.shutdown()
+        return inference.batches, captions
+
+    batches, captions = asyncio.run(run())
+    assert batches == [["a"], ["b", "c", "d"]]
+    assert captions == [f"caption {name}" for name in "abcd"]
+
+
+def test_disabled_captioning_returns_placeholder_without_queueing(monkeypatch):
+    monkeypatch.setattr(ai_engine, "CAPTIONING_ENABLED", False)
+    inference = FakeInference()
+    batcher = CaptionBatcher(inference)
+    assert asyncio.run(batcher.caption("a")) == ai_engine.CAPTION_DISABLED
+    assert inference.batches == []
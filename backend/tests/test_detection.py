@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("face_recognition")
+
+import ai_engine
+
+
+@pytest.mark.parametrize("shape, expected", [
+    ((480, 640, 3), 1.0),          # low-res: detect at full size
+    ((1080, 1920, 3), 1024 / 1920),  # long side kept at ADAPTIVE_MIN_SIDE
+    ((3000, 4000, 3), 50 / 120),     # large photo: face-size bound
+])
+def test_adaptive_scale_depends_on_image_size(monkeypatch, shape, expected):
+    monkeypatch.setattr(ai_engine, "ADAPTIVE_MIN_SIDE", 1024)
+    assert ai_engine.detection_scale(shape, expected_face_px=120) == pytest.approx(expected)
+
+
+def test_adaptive_scale_skips_marginal_downscale():
+    assert ai_engine.detection_scale((3000, 4000, 3), expected_face_px=55) == 1.0
+
+
+def test_tiled_retries_only_where_there_is_evidence_of_small_faces():
+    import numpy as np
+
+    image = np.zeros((2048, 2048, 3), dtype=np.uint8)
+    jobs = ai_engine.tiled_detection_plan(image.shape, tile_size=1024, overlap=200)
+    tiles = jobs[1:]
+    assert len(tiles) == 9
+
+    # One small face in the top-left tile, nothing anywhere else
+    per_job = [[] for _ in jobs]
+    per_job[1] = [(100, 140, 140, 100)]
+    retries = ai_engine.tiled_retry_plan(image, jobs, per_job)
+    assert all(job[5] == 2 for job in retries)
+    assert sorted(job[:2] for job in retries) == [(0, 0), (0, 824), (824, 0), (824, 824)]
+
+    # Only large faces: no retries at all
+    per_job[1] = [(100, 300, 300, 100)]
+    assert ai_engine.tiled_retry_plan(image, jobs, per_job) == []
+
+
+def test_tiled_blind_retries_are_capped(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(ai_engine, "TILE_BLIND_RETRIES", 2)
+    image = np.zeros((2048, 2048, 3), dtype=np.uint8)
+    # The bottom-right tile has the most detail
+    image[1700:, 1700:] = np.random.default_rng(0).integers(0, 255, (348, 348, 3))
+    jobs = ai_engine.tiled_detection_plan(image.shape, tile_size=1024, overlap=200)
+    retries = ai_engine.tiled_retry_plan(image, jobs, [[] for _ in jobs])
+    assert len(retries) == 2
+    assert retries[0][:2] == (1648, 1648)
@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+from sqlmodel import SQLModel, create_engine
+
+pytest.importorskip("face_recognition")
+
+
+@pytest.fixture
+def ingest(workdir, monkeypatch):
+    """ingest_data on its own database (imported late, like main in the api fixture)."""
+    import ingest_data
+
+    engine = create_engine(f"sqlite:///{workdir / 'ingest.db'}")
+    monkeypatch.setattr(ingest_data, "engine", engine)
+    monkeypatch.setattr(ingest_data, "create_db_and_tables", lambda: SQLModel.metadata.create_all(engine))
+    return ingest_data
+
+
+def test_unreadable_photos_are_errors_and_retried_on_resume(ingest, workdir):
+    roster_dir = workdir / "static" / "roster"
+    Image.fromarray(np.full((80, 80, 3), 128, dtype=np.uint8)).save(roster_dir / "Alice_1.jpg")
+    (roster_dir / "Bob_2.jpg").write_bytes(b"not a jpeg")
+    manifest = str(roster_dir / "manifest.jsonl")
+
+    counts = ingest.ingest_roster(str(roster_dir), workers=1, manifest_path=manifest)
+    assert (counts[ingest.REGISTERED], counts[ingest.NO_FACE], counts[ingest.ERROR]) == (1, 0, 1)
+    with open(manifest) as f:
+        statuses = {entry["student_id"]: entry["status"] for entry in map(json.loads, f)}
+    assert statuses == {"1": ingest.REGISTERED, "2": ingest.ERROR}
+
+    # Alice is done; Bob's error is tried again rather than skipped
+    counts = ingest.ingest_roster(str(roster_dir), workers=1, manifest_path=manifest)
+    assert counts["existing"] == 1
+    assert counts[ingest.ERROR] == 1
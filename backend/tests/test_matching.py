@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from matching import UNKNOWN, assign, collapse_by_student, distance_matrix, match_faces
+
+
+def pairs(distances, tolerance=0.6):
+    rows, cols = assign(np.asarray(distances, dtype=np.float32), tolerance)
+    return sorted(zip(rows.tolist(), cols.tolist()))
+
+
+def test_duplicate_claims_go_to_the_best_overall_assignment():
+    # Both faces are closest to student 0; greedy would leave face 1 unmatched
+    distances = [[0.30, 0.50],
+                 [0.20, 0.90]]
+    assert pairs(distances) == [(0, 1), (1, 0)]
+
+
+def test_duplicate_claim_without_an_alternative_leaves_one_face_unknown():
+    distances = [[0.40, 0.90],
+                 [0.20, 0.95]]
+    assert pairs(distances) == [(1, 0)]
+
+
+def test_more_matches_beat_a_smaller_total_distance():
+    # (0,0)+(1,1) = 1.15 is worse than (0,1) alone = 0.05, but matches two faces
+    distances = [[0.55, 0.05],
+                 [0.70, 0.60]]
+    assert pairs(distances) == [(0, 0), (1, 1)]
+
+
+@pytest.mark.parametrize("distance, matched", [(0.59, True), (0.60, True), (0.61, False)])
+def test_tolerance_cutoff(distance, matched):
+    assert pairs([[distance]]) == ([(0, 0)] if matched else [])
+
+
+def test_more_faces_than_students():
+    distances = [[0.10, 0.80],
+                 [0.30, 0.70],
+                 [0.90, 0.20],
+                 [0.40, 0.25]]
+    assert pairs(distances) == [(0, 0), (2, 1)]
+
+
+def test_no_feasible_pairs():
+    assert pairs(np.full((3, 2), 0.9)) == []
+
+
+def test_distance_matrix_matches_pairwise_norms():
+    rng = np.random.default_rng(1)
+    faces, roster = rng.normal(size=(3, 128)), rng.normal(size=(5, 128))
+    expected = np.linalg.norm(faces[:, None, :] - roster[None, :, :], axis=2)
+    np.testing.assert_allclose(distance_matrix(faces, roster), expected, rtol=1e-5)
+
+
+def test_collapse_takes_each_students_closest_row():
+    distances = np.array([[0.5, 0.2, 0.9, 0.4],
+                          [0.1, 0.7, 0.3, 0.8]])
+    collapsed, student_ids = collapse_by_student(distances, np.array([7, 7, 3, 7]))
+    assert student_ids.tolist() == [3, 7]
+    np.testing.assert_array_equal(collapsed, [[0.9, 0.2], [0.3, 0.1]])
+
+
+def test_template_students_are_claimed_once():
+    rng = np.random.default_rng(0)
+    alice, bob = rng.normal(scale=0.1, size=(2, 128)).astype(np.float32)
+    # Alice has two rows, and both faces are nearest to one of them
+    roster = np.stack([alice, alice + 0.01, bob])
+    faces = np.stack([alice + 0.005, alice + 0.02])
+    student_ids, distances = match_faces(faces, np.array([1, 1, 2]), roster)
+    # Bob is out of tolerance, so the closer face gets Alice and the other is unknown
+    assert student_ids.tolist() == [1, UNKNOWN]
+    assert np.isinf(distances[1])
+
+
+def test_without_one_to_one_every_face_takes_its_nearest_student():
+    rng = np.random.default_rng(0)
+    alice, bob = rng.normal(scale=0.1, size=(2, 128)).astype(np.float32)
+    # Several encodings of one video track are all the same person
+    faces = np.stack([alice + 0.005, alice + 0.02, bob + 0.5])
+    student_ids, distances = match_faces(faces, np.array([1, 1, 2]), np.stack([alice, alice + 0.01, bob]),
+                                         one_to_one=False)
+    assert student_ids.tolist() == [1, 1, UNKNOWN]
+    assert np.isfinite(distances[:2]).all() and np.isinf(distances[2])
+
+
+class NoCandidates:
+    """Search backend whose probed lists all came back empty."""
+
+    def candidate_rows(self, queries, embeddings, k):
+        return np.empty(0, dtype=np.intp)
+
+
+@pytest.mark.parametrize("one_to_one", [True, False])
+def test_no_candidates_leaves_every_face_unknown(one_to_one):
+    roster = np.random.default_rng(0).normal(size=(3, 128)).astype(np.float32)
+    student_ids, distances = match_faces(roster[:2], np.array([1, 2, 3]), roster, backend=NoCandidates(),
+                                         one_to_one=one_to_one)
+    assert student_ids.tolist() == [UNKNOWN, UNKNOWN]
+    assert np.isinf(distances).all()
@@ -0,0 +1,74 @@
+import base64
+import datetime
+import json
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+import pagination
+from models import AttendanceSession
+from pagination import InvalidCursor
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def crafted(*key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+@pytest.mark.parametrize("page, cursor", [
+    (pagination.sessions_page, crafted({"a": 1}, 1)),
+    (pagination.sessions_page, crafted("2024-01-01T00:00:00", [1])),
+    (pagination.sessions_page, crafted(1, 1)),
+    (pagination.sessions_page, crafted("not a date", 1)),
+    (pagination.sessions_page, crafted("2024-01-01T00:00:00", "1")),
+    (pagination.students_page, crafted({"a": 1})),
+    (pagination.students_page, crafted([1])),
+    (pagination.students_page, crafted(1.5)),
+    (pagination.students_page, crafted(True)),
+    (pagination.courses_page, crafted(None)),
+    (pagination.student_stats_page, crafted("1")),
+    (pagination.students_page, "not base64!"),
+])
+def test_tampered_cursors_are_rejected(db, page, cursor):
+    with pytest.raises(InvalidCursor):
+        page(db, cursor=cursor)
+
+
+def test_sessions_page_across_equal_timestamps(db):
+    # Recent SQLModel releases reject naive datetimes on write
+    noon = datetime.datetime(2024, 3, 4, 12, 0, tzinfo=datetime.timezone.utc)
+    # Bulk imports stamp many sessions with the same time; pages split inside the run
+    times = [noon - datetime.timedelta(hours=1)] * 2 + [noon] * 5 + [noon + datetime.timedelta(hours=1)]
+    db.add_all(AttendanceSession(created_at=t, classroom_image_path=f"{i}.jpg") for i, t in enumerate(times))
+    db.commit()
+
+    seen, cursor = [], None
+    while True:
+        items, cursor = pagination.sessions_page(db, limit=3, cursor=cursor)
+        assert len(items) <= 3
+        seen += [item["id"] for item in items]
+        if cursor is None:
+            break
+    # Newest first, ties by id descending: every session exactly once
+    expected = sorted(range(1, len(times) + 1), key=lambda i: (times[i - 1], i), reverse=True)
+    assert seen == expected
+
+
+def test_sessions_page_cursor_respects_the_date_range(db):
+    noon = datetime.datetime(2024, 3, 4, 12, 0, tzinfo=datetime.timezone.utc)
+    db.add_all(AttendanceSession(created_at=noon + datetime.timedelta(days=d), classroom_image_path="x.jpg")
+               for d in range(6))
+    db.commit()
+    since, until = noon + datetime.timedelta(days=1), noon + datetime.timedelta(days=5)
+
+    first, cursor = pagination.sessions_page(db, limit=2, since=since, until=until)
+    rest, last_cursor = pagination.sessions_page(db, limit=2, cursor=cursor, since=since, until=until)
+    assert [item["id"] for item in first + rest] == [5, 4, 3, 2]
+    assert last_cursor is None
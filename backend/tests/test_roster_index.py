@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+
+import roster_index
+from roster_index import RosterIndex
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, 128)).astype(np.float32)
+
+
+def rows_by_student(index):
+    rows = {}
+    for student_id, embedding in zip(index.ids.tolist(), index.embeddings):
+        rows.setdefault(student_id, []).append(embedding)
+    return {student_id: np.stack(embeddings) for student_id, embeddings in rows.items()}
+
+
+def assert_same_roster(a, b):
+    left, right = rows_by_student(a), rows_by_student(b)
+    assert left.keys() == right.keys()
+    for student_id in left:
+        np.testing.assert_array_equal(left[student_id], right[student_id])
+
+
+def test_replayed_changes_reproduce_the_index():
+    data = vectors(8)
+    api, worker = RosterIndex(), RosterIndex()
+    for index in (api, worker):
+        index.rebuild(np.arange(1, 5), data[:4])
+    synced = api.version
+
+    api.add(5, data[4])
+    api.add(2, data[5:7])  # template grows
+    api.remove(1)
+    api.add(6, data[7])
+
+    changes = api.changes_since(synced)
+    assert [change.version for change in changes] == list(range(synced + 1, api.version + 1))
+    worker.apply_changes(changes)
+    assert_same_roster(api, worker)
+    worker.verify()
+
+
+def test_changes_since_is_none_once_the_log_no_longer_reaches_back(monkeypatch):
+    monkeypatch.setattr(roster_index, "CHANGE_LOG_SIZE", 3)
+    data = vectors(6)
+    index = RosterIndex()
+    index.rebuild(np.arange(1, 3), data[:2])
+    rebuilt = index.version
+    assert index.changes_since(rebuilt) == []
+    assert index.changes_since(rebuilt - 1) is None
+
+    for student_id in range(3, 7):
+        index.add(student_id, data[student_id - 1])
+    assert index.changes_since(rebuilt) is None
+    assert len(index.changes_since(index.change_log_base)) == 3
+
+    index.rebuild(index.ids.copy(), index.embeddings.copy())
+    assert index.changes_since(index.version - 1) is None
+
+
+def sorted_rows(rows):
+    return rows[np.lexsort(rows.T[::-1])]
+
+
+def assert_matches_model(index, model):
+    """The index holds exactly `model` ({student id: (k, dim) rows}) and passes verify()."""
+    index.verify()
+    assert len(index) == len(model)
+    assert index.row_count == sum(len(rows) for rows in model.values())
+    actual = rows_by_student(index)
+    assert actual.keys() == model.keys()
+    for student_id, rows in model.items():
+        # Swap-remove reorders the rows, not what they hold
+        np.testing.assert_array_equal(sorted_rows(actual[student_id]), sorted_rows(rows))
+        ids, embeddings = index.subset([student_id])
+        assert set(ids.tolist()) == {student_id}
+        np.testing.assert_array_equal(sorted_rows(embeddings), sorted_rows(rows))
+
+
+def test_swap_remove_fills_holes_from_the_end():
+    data = vectors(7)
+    ids = np.array([1, 1, 2, 3, 3, 3, 4])
+    # Read-only, like the memmapped store: the index must copy before writing
+    data.flags.writeable = False
+    index = RosterIndex()
+    index.rebuild(ids, data)
+    model = {1: data[0:2], 2: data[2:3], 3: data[3:6], 4: data[6:7]}
+    assert_matches_model(index, model)
+
+    # Both holes are refilled from rows that belong to other students
+    index.remove(1)
+    del model[1]
+    assert_matches_model(index, model)
+
+    # The last row's owner
+    index.remove(4)
+    del model[4]
+    assert_matches_model(index, model)
+
+    assert not index.remove(4)
+    np.testing.assert_array_equal(data, vectors(7))
+
+
+def test_replace_keeps_other_students_rows():
+    data = vectors(10)
+    index = RosterIndex()
+    index.rebuild(np.array([1, 2, 2, 3]), data[:4])
+    model = {1: data[0:1], 2: data[1:3], 3: data[3:4]}
+
+    # Same template size: rewritten in place
+    index.replace(2, data[4:6])
+    model[2] = data[4:6]
+    assert_matches_model(index, model)
+
+    # Template shrinks and grows: old rows dropped, new ones appended
+    for student_id, rows in ((2, data[6:7]), (1, data[7:10])):
+        index.add(student_id, rows)
+        model[student_id] = rows
+        assert_matches_model(index, model)
+
+
+def test_random_changes_keep_the_row_map_consistent():
+    rng = np.random.default_rng(3)
+    index = RosterIndex()
+    index.rebuild(np.empty(0, dtype=np.int64), np.empty((0, 128), dtype=np.float32))
+    model = {}
+    for step in range(300):
+        student_id = int(rng.integers(1, 25))
+        if student_id in model and rng.random() < 0.4:
+            assert index.remove(student_id)
+            del model[student_id]
+        else:
+            rows = vectors(int(rng.integers(1, 4)), seed=step)
+            index.add(student_id, rows)
+            model[student_id] = rows
+        assert_matches_model(index, model)
+
+
+def test_verify_detects_a_broken_row_map():
+    index = RosterIndex()
+    index.rebuild(np.array([1, 2, 3]), vectors(3))
+    index.remove(1)
+    index._ids[0] = 99
+    with pytest.raises(roster_index.RosterCorruptionError):
+        index.verify()
+
+
+@pytest.mark.parametrize("rows_of", [
+    {1: [0], 2: [0], 3: [2]},     # row claimed twice, row 1 by nobody
+    {1: [0], 2: [1], 3: [5]},     # past the end
+    {1: [0], 2: [1]},             # row 2 unmapped
+])
+def test_verify_detects_a_bad_row_map(rows_of):
+    index = RosterIndex()
+    index.rebuild(np.array([1, 2, 3]), vectors(3))
+    index._rows_of = rows_of
+    with pytest.raises(roster_index.RosterCorruptionError):
+        index.verify()
+
@@ -0,0 +1,37 @@
+import multiprocessing
+
+import numpy as np
+
+import roster_store
+
+
+def _append_rows(student_ids, started):
+    started.set()
+    for student_id in student_ids:
+        roster_store.append_embedding(student_id, np.full(128, student_id, dtype=np.float32))
+
+
+def test_rewrites_keep_appends_from_other_processes(workdir):
+    # Another process (ingest) appends while this one keeps purging and rewriting
+    appended = list(range(1, 301))
+    context = multiprocessing.get_context("spawn")
+    started = context.Event()
+    child = context.Process(target=_append_rows, args=(appended, started))
+    child.start()
+    started.wait(30)
+    while child.is_alive():
+        roster_store.append_embedding(999, np.zeros(128))
+        roster_store.purge_ids([999])
+    child.join()
+    assert child.exitcode == 0
+
+    ids, embeddings = roster_store.load_store()
+    assert sorted(ids.tolist()) == appended
+    np.testing.assert_array_equal(embeddings[:, 0], ids)
+
+
+def test_lock_is_reentrant(workdir):
+    with roster_store.locked():
+        with roster_store.locked():
+            roster_store.append_embedding(1, np.zeros(128))
+        assert roster_store.compact_store([1])[0].tolist() == [1]
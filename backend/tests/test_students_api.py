@@ -0,0 +1,37 @@
+import numpy as np
+
+
+def test_deleted_student_samples_not_inherited_by_reused_id(api, faces):
+    rng = np.random.default_rng(0)
+    alice, bob, carol = rng.normal(scale=0.12, size=(3, 128))
+    bob_sample = bob + rng.normal(scale=0.02, size=128)
+
+    faces.enroll(api, "alice", alice)
+    bob_id = faces.enroll(api, "bob", bob)
+    faces.photos["bob2.jpg"] = [bob_sample]
+    assert api.post(f"/students/{bob_id}/photos", files={"file": ("bob2.jpg", b"photo", "image/jpeg")}).status_code == 200
+    assert api.delete(f"/students/{bob_id}").status_code == 200
+
+    # SQLite hands the deleted max ID to the next student
+    carol_id = faces.enroll(api, "carol", carol)
+    assert carol_id == bob_id
+    assert api.post("/roster/reload").status_code == 200
+
+    result = api.post("/attendance/mark", files=faces.classroom(1, [bob_sample])).json()
+    assert result["present_count"] == 0
+    assert result["unknown_faces_count"] == 1
+    statuses = {record["student_id"]: record["status"] for record in result["records"]}
+    assert statuses[carol_id] == "ABSENT"
+
+
+def test_reload_rejects_a_corrupt_store(api, faces):
+    import roster_store
+
+    alice_id = faces.enroll(api, "alice", np.full(128, 0.05))
+    assert api.post("/roster/reload").status_code == 200
+
+    # Newest row wins, so the damaged one is what a rebuild picks up
+    roster_store.append_embedding(alice_id, np.full(128, np.nan))
+    response = api.post("/roster/reload")
+    assert response.status_code == 500
+    assert "corrupt" in response.json()["detail"]
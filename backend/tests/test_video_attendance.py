@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("face_recognition")
+
+import ai_engine
+import video_attendance
+from roster_index import RosterIndex
+
+
+class StillReader:
+    """A still shot of `faces` (one encoding each), `frame_count` frames long."""
+
+    def __init__(self, frame_count, fps=25.0, reported_frame_count=None):
+        self.fps = fps
+        self.frame_count = frame_count if reported_frame_count is None else reported_frame_count
+        self._frames = frame_count
+        self.last_read = None
+
+    def read(self, index):
+        if index >= self._frames:
+            return None
+        self.last_read = index
+        return np.zeros((36, 64, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def scene(monkeypatch):
+    """Roster of students 1 and 2; returns the list of encodings every frame shows."""
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(scale=0.05, size=(2, 128)).astype(np.float32)
+    roster = RosterIndex()
+    roster.rebuild(np.array([1, 2]), embeddings)
+    monkeypatch.setattr(ai_engine, "roster", roster)
+
+    shown = []
+    monkeypatch.setattr(ai_engine, "detect_faces",
+                        lambda frame, mode=None: [(10, 20 * i + 15, 25, 20 * i) for i in range(len(shown))])
+    monkeypatch.setattr(ai_engine.face_recognition, "face_encodings",
+                        lambda frame, boxes: [shown[box[3] // 20] for box in boxes])
+    return embeddings, shown
+
+
+def test_duration_is_the_video_length(scene):
+    # The last sampled frame comes before the end of the video
+    result = video_attendance.process_video(StillReader(250))
+    assert result.duration_s == pytest.approx(10.0)
+
+
+def test_duration_without_a_frame_count_falls_back_to_the_last_sample(scene):
+    result = video_attendance.process_video(StillReader(250, reported_frame_count=0))
+    assert 0 < result.duration_s < 10.0
+
+
+def test_duration_is_capped_at_the_seconds_processed(scene):
+    reader = StillReader(25 * 60)
+    result = video_attendance.process_video(reader, max_seconds=5)
+    assert result.duration_s == 5
+    # No frame from past the window is sampled
+    assert reader.last_read / reader.fps < 5
+
+
+def test_tracks_are_matched_within_the_course_first(scene):
+    embeddings, shown = scene
+    # Closer to student 2, but close enough to student 1, who is in the course
+    between = embeddings[1] + 0.4 * (embeddings[0] - embeddings[1])
+    shown.extend([between, embeddings[1] + 0.01])
+
+    whole_roster = video_attendance.process_video(StillReader(100))
+    assert whole_roster.recognized_ids == [2]
+
+    scoped = video_attendance.process_video(StillReader(100), scope=(1,))
+    assert scoped.recognized_ids == [1]
+    # The other face is only found by the fallback lookup
+    assert scoped.unenrolled_ids == [2]
+    assert scoped.unknown_count == 0
@@ -0,0 +1,310 @@
+"""
+Attendance from a short classroom video.
+
+A single photo misses whoever is hidden at that instant; a few seconds of
+video catch them. Decoding and encoding every frame would be far too slow on
+CPU, so:
+
+- Frames are sampled adaptively: faster (up to VIDEO_MAX_SAMPLE_FPS) while
+  the scene moves or faces appear and disappear, slower when it is still.
+  The sampler also watches the clock: if processing falls behind
+  VIDEO_REALTIME_FACTOR x the video time covered so far, it backs off. Skipped
+  frames are only grabbed, never decoded.
+- Faces are tracked across sampled frames by box overlap (IoU, one-to-one),
+  and each track is encoded only a few times (ENCODINGS_PER_TRACK), not on
+  every frame it appears in.
+- Each track's encodings vote on its identity (weighted by how far inside
+  the tolerance they are); a track is identified only by a majority of its
+  own encodings. Encodings are matched like photo faces (search backend,
+  course scope and fallback, see ai_engine.match_encoding_ids), except that
+  one track's encodings may all pick the same student. Present students are
+  the identified tracks; unknown faces are the unidentified tracks that
+  lasted more than one sample.
+"""
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from scipy.optimize import linear_sum_assignment
+
+import ai_engine
+from matching import DEFAULT_TOLERANCE, UNKNOWN
+
+VIDEO_SAMPLE_FPS = float(os.environ.get("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_MIN_SAMPLE_FPS = 1.0
+VIDEO_MAX_SAMPLE_FPS = float(os.environ.get("VIDEO_MAX_SAMPLE_FPS", "6"))
+# Target processing time as a fraction of the video's duration
+VIDEO_REALTIME_FACTOR = float(os.environ.get("VIDEO_REALTIME_FACTOR", "0.5"))
+VIDEO_MAX_SECONDS = float(os.environ.get("VIDEO_MAX_SECONDS", "120"))
+
+TRACK_IOU = 0.3
+# Sampled frames a track may go unseen (occlusion, missed detection) before it ends
+TRACK_MAX_MISSES = 3
+ENCODINGS_PER_TRACK = 3
+# Encode a track on its 1st, 3rd, 5th... sighting until it has enough
+ENCODE_EVERY = 2
+
+# Mean absolute difference (0-255) between grayscale thumbnails of consecutive samples
+MOTION_HIGH = 12.0
+MOTION_LOW = 3.0
+
+Box = Tuple[int, int, int, int]
+
+
+class Track:
+    def __init__(self, track_id: int, box: Box, t: float):
+        self.id = track_id
+        self.box = box
+        self.first_t = t
+        self.last_t = t
+        self.hits = 1
+        self.misses = 0
+        self.encodings: List[np.ndarray] = []
+
+
+def iou_matrix(a: List[Box], b: List[Box]) -> np.ndarray:
+    """
+    Intersection over union of every box in a against every box in b,
+    boxes as (top, right, bottom, left).
+    """
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(bottom - top, 0, None) * np.clip(right - left, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 1] - a[:, 3])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 1] - b[:, 3])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+class FaceTracker:
+    """
+    IoU tracker: detections are assigned to live tracks one-to-one by
+    maximum total overlap, unmatched detections start new tracks, and
+    tracks unseen for more than max_misses samples end.
+    """
+
+    def __init__(self, iou_threshold: float = TRACK_IOU, max_misses: int = TRACK_MAX_MISSES):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.active: List[Track] = []
+        self.finished: List[Track] = []
+        self._next_id = 0
+
+    def update(self, boxes: List[Box], t: float) -> Tuple[List[Track], int, int]:
+        """
+        Returns (track for each box, tracks started, tracks ended).
+        """
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        matched = set()
+        if self.active and boxes:
+            overlap = iou_matrix([track.box for track in self.active], boxes)
+            rows, cols = linear_sum_assignment(-overlap)
+            for r, c in zip(rows, cols):
+                if overlap[r, c] >= self.iou_threshold:
+                    track = self.active[r]
+                    track.box, track.last_t = boxes[c], t
+                    track.hits += 1
+                    track.misses = 0
+                    assigned[c] = track
+                    matched.add(r)
+
+        still_active, ended = [], 0
+        for r, track in enumerate(self.active):
+            if r not in matched:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    self.finished.append(track)
+                    ended += 1
+                    continue
+            still_active.append(track)
+        self.active = still_active
+
+        started = 0
+        for c, box in enumerate(boxes):
+            if assigned[c] is None:
+                track = Track(self._next_id, box, t)
+                self._next_id += 1
+                self.active.append(track)
+                assigned[c] = track
+                started += 1
+        return assigned, started, ended
+
+    def all_tracks(self) -> List[Track]:
+        return self.finished + self.active
+
+
+class VideoReader:
+    """
+    Sequential frame access that only decodes the frames asked for.
+    """
+
+    def __init__(self, path: str):
+        import cv2
+        self._cv2 = cv2
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError("Could not open video")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        # From the container header; 0 when the format doesn't say
+        self.frame_count = max(0, int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self._position = 0
+
+    def read(self, index: int) -> Optional[np.ndarray]:
+        # grab() advances without decoding; seeking is unreliable across codecs
+        while self._position < index:
+            if not self.capture.grab():
+                return None
+            self._position += 1
+        ok, frame = self.capture.read()
+        if not ok:
+            return None
+        self._position += 1
+        return self._cv2.cvtColor(frame, self._cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        self.capture.release()
+
+
+class VideoAttendance(NamedTuple):
+    recognized_ids: List[int]
+    unknown_count: int
+    # Identified students outside the course scope (fallback lookup)
+    unenrolled_ids: List[int]
+    # Sampled frame with the most faces, for captioning and the session image
+    keyframe: Optional[np.ndarray]
+    frames_sampled: int
+    # Seconds of video covered: the whole video, or max_seconds of a longer one
+    duration_s: float
+    processing_s: float
+    tracks: List[Dict]
+    roster_version: int
+
+
+def _motion(previous: Optional[np.ndarray], thumbnail: np.ndarray) -> float:
+    if previous is None:
+        return 0.0
+    return float(np.mean(np.abs(thumbnail.astype(np.int16) - previous.astype(np.int16))))
+
+
+def vote_identities(tracks: List[Track], tolerance: float = DEFAULT_TOLERANCE,
+                    scope: Optional[Sequence[int]] = None) -> Tuple[List[Optional[int]], int]:
+    """
+    Identity per track by confidence-weighted majority of its encodings.
+    With `scope`, identities from outside it come from the fallback lookup.
+    Returns (student id or None per track, roster version used).
+    """
+    identities: List[Optional[int]] = [None] * len(tracks)
+    encoded = [i for i, track in enumerate(tracks) if track.encodings]
+    with ai_engine.roster.lock:
+        version = ai_engine.roster.version
+        if not encoded or len(ai_engine.roster) == 0:
+            return identities, version
+        encodings = np.vstack([np.vstack(tracks[i].encodings) for i in encoded])
+        best, best_distance = ai_engine.match_encoding_ids(encodings, scope, tolerance, one_to_one=False)
+
+    start = 0
+    for i in encoded:
+        n = len(tracks[i].encodings)
+        weights: Dict[int, float] = {}
+        votes: Dict[int, int] = {}
+        for student_id, d in zip(best[start:start + n].tolist(), best_distance[start:start + n]):
+            if student_id != UNKNOWN:
+                weights[student_id] = weights.get(student_id, 0.0) + (tolerance - d)
+                votes[student_id] = votes.get(student_id, 0) + 1
+        start += n
+        if weights:
+            winner = max(weights, key=weights.get)
+            if votes[winner] * 2 > n:
+                identities[i] = winner
+    return identities, version
+
+
+def process_video(reader, detection_mode: str = "adaptive",
+                  scope: Optional[Sequence[int]] = None,
+                  realtime_factor: float = VIDEO_REALTIME_FACTOR,
+                  max_seconds: float = VIDEO_MAX_SECONDS) -> VideoAttendance:
+    """
+    Samples, detects, tracks, encodes and votes. `reader` provides `fps`,
+    `frame_count` (0 if unknown) and `read(frame_index)` (see VideoReader).
+    `scope` is a course's enrolled Student IDs, or None for the whole roster.
+    """
+    start = time.perf_counter()
+    tracker = FaceTracker()
+    sample_fps = VIDEO_SAMPLE_FPS
+    index, frames_sampled, t = 0, 0, 0.0
+    previous_thumbnail = None
+    keyframe, keyframe_faces = None, -1
+
+    # Only frames inside the window, so what is sampled matches duration_s
+    while index / reader.fps < max_seconds:
+        frame = reader.read(index)
+        if frame is None:
+            break
+        frames_sampled += 1
+        t = index / reader.fps
+
+        boxes = ai_engine.detect_faces(frame, detection_mode)
+        tracks, started, ended = tracker.update(boxes, t)
+        to_encode = [i for i, track in enumerate(tracks)
+                     if len(track.encodings) < ENCODINGS_PER_TRACK and (track.hits - 1) % ENCODE_EVERY == 0]
+        if to_encode:
+            encodings = ai_engine.face_recognition.face_encodings(frame, [boxes[i] for i in to_encode])
+            for i, encoding in zip(to_encode, encodings):
+                tracks[i].encodings.append(np.asarray(encoding, dtype=np.float32))
+        if len(boxes) > keyframe_faces:
+            keyframe, keyframe_faces = frame, len(boxes)
+
+        # Adapt the sampling rate: faster while things change, slower while
+        # still, and always slower if we are behind the real-time budget
+        thumbnail = np.asarray(Image.fromarray(frame).convert("L").resize((64, 36)))
+        motion = _motion(previous_thumbnail, thumbnail)
+        previous_thumbnail = thumbnail
+        if time.perf_counter() - start > realtime_factor * max(t, 1.0 / sample_fps):
+            sample_fps = max(VIDEO_MIN_SAMPLE_FPS, sample_fps / 2)
+        elif started or ended or motion > MOTION_HIGH:
+            sample_fps = min(VIDEO_MAX_SAMPLE_FPS, sample_fps * 2)
+        elif motion < MOTION_LOW:
+            sample_fps = max(VIDEO_MIN_SAMPLE_FPS, sample_fps / 2)
+        index += max(1, int(round(reader.fps / sample_fps)))
+
+    all_tracks = tracker.all_tracks()
+    identities, version = vote_identities(all_tracks, scope=scope)
+    identified = {student_id for student_id in identities if student_id is not None}
+    enrolled = identified if scope is None else {int(i) for i in scope}
+    present = sorted(identified & enrolled)
+    unenrolled = sorted(identified - enrolled)
+    # Single-sighting tracks with no identity are most likely false detections
+    unknown = sum(1 for track, student_id in zip(all_tracks, identities) if student_id is None and track.hits > 1)
+    summaries = [
+        {"track_id": track.id, "student_id": student_id, "first_seen_s": round(track.first_t, 2),
+         "last_seen_s": round(track.last_t, 2), "sightings": track.hits, "encodings": len(track.encodings)}
+        for track, student_id in zip(all_tracks, identities)
+    ]
+    # t is only the last sampled frame, which can be well short of the end
+    duration = reader.frame_count / reader.fps if reader.frame_count else t
+    return VideoAttendance(
+        recognized_ids=present,
+        unknown_count=unknown,
+        unenrolled_ids=unenrolled,
+        keyframe=keyframe,
+        frames_sampled=frames_sampled,
+        duration_s=min(duration, max_seconds),
+        processing_s=time.perf_counter() - start,
+        tracks=summaries,
+        roster_version=version,
+    )
+
+
+def video_attendance(path: str, detection_mode: str = "adaptive",
+                     scope: Optional[Sequence[int]] = None) -> VideoAttendance:
+    reader = VideoReader(path)
+    try:
+        return process_video(reader, detection_mode, scope)
+    finally:
+        reader.close()
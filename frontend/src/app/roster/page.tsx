@@ -1,6 +1,6 @@
 "use client";
 import React, { useState, useEffect } from 'react';
-import { Student } from '../../types';
+import { Page, Student } from '../../types';
 
 export default function RosterPage() {
     const [name, setName] = useState("");
@@ -16,11 +16,19 @@ export default function RosterPage() {
 
     const fetchStudents = async () => {
         try {
-            const res = await fetch("http://localhost:8000/students/");
-            if (res.ok) {
-                const data = await res.json();
-                setStudents(data);
-            }
+            // The list is paginated; follow next_cursor until the last page
+            const all: Student[] = [];
+            let cursor: string | null = null;
+            do {
+                const params = new URLSearchParams({ limit: "500" });
+                if (cursor) params.set("cursor", cursor);
+                const res = await fetch(`http://localhost:8000/students/?${params}`);
+                if (!res.ok) return;
+                const data: Page<Student> = await res.json();
+                all.push(...data.items);
+                cursor = data.next_cursor;
+            } while (cursor);
+            setStudents(all);
         } catch (err) {
             console.error("Failed to fetch students");
         }
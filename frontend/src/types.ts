@@ -21,3 +21,8 @@ export interface AttendanceSession {
     unknown_faces_count?: number;
     records?: AttendanceRecord[];
 }
+
+export interface Page<T> {
+    items: T[];
+    next_cursor: string | null;
+}